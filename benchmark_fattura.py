@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Benchmark di Fattura Pro - Misure headless della pipeline fatture
+Per ogni misura riporta p50/p99, throughput e picco di memoria; i risultati si possono
+salvare come baseline JSON e confrontare tra versioni per trovare le regressioni
+"""
+
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from fattura_engine import (REPORTLAB_AVAILABLE, crea_template, get_template, render_batch, render_pdf,
+                            tabelle_prodotti)
+from fattura_cache import CachePDF
+from fattura_importi import NUMPY_AVAILABLE, riepiloga_batch, riepiloga_colonne, riepiloga_fattura
+from fattura_io import scrivi_json_atomico
+from fattura_numerazione import IndiceNumerazione
+
+
+# resource (picco di memoria) esiste solo su Unix
+RESOURCE_AVAILABLE = importlib.util.find_spec("resource") is not None
+
+ALIQUOTE = [22.0, 10.0, 4.0, 0.0]
+BASELINE_VERSION = 1
+SOGLIA_REGRESSIONE = 10.0  # % di peggioramento della mediana oltre cui una misura è segnalata
+
+# Misure dell'esecuzione corrente: chiave -> statistiche (vedi registra)
+RISULTATI: Dict[str, Dict] = {}
+
+
+def fattura_sintetica(n_righe: int = 10, i: int = 1) -> Dict:
+    """Crea una fattura di prova con n_righe prodotti"""
+    prodotti = []
+    for r in range(n_righe):
+        quantita = float(1 + r % 5)
+        prezzo = round(10 + (r * 7.3) % 490, 2)
+        iva = ALIQUOTE[r % len(ALIQUOTE)]
+        imponibile = quantita * prezzo
+        iva_importo = imponibile * (iva / 100)
+        prodotti.append({
+            "descrizione": f"Prodotto di prova {r + 1}",
+            "quantita": quantita,
+            "prezzo": prezzo,
+            "iva": iva,
+            "imponibile": imponibile,
+            "iva_importo": iva_importo,
+            "totale": imponibile + iva_importo
+        })
+    return {
+        "azienda": {
+            "ragione_sociale": "Azienda Benchmark Srl", "indirizzo": "Via Roma 1",
+            "citta": "Milano", "cap": "20121", "provincia": "MI", "p_iva": "12345678903",
+            "codice_fiscale": "", "pec": "bench@pec.it", "telefono": "02 1234567",
+            "email": "info@bench.it", "sito_web": "", "rea": "MI-123456", "capitale_sociale": "10000"
+        },
+        "cliente": {
+            "ragione_sociale": f"Cliente {i} Spa", "indirizzo": "Corso Italia 10",
+            "citta": "Torino", "cap": "10121", "provincia": "TO", "p_iva": "01234567897",
+            "codice_fiscale": "", "pec": "", "codice_destinatario": "ABC1234",
+            "telefono": "", "email": ""
+        },
+        "fattura": {
+            "tipo": "Fattura", "numero": f"FAT-2026-{i:04d}", "data": "15/03/2026",
+            "scadenza": "15/04/2026", "condizioni": "Bonifico 30 gg", "causale": "", "note": ""
+        },
+        "banca": {"iban": "IT60X0542811101000000123456", "nome": "Banca di Prova"},
+        "prodotti": prodotti
+    }
+
+
+def misura(funzione: Callable, ripetizioni: int) -> List[float]:
+    """Tempi in secondi di ripetizioni chiamate a funzione"""
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - inizio)
+    return tempi
+
+
+def percentile(tempi: List[float], p: float) -> float:
+    """Percentile p (0-100) con il metodo nearest-rank"""
+    ordinati = sorted(tempi)
+    return ordinati[max(0, math.ceil(p / 100 * len(ordinati)) - 1)]
+
+
+def picco_rss_mb() -> Optional[float]:
+    """Picco di memoria residente del processo finora, in MB (None senza resource)"""
+    if not RESOURCE_AVAILABLE:
+        return None
+    import resource
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KB, macOS byte
+    return picco / (1024 * 1024) if sys.platform == "darwin" else picco / 1024
+
+
+def registra(chiave: str, tempi: List[float], elementi: int = 1, unita: str = "op") -> Dict:
+    """Salva le statistiche di una misura in RISULTATI; elementi = unità elaborate per chiamata"""
+    p50 = statistics.median(tempi)
+    misura = {
+        "n": len(tempi),
+        "media_ms": statistics.mean(tempi) * 1000,
+        "p50_ms": p50 * 1000,
+        "p99_ms": percentile(tempi, 99) * 1000,
+        "throughput": elementi / p50 if p50 > 0 else 0.0,
+        "unita": unita,
+        "picco_rss_mb": picco_rss_mb(),
+    }
+    RISULTATI[chiave] = misura
+    return misura
+
+
+def stampa_tempi(chiave: str, nome: str, tempi: List[float], elementi: int = 1, unita: str = "op"):
+    """Registra una serie di tempi e stampa p50, p99 e throughput"""
+    m = registra(chiave, tempi, elementi, unita)
+    print(f"  {nome:<40} p50 {m['p50_ms']:9.2f} ms   p99 {m['p99_ms']:9.2f} ms   "
+          f"{m['throughput']:10.1f} {unita}/s")
+
+
+def bench_template(ripetizioni: int):
+    """Costo del setup degli stili: template condiviso contro template ricostruito"""
+    data = fattura_sintetica(5)
+    get_template()
+    render_pdf(data)  # riscaldamento: font e moduli reportlab
+    
+    setup = misura(crea_template, ripetizioni)
+    # Misure alternate, così GC e riscaldamento pesano allo stesso modo sulle due varianti
+    nuovo, condiviso = [], []
+    for _ in range(ripetizioni):
+        nuovo += misura(lambda: render_pdf(data, crea_template()), 1)
+        condiviso += misura(lambda: render_pdf(data), 1)
+    
+    print(f"Template ({ripetizioni} fatture da 5 righe)")
+    stampa_tempi("template.costruzione", "solo costruzione template", setup)
+    stampa_tempi("template.render_nuovo", "render con template ricostruito", nuovo, unita="fatture")
+    stampa_tempi("template.render_condiviso", "render con template condiviso", condiviso, unita="fatture")
+    risparmio = statistics.median(nuovo) - statistics.median(condiviso)
+    print(f"  risparmio per fattura (mediana): {risparmio * 1000:.2f} ms "
+          f"({risparmio / statistics.median(nuovo) * 100:.1f}%)")
+
+
+def bench_prodotti(ripetizioni: int):
+    """Tabella prodotti e PDF completo (render e scrittura su file, come create_pdf_professionale)
+    a 1, 100 e 10.000 righe"""
+    template = get_template()
+    render_pdf(fattura_sintetica(1))  # riscaldamento
+    print("Tabella prodotti e PDF")
+    with tempfile.TemporaryDirectory() as cartella:
+        destinazione = Path(cartella) / "fattura.pdf"
+        
+        def crea_pdf(data):
+            with open(destinazione, 'wb') as f:
+                f.write(render_pdf(data))
+        
+        for n_righe in (1, 100, 10000):
+            data = fattura_sintetica(n_righe)
+            # Le fatture grandi costano molto: si riducono le ripetizioni in proporzione
+            volte = max(3, min(ripetizioni, 100000 // (n_righe * 10)))
+            tabelle = misura(lambda: tabelle_prodotti(data["prodotti"], template), volte)
+            pdf = misura(lambda: crea_pdf(data), max(3, volte // 5))
+            stampa_tempi(f"prodotti.tabelle_{n_righe}", f"tabelle, {n_righe} righe", tabelle, n_righe, "righe")
+            stampa_tempi(f"prodotti.pdf_{n_righe}", f"PDF su file, {n_righe} righe", pdf, n_righe, "righe")
+
+
+def bench_importi(ripetizioni: int):
+    """Totali di una fattura e totali per aliquota su 100.000 righe: Decimal/centesimi contro colonne NumPy"""
+    fatture = [fattura_sintetica(20, i) for i in range(5000)]
+    volte = max(3, ripetizioni // 10)
+    print("Importi")
+    singola = fattura_sintetica(100)["prodotti"]
+    stampa_tempi("importi.fattura_100", "riepiloga_fattura, 100 righe",
+                 misura(lambda: riepiloga_fattura(singola), ripetizioni), 100, "righe")
+    decimali = misura(lambda: riepiloga_batch(fatture), volte)
+    stampa_tempi("importi.batch_decimal", "riepiloga_batch, 100.000 righe", decimali, 100000, "righe")
+    if NUMPY_AVAILABLE:
+        colonne = ([], [], [], [])
+        for i, data in enumerate(fatture):
+            for p in data["prodotti"]:
+                colonne[0].append(i)
+                colonne[1].append(p["quantita"])
+                colonne[2].append(p["prezzo"])
+                colonne[3].append(p["iva"])
+        stampa_tempi("importi.batch_numpy", "riepiloga_colonne (NumPy), 100.000 righe",
+                     misura(lambda: riepiloga_colonne(*colonne), volte), 100000, "righe")
+    else:
+        print("  numpy non installato: modalità a colonne non misurata")
+
+
+def scrivi_fatture(cartella: Path, n: int, n_righe: int = 10):
+    """Scrive n file fattura_*.json sintetici nella cartella"""
+    for i in range(1, n + 1):
+        with open(cartella / f"fattura_{i:05d}.json", 'w', encoding='utf-8') as f:
+            json.dump(fattura_sintetica(n_righe, i), f, indent=2, ensure_ascii=False)
+
+
+def bench_numerazione(ripetizioni: int):
+    """Ricerca dell'ultimo numero (get_last_fattura_num) su una cartella di 2.000 fatture"""
+    n = 2000
+    print(f"Numerazione ({n} fatture)")
+    with tempfile.TemporaryDirectory() as tmp:
+        cartella = Path(tmp)
+        scrivi_fatture(cartella, n, 1)
+        
+        def da_zero():
+            shutil.rmtree(cartella / ".fattura_pro", ignore_errors=True)
+            IndiceNumerazione(cartella).ultimo(2026)
+        
+        stampa_tempi("numerazione.indice_da_zero", "indice da zero (prima apertura)",
+                     misura(da_zero, max(3, ripetizioni // 10)), n, "file")
+        stampa_tempi("numerazione.apertura", "apertura con indice salvato",
+                     misura(lambda: IndiceNumerazione(cartella).ultimo(2026), ripetizioni))
+        indice = IndiceNumerazione(cartella)
+        stampa_tempi("numerazione.ultimo", "ultimo() con indice in memoria",
+                     misura(lambda: indice.ultimo(2026), ripetizioni * 10))
+        
+        nuove = iter(range(n + 1, n + 1 + ripetizioni))
+        
+        def nuova_fattura():
+            i = next(nuove)
+            data = fattura_sintetica(1, i)
+            with open(cartella / f"fattura_{i:05d}.json", 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            indice.registra(data)
+            indice.ultimo(2026)
+        
+        stampa_tempi("numerazione.nuova_fattura", "salvataggio + registra + ultimo()",
+                     misura(nuova_fattura, ripetizioni))
+
+
+def bench_json(ripetizioni: int):
+    """Salvataggio (atomico con fsync) e caricamento come salva_dati/carica_dati"""
+    print("JSON fattura")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "fattura_bench.json"
+        for n_righe in (10, 1000):
+            data = fattura_sintetica(n_righe)
+            volte = max(3, ripetizioni if n_righe <= 10 else ripetizioni // 5)
+            
+            def salva():
+                scrivi_json_atomico(path, data, indent=2)
+            
+            def carica():
+                with open(path, 'r', encoding='utf-8') as f:
+                    json.load(f)
+            
+            stampa_tempi(f"json.salva_{n_righe}", f"salva_dati, {n_righe} righe", misura(salva, volte),
+                         unita="fatture")
+            stampa_tempi(f"json.carica_{n_righe}", f"carica_dati, {n_righe} righe", misura(carica, volte),
+                         unita="fatture")
+
+
+def bench_batch(ripetizioni: int):
+    """Render batch di una cartella: un processo, tutti i processi, ripetizione con cache"""
+    n = max(20, ripetizioni * 4)
+    workers = os.cpu_count() or 1
+    print(f"Batch ({n} fatture da 20 righe, {workers} processi disponibili)")
+    with tempfile.TemporaryDirectory() as tmp:
+        cartella = Path(tmp)
+        scrivi_fatture(cartella, n, 20)
+        files = sorted(cartella.glob("fattura_*.json"))
+        uscita = cartella / "pdf"
+        stampa_tempi("batch.seriale", "1 processo",
+                     misura(lambda: render_batch(files, uscita, 1), 1), n, "fatture")
+        if workers > 1:
+            stampa_tempi("batch.parallelo", f"{workers} processi",
+                         misura(lambda: render_batch(files, uscita, workers), 1), n, "fatture")
+        cache = CachePDF(cartella / "cache")
+        render_batch(files, uscita, workers, cache=cache)
+        stampa_tempi("batch.cache", "ripetizione con cache (tutti hit)",
+                     misura(lambda: render_batch(files, uscita, 1, cache=cache), 1), n, "fatture")
+
+
+# Avvio in un interprete nuovo: import del modulo GUI e, se c'è un display, prima finestra disegnata
+CODICE_AVVIO = """
+import time
+inizio = time.perf_counter()
+{precarica}
+import fattura_pro
+if {finestra}:
+    import tkinter as tk
+    root = tk.Tk()
+    app = fattura_pro.FatturaPro(root)
+    root.update()
+print(time.perf_counter() - inizio)
+"""
+
+
+def tempo_avvio(precarica: str, finestra: bool) -> float:
+    """Secondi per avviare fattura_pro in un processo nuovo"""
+    codice = CODICE_AVVIO.format(precarica=precarica, finestra=finestra)
+    uscita = subprocess.run([sys.executable, "-c", codice], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(uscita.stdout.strip().splitlines()[-1])
+
+
+def bench_avvio(ripetizioni: int):
+    """Avvio a freddo: reportlab e numpy importati subito (come prima) contro al primo uso"""
+    finestra = bool(os.environ.get("DISPLAY")) or sys.platform in ("win32", "darwin")
+    volte = max(3, ripetizioni // 5)
+    moduli = ["reportlab.platypus", "reportlab.lib.styles"] + (["numpy"] if NUMPY_AVAILABLE else [])
+    precarica = "import " + ", ".join(moduli)
+    # Misure alternate, come in bench_template
+    subito, pigro = [], []
+    for _ in range(volte):
+        subito.append(tempo_avvio(precarica, finestra))
+        pigro.append(tempo_avvio("", finestra))
+    
+    print(f"Avvio ({volte} processi, {'fino alla finestra disegnata' if finestra else 'solo import, nessun display'})")
+    stampa_tempi("avvio.import_immediati",
+                 f"import immediati di {'reportlab e numpy' if NUMPY_AVAILABLE else 'reportlab'}", subito)
+    stampa_tempi("avvio.import_al_primo_uso", "import al primo uso", pigro)
+    risparmio = statistics.median(subito) - statistics.median(pigro)
+    print(f"  risparmio all'avvio (mediana): {risparmio * 1000:.2f} ms "
+          f"({risparmio / statistics.median(subito) * 100:.1f}%)")
+
+
+BENCHMARK = {
+    "avvio": bench_avvio,
+    "batch": bench_batch,
+    "importi": bench_importi,
+    "json": bench_json,
+    "numerazione": bench_numerazione,
+    "prodotti": bench_prodotti,
+    "template": bench_template,
+}
+
+
+def salva_baseline(path, benchmark: List[str]):
+    """Scrive i risultati correnti come baseline JSON"""
+    baseline = {
+        "versione": BASELINE_VERSION,
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "cpu": os.cpu_count(),
+        "benchmark": benchmark,
+        "risultati": RISULTATI,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False)
+
+
+def confronta_baseline(path, soglia: float = SOGLIA_REGRESSIONE) -> List[str]:
+    """Confronta le mediane correnti con una baseline; restituisce le misure peggiorate oltre soglia %"""
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get("versione") != BASELINE_VERSION:
+        raise ValueError(f"formato baseline non supportato: {baseline.get('versione')}")
+    
+    print(f"Confronto con {path} ({baseline.get('data', '?')}, Python {baseline.get('python', '?')})")
+    regressioni = []
+    for chiave, attuale in sorted(RISULTATI.items()):
+        prima = baseline["risultati"].get(chiave)
+        if prima is None or not prima["p50_ms"]:
+            print(f"  {chiave:<34} nuova misura")
+            continue
+        variazione = (attuale["p50_ms"] - prima["p50_ms"]) / prima["p50_ms"] * 100
+        esito = ""
+        if variazione > soglia:
+            esito = "  REGRESSIONE"
+            regressioni.append(chiave)
+        elif variazione < -soglia:
+            esito = "  miglioramento"
+        print(f"  {chiave:<34} {prima['p50_ms']:9.2f} -> {attuale['p50_ms']:9.2f} ms  "
+              f"({variazione:+6.1f}%){esito}")
+    return regressioni
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline Fattura Pro")
+    parser.add_argument("benchmark", nargs="*",
+                       help=f"Benchmark da eseguire: {', '.join(sorted(BENCHMARK))} (default: tutti)")
+    parser.add_argument("-n", "--ripetizioni", type=int, default=50, help="Ripetizioni per misura (default: 50)")
+    parser.add_argument("--salva", metavar="JSON", help="Salva i risultati come baseline")
+    parser.add_argument("--confronta", metavar="JSON", help="Confronta i risultati con una baseline salvata")
+    parser.add_argument("--soglia", type=float, default=SOGLIA_REGRESSIONE,
+                       help="Peggioramento %% della mediana segnalato come regressione (default: %(default)g)")
+    args = parser.parse_args(argv)
+    for nome in args.benchmark:
+        if nome not in BENCHMARK:
+            parser.error(f"benchmark sconosciuto: {nome}")
+    
+    if not REPORTLAB_AVAILABLE:
+        print("Errore: reportlab non installato!\nInstalla con: pip install reportlab")
+        return
+    
+    eseguiti = args.benchmark or sorted(BENCHMARK)
+    for nome in eseguiti:
+        BENCHMARK[nome](args.ripetizioni)
+        rss = picco_rss_mb()
+        if rss is not None:
+            # Il picco è del processo: per isolarlo eseguire un solo benchmark per volta
+            print(f"  picco memoria (RSS) finora: {rss:.1f} MB")
+        print()
+    
+    if args.salva:
+        salva_baseline(args.salva, eseguiti)
+        print(f"Baseline salvata in {args.salva}")
+    if args.confronta:
+        regressioni = confronta_baseline(args.confronta, args.soglia)
+        if regressioni:
+            print(f"\nRegressioni oltre il {args.soglia:g}%: {', '.join(regressioni)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
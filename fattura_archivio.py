@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Archivio Fatture - Archivio SQLite di aziende, clienti, fatture e righe prodotto
+Permette ricerche per cliente o periodo senza riaprire ogni file JSON; ogni fattura
+archiviata aggiorna anche il registro IVA (fattura_registro) e lo scadenzario (fattura_scadenzario)
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fattura_importi import da_centesimi, normalizza_riga, riepiloga_fattura
+from fattura_numerazione import DATA_DIR
+from fattura_registro import RegistroIVA
+from fattura_scadenzario import Scadenzario
+
+
+DB_FILE = str(Path(DATA_DIR) / "archivio.db")
+
+CAMPI_AZIENDA = ["ragione_sociale", "indirizzo", "citta", "cap", "provincia", "p_iva",
+                 "codice_fiscale", "pec", "telefono", "email", "sito_web", "rea",
+                 "capitale_sociale"]
+CAMPI_CLIENTE = ["ragione_sociale", "indirizzo", "citta", "cap", "provincia", "p_iva",
+                 "codice_fiscale", "pec", "codice_destinatario", "telefono", "email"]
+CAMPI_PRODOTTO = ["descrizione", "quantita", "prezzo", "iva", "imponibile", "iva_importo", "totale"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS aziende (
+    id INTEGER PRIMARY KEY,
+    impronta TEXT NOT NULL UNIQUE,
+    {", ".join(f"{c} TEXT" for c in CAMPI_AZIENDA)},
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS clienti (
+    id INTEGER PRIMARY KEY,
+    impronta TEXT NOT NULL UNIQUE,
+    {", ".join(f"{c} TEXT" for c in CAMPI_CLIENTE)},
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS fatture (
+    id INTEGER PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    numero TEXT NOT NULL,
+    data TEXT,
+    data_iso TEXT,
+    scadenza TEXT,
+    condizioni TEXT,
+    causale TEXT,
+    note TEXT,
+    banca_iban TEXT,
+    banca_nome TEXT,
+    azienda_id INTEGER REFERENCES aziende(id),
+    cliente_id INTEGER REFERENCES clienti(id),
+    imponibile REAL,
+    iva REAL,
+    totale REAL,
+    file TEXT,
+    UNIQUE (tipo, numero)
+);
+CREATE TABLE IF NOT EXISTS prodotti (
+    fattura_id INTEGER NOT NULL REFERENCES fatture(id) ON DELETE CASCADE,
+    riga INTEGER NOT NULL,
+    descrizione TEXT,
+    quantita REAL,
+    prezzo REAL,
+    iva REAL,
+    imponibile REAL,
+    iva_importo REAL,
+    totale REAL,
+    extra TEXT,
+    PRIMARY KEY (fattura_id, riga)
+);
+CREATE INDEX IF NOT EXISTS idx_fatture_numero ON fatture(numero);
+CREATE INDEX IF NOT EXISTS idx_fatture_data ON fatture(data_iso);
+CREATE INDEX IF NOT EXISTS idx_fatture_cliente ON fatture(cliente_id, data_iso);
+CREATE INDEX IF NOT EXISTS idx_fatture_totale ON fatture(totale);
+CREATE INDEX IF NOT EXISTS idx_clienti_piva ON clienti(p_iva);
+"""
+
+
+def data_iso(data: str) -> Optional[str]:
+    """Converte una data gg/mm/aaaa in aaaa-mm-gg (None se non valida)"""
+    try:
+        return datetime.strptime((data or "").strip(), "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def normalizza_p_iva(p_iva: str) -> str:
+    """Partita IVA senza spazi e senza prefisso IT, come va confrontata"""
+    p_iva = re.sub(r"\s+", "", p_iva or "").upper()
+    if p_iva.startswith("IT") and p_iva[2:].isdigit():
+        p_iva = p_iva[2:]
+    return p_iva
+
+
+def impronta(record: Dict) -> str:
+    """Hash del contenuto di un record anagrafico, usato per deduplicarlo"""
+    canonico = json.dumps(record, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(canonico.encode('utf-8')).hexdigest()
+
+
+def _extra(record: Dict, campi: List[str]) -> Optional[str]:
+    """Campi non previsti dallo schema, conservati come JSON"""
+    extra = {k: v for k, v in record.items() if k not in campi}
+    return json.dumps(extra, ensure_ascii=False) if extra else None
+
+
+class ArchivioFatture:
+    """Archivio SQLite delle fatture"""
+    
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+        self.registro = RegistroIVA(self.conn)
+        self.scadenzario = Scadenzario(self.conn)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.chiudi()
+    
+    def chiudi(self):
+        """Chiude la connessione"""
+        self.conn.close()
+    
+    def _anagrafica(self, tabella: str, campi: List[str], record: Dict) -> int:
+        """Inserisce (se nuovo) un record azienda/cliente e ne restituisce l'id
+        
+        La Partita IVA viene normalizzata prima dell'impronta: lo stesso soggetto
+        scritto con o senza spazi e prefisso IT è un solo record.
+        """
+        if isinstance(record.get("p_iva"), str):
+            record = dict(record, p_iva=normalizza_p_iva(record["p_iva"]))
+        chiave = impronta(record)
+        row = self.conn.execute(f"SELECT id FROM {tabella} WHERE impronta = ?", (chiave,)).fetchone()
+        if row:
+            return row["id"]
+        valori = [record.get(c, "") for c in campi]
+        cur = self.conn.execute(
+            f"INSERT INTO {tabella} (impronta, {', '.join(campi)}, extra) "
+            f"VALUES (?, {', '.join('?' for _ in campi)}, ?)",
+            [chiave] + valori + [_extra(record, campi)]
+        )
+        return cur.lastrowid
+    
+    def _inserisci(self, data: Dict, file: Optional[str] = None) -> int:
+        """Inserisce o sostituisce una fattura (senza commit)
+        
+        Gli importi delle righe passano da fattura_importi: un valore non numerico
+        è un ValueError, non un testo in una colonna REAL con totali a zero.
+        """
+        fattura = data.get("fattura", {})
+        banca = data.get("banca", {})
+        prodotti = []
+        for i, p in enumerate(data.get("prodotti", []), 1):
+            try:
+                prodotti.append(normalizza_riga(p))
+            except ValueError as e:
+                raise ValueError(f"riga {i}: {e}") from None
+        azienda_id = self._anagrafica("aziende", CAMPI_AZIENDA, data.get("azienda", {}))
+        cliente_id = self._anagrafica("clienti", CAMPI_CLIENTE, data.get("cliente", {}))
+        
+        riepilogo = riepiloga_fattura(prodotti)
+        imponibile, iva, totale = riepilogo.totali()
+        
+        tipo = fattura.get("tipo") or "Fattura"
+        numero = fattura.get("numero", "")
+        self.conn.execute("DELETE FROM fatture WHERE tipo = ? AND numero = ?", (tipo, numero))
+        cur = self.conn.execute(
+            """INSERT INTO fatture (tipo, numero, data, data_iso, scadenza, condizioni, causale,
+                                    note, banca_iban, banca_nome, azienda_id, cliente_id,
+                                    imponibile, iva, totale, file)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (tipo, numero, fattura.get("data", ""), data_iso(fattura.get("data", "")),
+             fattura.get("scadenza", ""), fattura.get("condizioni", ""),
+             fattura.get("causale", ""), fattura.get("note", ""),
+             banca.get("iban", ""), banca.get("nome", ""), azienda_id, cliente_id,
+             da_centesimi(imponibile), da_centesimi(iva), da_centesimi(totale), file)
+        )
+        fattura_id = cur.lastrowid
+        self.conn.executemany(
+            f"INSERT INTO prodotti (fattura_id, riga, {', '.join(CAMPI_PRODOTTO)}, extra) "
+            f"VALUES (?, ?, {', '.join('?' for _ in CAMPI_PRODOTTO)}, ?)",
+            ([fattura_id, i] + [p.get(c) for c in CAMPI_PRODOTTO] + [_extra(p, CAMPI_PRODOTTO)]
+             for i, p in enumerate(prodotti))
+        )
+        self.registro.registra(tipo, numero, data_iso(fattura.get("data", "")), riepilogo)
+        self.scadenzario.registra(tipo, numero, fattura, totale, data.get("cliente", {}).get("ragione_sociale", ""))
+        return fattura_id
+    
+    def salva(self, data: Dict, file: Optional[str] = None) -> int:
+        """Archivia una fattura (sostituisce quella con stesso tipo e numero)"""
+        with self.conn:
+            return self._inserisci(data, file)
+    
+    def salva_differita(self, data: Dict, file: Optional[str] = None) -> int:
+        """Archivia una fattura dentro la transazione in corso, senza commit
+        
+        Per le importazioni lunghe: si chiama conferma() ogni tanto e alla fine.
+        Se l'inserimento fallisce si annulla solo questa fattura.
+        """
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+        self.conn.execute("SAVEPOINT fattura")
+        try:
+            fattura_id = self._inserisci(data, file)
+        except Exception:
+            self.conn.execute("ROLLBACK TO fattura")
+            raise
+        finally:
+            self.conn.execute("RELEASE fattura")
+        return fattura_id
+    
+    def conferma(self):
+        """Conferma (commit) le fatture archiviate con salva_differita"""
+        self.conn.commit()
+    
+    def importa_json(self, cartella, pattern: str = "fattura_*.json") -> Tuple[int, List[str]]:
+        """Importa tutti i file fattura JSON di una cartella in un'unica transazione
+        
+        Ogni file ha il suo savepoint: un file con errori viene annullato per
+        intero senza toccare gli altri. Due file con lo stesso tipo e numero (o
+        senza numero) sono un errore: il secondo non sostituisce il primo.
+        Restituisce il numero di fatture importate e gli errori per file.
+        """
+        importate = 0
+        errori = []
+        visti: Dict[Tuple[str, str], Path] = {}
+        try:
+            for path in sorted(Path(cartella).glob(pattern)):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    fattura = data.get("fattura") or {}
+                    chiave = (fattura.get("tipo") or "Fattura", fattura.get("numero") or "")
+                    if not chiave[1]:
+                        raise ValueError("numero fattura mancante")
+                    if chiave in visti:
+                        raise ValueError(f"{chiave[0]} {chiave[1]} già importata da {visti[chiave].name}")
+                    self.salva_differita(data, str(path))
+                    visti[chiave] = path
+                    importate += 1
+                except (OSError, ValueError, AttributeError, sqlite3.Error) as e:
+                    errori.append(f"{path}: {e}")
+            self.conferma()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return importate, errori
+    
+    def _record(self, tabella: str, campi: List[str], record_id: int) -> Dict:
+        """Ricostruisce il dizionario di un'anagrafica"""
+        row = self.conn.execute(f"SELECT * FROM {tabella} WHERE id = ?", (record_id,)).fetchone()
+        if row is None:
+            return {}
+        record = {c: row[c] for c in campi}
+        if row["extra"]:
+            record.update(json.loads(row["extra"]))
+        return record
+    
+    def carica(self, numero: str, tipo: Optional[str] = None) -> Optional[Dict]:
+        """Ricostruisce il dizionario fattura (formato salva_dati) dal numero"""
+        query = "SELECT * FROM fatture WHERE numero = ?"
+        params = [numero]
+        if tipo:
+            query += " AND tipo = ?"
+            params.append(tipo)
+        row = self.conn.execute(query, params).fetchone()
+        if row is None:
+            return None
+        
+        prodotti = []
+        for p in self.conn.execute("SELECT * FROM prodotti WHERE fattura_id = ? ORDER BY riga", (row["id"],)):
+            prodotto = {c: p[c] for c in CAMPI_PRODOTTO}
+            if p["extra"]:
+                prodotto.update(json.loads(p["extra"]))
+            prodotti.append(prodotto)
+        
+        return {
+            "azienda": self._record("aziende", CAMPI_AZIENDA, row["azienda_id"]),
+            "cliente": self._record("clienti", CAMPI_CLIENTE, row["cliente_id"]),
+            "fattura": {
+                "tipo": row["tipo"],
+                "numero": row["numero"],
+                "data": row["data"],
+                "scadenza": row["scadenza"],
+                "condizioni": row["condizioni"],
+                "causale": row["causale"],
+                "note": row["note"]
+            },
+            "banca": {
+                "iban": row["banca_iban"],
+                "nome": row["banca_nome"]
+            },
+            "prodotti": prodotti
+        }
+    
+    def _riepiloghi(self, where: str, params) -> List[Dict]:
+        """Elenco sintetico delle fatture che soddisfano una condizione"""
+        rows = self.conn.execute(
+            f"""SELECT f.tipo, f.numero, f.data, f.imponibile, f.iva, f.totale,
+                       c.ragione_sociale AS cliente, c.p_iva AS cliente_p_iva
+                FROM fatture f JOIN clienti c ON c.id = f.cliente_id
+                WHERE {where}
+                ORDER BY f.data_iso, f.numero""",
+            params
+        )
+        return [dict(r) for r in rows]
+    
+    def per_cliente(self, p_iva: str) -> List[Dict]:
+        """Fatture emesse a un cliente (per Partita IVA)"""
+        return self._riepiloghi("c.p_iva = ?", (normalizza_p_iva(p_iva),))
+    
+    def per_periodo(self, da: str, a: str) -> List[Dict]:
+        """Fatture con data compresa tra due date gg/mm/aaaa (estremi inclusi)"""
+        return self._riepiloghi("f.data_iso BETWEEN ? AND ?", (data_iso(da), data_iso(a)))
+
+
+def stampa_riepiloghi(righe: List[Dict]):
+    """Stampa un elenco di fatture"""
+    for r in righe:
+        print(f"{r['data']:<12}{r['numero']:<18}{r['cliente'][:30]:<32}€ {r['totale']:>12.2f}")
+    print(f"\nFatture: {len(righe)}, totale: € {sum(r['totale'] for r in righe):.2f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Archivio SQLite delle fatture")
+    parser.add_argument("--db", default=DB_FILE, help=f"File dell'archivio (default: {DB_FILE})")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    p = sub.add_parser("importa", help="Importa i file fattura_*.json di una cartella")
+    p.add_argument("cartella")
+    p = sub.add_parser("cliente", help="Fatture di un cliente per Partita IVA")
+    p.add_argument("p_iva")
+    p = sub.add_parser("periodo", help="Fatture in un periodo (date gg/mm/aaaa)")
+    p.add_argument("da")
+    p.add_argument("a")
+    args = parser.parse_args(argv)
+    
+    with ArchivioFatture(args.db) as archivio:
+        if args.comando == "importa":
+            importate, errori = archivio.importa_json(args.cartella)
+            for errore in errori:
+                print(f"✗ {errore}")
+            print(f"Fatture importate: {importate}, errori: {len(errori)}")
+            sys.exit(1 if errori else 0)
+        elif args.comando == "cliente":
+            stampa_riepiloghi(archivio.per_cliente(args.p_iva))
+        elif args.comando == "periodo":
+            stampa_riepiloghi(archivio.per_periodo(args.da, args.a))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Cache dei PDF generati per Fattura Pro
+I PDF sono indicizzati per hash del contenuto canonico della fattura più la versione
+del template: rigenerando un batch, le fatture invariate vengono collegate (hardlink)
+o copiate dalla cache invece di essere impaginate di nuovo
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fattura_io import scrivi_atomico
+from fattura_numerazione import DATA_DIR
+
+
+CACHE_DIR = str(Path(DATA_DIR) / "cache_pdf")
+DIMENSIONE_MAX = 500 * 1024 * 1024  # byte
+RIEMPIMENTO_DOPO_PULIZIA = 0.9  # la pulizia scende al 90% del limite
+
+
+def chiave_render(data: Dict, versione: str) -> str:
+    """Hash SHA-256 del contenuto canonico della fattura (chiavi ordinate) e della versione del template"""
+    canonico = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    h = hashlib.sha256(versione.encode("utf-8"))
+    h.update(b"\0")
+    h.update(canonico.encode("utf-8"))
+    return h.hexdigest()
+
+
+class CachePDF:
+    """Cache su disco dei PDF con eliminazione LRU entro una dimensione massima
+    
+    Ogni voce è cartella/ab/<hash>.pdf; l'ultimo utilizzo è la data di modifica,
+    aggiornata a ogni hit. Le statistiche (hit, miss, eliminati) sono del
+    processo corrente. Più processi possono usare la stessa cartella: le
+    scritture sono atomiche e la pulizia tollera file già rimossi da altri.
+    """
+    
+    def __init__(self, cartella: str = CACHE_DIR, dimensione_max: int = DIMENSIONE_MAX, collega: bool = True):
+        self.cartella = Path(cartella)
+        self.dimensione_max = dimensione_max
+        self.collega = collega
+        self.hit = 0
+        self.miss = 0
+        self.eliminati = 0
+        self._occupato: Optional[int] = None  # stima, ricalcolata a ogni pulizia
+    
+    def __getstate__(self):
+        # Nei processi worker ogni copia parte con statistiche e stima azzerate
+        stato = dict(self.__dict__)
+        stato.update(hit=0, miss=0, eliminati=0, _occupato=None)
+        return stato
+    
+    def percorso(self, chiave: str) -> Path:
+        """File della voce in cache (le prime due cifre dell'hash fanno da sottocartella)"""
+        return self.cartella / chiave[:2] / f"{chiave}.pdf"
+    
+    def voci(self) -> List[Tuple[Path, os.stat_result]]:
+        """(path, stat) di tutte le voci in cache"""
+        voci = []
+        for path in self.cartella.glob("??/*.pdf"):
+            try:
+                voci.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+        return voci
+    
+    def occupato(self) -> int:
+        """Byte occupati dalla cache (stima aggiornata dalle scritture)"""
+        if self._occupato is None:
+            self._occupato = sum(st.st_size for _, st in self.voci())
+        return self._occupato
+    
+    def statistiche(self) -> Dict:
+        """Hit, miss ed eliminazioni del processo più lo stato su disco"""
+        voci = self.voci()
+        richieste = self.hit + self.miss
+        return {
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_rate": self.hit / richieste if richieste else 0.0,
+            "eliminati": self.eliminati,
+            "voci": len(voci),
+            "byte": sum(st.st_size for _, st in voci),
+            "dimensione_max": self.dimensione_max,
+        }
+    
+    def _materializza(self, sorgente: Path, destinazione: Path):
+        """Porta il PDF in cache nella destinazione: hardlink se possibile, altrimenti copia"""
+        destinazione = Path(destinazione)
+        if destinazione.exists() and os.path.samefile(sorgente, destinazione):
+            return
+        tmp = destinazione.with_name(f".tmp_{os.getpid()}_{destinazione.name}")
+        try:
+            if self.collega:
+                try:
+                    os.link(sorgente, tmp)
+                except OSError:  # file system diversi o senza hardlink
+                    shutil.copyfile(sorgente, tmp)
+            else:
+                shutil.copyfile(sorgente, tmp)
+            os.replace(tmp, destinazione)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+    
+    def recupera(self, chiave: str, destinazione) -> bool:
+        """Scrive nella destinazione il PDF in cache; False se non c'è"""
+        sorgente = self.percorso(chiave)
+        try:
+            os.utime(sorgente)
+            self._materializza(sorgente, destinazione)
+        except FileNotFoundError:
+            self.miss += 1
+            return False
+        self.hit += 1
+        return True
+    
+    def salva(self, chiave: str, pdf: bytes):
+        """Aggiunge un PDF alla cache ed elimina i meno usati se si supera il limite"""
+        if len(pdf) > self.dimensione_max:
+            return
+        path = self.percorso(chiave)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        scrivi_atomico(path, pdf, fsync=False)  # una voce persa si rigenera
+        self._occupato = self.occupato() + len(pdf)
+        if self._occupato > self.dimensione_max:
+            self.pulisci()
+    
+    def pulisci(self, dimensione_max: Optional[int] = None) -> int:
+        """Elimina le voci usate meno di recente fino a scendere sotto il limite; restituisce quante"""
+        limite = self.dimensione_max if dimensione_max is None else dimensione_max
+        voci = sorted(self.voci(), key=lambda voce: voce[1].st_mtime)
+        occupato = sum(st.st_size for _, st in voci)
+        obiettivo = limite * RIEMPIMENTO_DOPO_PULIZIA if occupato > limite else occupato
+        eliminati = 0
+        for path, st in voci:
+            if occupato <= obiettivo:
+                break
+            try:
+                path.unlink()
+                eliminati += 1
+            except FileNotFoundError:
+                pass
+            occupato -= st.st_size
+        self._occupato = occupato
+        self.eliminati += eliminati
+        return eliminati
+    
+    def svuota(self) -> int:
+        """Elimina tutte le voci"""
+        return self.pulisci(0)
+    
+    def genera(self, destinazione, chiave: str, render: Callable[[], bytes]) -> bool:
+        """Scrive il PDF nella destinazione, dalla cache o chiamando render()
+        
+        Restituisce True se il PDF veniva dalla cache.
+        """
+        if self.recupera(chiave, destinazione):
+            return True
+        pdf = render()
+        self.salva(chiave, pdf)
+        scrivi_atomico(destinazione, pdf)
+        return False
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Cache dei PDF di Fattura Pro")
+    parser.add_argument("--cartella", default=CACHE_DIR, help=f"Cartella della cache (default: {CACHE_DIR})")
+    parser.add_argument("--max-mb", type=float, default=DIMENSIONE_MAX / 1024 / 1024,
+                       help="Dimensione massima in MB (default: %(default)g)")
+    parser.add_argument("comando", choices=["stato", "pulisci", "svuota"])
+    args = parser.parse_args(argv)
+    
+    cache = CachePDF(args.cartella, int(args.max_mb * 1024 * 1024))
+    if args.comando == "pulisci":
+        print(f"Voci eliminate: {cache.pulisci()}")
+    elif args.comando == "svuota":
+        print(f"Voci eliminate: {cache.svuota()}")
+    stato = cache.statistiche()
+    print(f"Voci in cache: {stato['voci']}, {stato['byte'] / 1024 / 1024:.1f} MB "
+          f"su {stato['dimensione_max'] / 1024 / 1024:g} MB")
+
+
+if __name__ == "__main__":
+    main()
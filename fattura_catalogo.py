@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Catalogo prodotti/servizi di Fattura Pro
+Articoli (SKU, descrizione, prezzo, aliquota IVA) in SQLite, con indice in memoria
+per la ricerca per prefisso e per sottostringa (trigrammi) durante la digitazione
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+from bisect import bisect_left
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from fattura_clienti import normalizza_testo
+from fattura_importi import a_decimal, da_centesimi, in_centesimi
+from fattura_numerazione import DATA_DIR
+
+
+CATALOGO_FILE = str(Path(DATA_DIR) / "catalogo.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articoli (
+    sku TEXT PRIMARY KEY,
+    descrizione TEXT NOT NULL,
+    prezzo_cent INTEGER NOT NULL DEFAULT 0,
+    iva REAL NOT NULL DEFAULT 22
+);
+"""
+
+
+class Articolo(NamedTuple):
+    """Un articolo del catalogo (prezzo unitario in euro)"""
+    sku: str
+    descrizione: str
+    prezzo: float
+    iva: float
+
+
+def trigrammi(testo: str) -> set:
+    """Trigrammi distinti di un testo già normalizzato"""
+    return {testo[i:i + 3] for i in range(len(testo) - 2)}
+
+
+class IndiceCatalogo:
+    """Indice di ricerca in memoria sugli articoli del catalogo
+    
+    - prefisso: lista ordinata di (voce, n) con la descrizione da ogni parola
+      in poi e lo SKU, interrogata con bisect;
+    - sottostringa: per ogni trigramma la lista degli articoli che lo contengono;
+      si parte dalla lista più corta dei trigrammi cercati e si verifica il testo.
+    Le ricerche si fermano appena trovati `limite` risultati.
+    """
+    
+    def __init__(self, articoli: Iterable[Articolo] = ()):
+        self.articoli: List[Articolo] = []
+        self.testi: List[str] = []  # "sku descrizione" normalizzati, per la verifica
+        self.posizione: Dict[str, int] = {}  # sku -> n
+        self.prefissi: List[Tuple[str, int]] = []
+        self.trigrammi: Dict[str, List[int]] = {}
+        for articolo in articoli:
+            self._aggiungi(articolo)
+        self.prefissi.sort()
+    
+    def __len__(self):
+        return len(self.articoli)
+    
+    def _aggiungi(self, articolo: Articolo):
+        n = len(self.articoli)
+        self.articoli.append(articolo)
+        self.posizione[articolo.sku] = n
+        sku = normalizza_testo(articolo.sku)
+        parole = normalizza_testo(articolo.descrizione).split()
+        testo = " ".join([sku] + parole)
+        self.testi.append(testo)
+        self.prefissi.append((sku, n))
+        self.prefissi.extend((" ".join(parole[i:]), n) for i in range(len(parole)))
+        for trigramma in trigrammi(testo):
+            self.trigrammi.setdefault(trigramma, []).append(n)
+    
+    def get(self, sku: str) -> Optional[Articolo]:
+        """Articolo per SKU"""
+        n = self.posizione.get(sku)
+        return self.articoli[n] if n is not None else None
+    
+    def cerca(self, testo: str, limite: int = 10) -> List[Articolo]:
+        """Articoli per prefisso (SKU o parola della descrizione), poi per sottostringa"""
+        cercato = normalizza_testo(testo)
+        if not cercato:
+            return []
+        trovati: Dict[int, None] = {}
+        
+        i = bisect_left(self.prefissi, (cercato,))
+        while i < len(self.prefissi) and len(trovati) < limite:
+            voce, n = self.prefissi[i]
+            if not voce.startswith(cercato):
+                break
+            trovati[n] = None
+            i += 1
+        
+        if len(trovati) < limite and len(cercato) >= 3:
+            liste = [self.trigrammi.get(t) for t in trigrammi(cercato)]
+            if all(liste):
+                for n in min(liste, key=len):
+                    if n not in trovati and cercato in self.testi[n]:
+                        trovati[n] = None
+                        if len(trovati) >= limite:
+                            break
+        return [self.articoli[n] for n in trovati]
+
+
+def firma_catalogo(path: str = CATALOGO_FILE) -> Tuple:
+    """mtime e dimensione del database e del suo WAL: cambiano a ogni scrittura
+    
+    Serve a chi tiene un IndiceCatalogo in memoria per accorgersi delle
+    modifiche fatte da un altro processo (import, variazioni di prezzo).
+    """
+    firma = []
+    for file in (path, path + "-wal"):
+        try:
+            st = os.stat(file)
+            firma.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            firma.append(None)
+    return tuple(firma)
+
+
+class CatalogoProdotti:
+    """Catalogo articoli su SQLite"""
+    
+    def __init__(self, path: str = CATALOGO_FILE):
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.chiudi()
+    
+    def chiudi(self):
+        """Chiude la connessione"""
+        self.conn.close()
+    
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM articoli").fetchone()[0]
+    
+    def salva(self, articoli: Iterable[Articolo]) -> int:
+        """Inserisce o aggiorna articoli in un'unica transazione; restituisce quanti"""
+        with self.conn:
+            cur = self.conn.executemany(
+                """INSERT INTO articoli (sku, descrizione, prezzo_cent, iva) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(sku) DO UPDATE SET descrizione = excluded.descrizione,
+                       prezzo_cent = excluded.prezzo_cent, iva = excluded.iva""",
+                ((a.sku, a.descrizione, in_centesimi(a.prezzo), float(a.iva)) for a in articoli)
+            )
+            return cur.rowcount
+    
+    def articoli(self) -> Iterable[Articolo]:
+        """Tutti gli articoli in ordine di SKU"""
+        for sku, descrizione, prezzo_cent, iva in self.conn.execute(
+                "SELECT sku, descrizione, prezzo_cent, iva FROM articoli ORDER BY sku"):
+            yield Articolo(sku, descrizione, da_centesimi(prezzo_cent), iva)
+    
+    def indice(self) -> IndiceCatalogo:
+        """Costruisce l'indice di ricerca in memoria (una lettura della tabella)"""
+        return IndiceCatalogo(self.articoli())
+    
+    def aggiorna_prezzi(self, prezzi: Iterable[Tuple[str, float]]) -> int:
+        """Nuovi prezzi per SKU in un'unica transazione; restituisce gli articoli aggiornati"""
+        with self.conn:
+            cur = self.conn.executemany(
+                "UPDATE articoli SET prezzo_cent = ? WHERE sku = ?",
+                ((in_centesimi(prezzo), sku) for sku, prezzo in prezzi)
+            )
+            return cur.rowcount
+    
+    def varia_prezzi(self, percentuale: float, prefisso_sku: str = "") -> int:
+        """Aumenta (o riduce) di percentuale punti tutti i prezzi, o quelli con SKU che inizia
+        per prefisso_sku, in un'unica transazione; arrotondamento al centesimo"""
+        fattore = 1 + a_decimal(percentuale) / 100
+        with self.conn:
+            righe = self.conn.execute(
+                "SELECT sku, prezzo_cent FROM articoli WHERE sku >= ? AND sku < ?",
+                (prefisso_sku, prefisso_sku + "\U0010ffff")
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE articoli SET prezzo_cent = ? WHERE sku = ?",
+                ((int((cent * fattore).quantize(Decimal(1), rounding=ROUND_HALF_UP)), sku)
+                 for sku, cent in righe)
+            )
+        return len(righe)
+
+
+def leggi_csv(path, delimitatore: Optional[str] = None) -> Iterable[Articolo]:
+    """Articoli da un CSV con colonne sku, descrizione, prezzo, iva (iva facoltativa)"""
+    from fattura_import import apri_csv, leggi_numero
+    f, reader = apri_csv(path, delimitatore=delimitatore)
+    with f:
+        intestazione = [c.strip().lower() for c in next(reader, [])]
+        for riga in reader:
+            campi = dict(zip(intestazione, (c.strip() for c in riga)))
+            if not campi.get("sku"):
+                continue
+            yield Articolo(campi["sku"], campi.get("descrizione", ""),
+                           leggi_numero(campi.get("prezzo", "0") or "0"),
+                           leggi_numero(campi.get("iva", "22") or "22"))
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Catalogo prodotti/servizi di Fattura Pro")
+    parser.add_argument("--db", default=CATALOGO_FILE, help=f"File del catalogo (default: {CATALOGO_FILE})")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    p = sub.add_parser("importa", help="Importa o aggiorna articoli da CSV (sku, descrizione, prezzo, iva)")
+    p.add_argument("csv")
+    p = sub.add_parser("prezzi", help="Aggiorna i prezzi in un'unica transazione")
+    gruppo = p.add_mutually_exclusive_group(required=True)
+    gruppo.add_argument("--percentuale", type=float, help="Variazione percentuale (es. 3.5 o -10)")
+    gruppo.add_argument("--file", help="CSV con colonne sku, prezzo")
+    p.add_argument("--prefisso", default="", help="Solo gli SKU che iniziano così (con --percentuale)")
+    p = sub.add_parser("cerca", help="Cerca articoli per SKU o descrizione")
+    p.add_argument("testo")
+    p.add_argument("-n", "--limite", type=int, default=10, help="Numero massimo di risultati (default: 10)")
+    args = parser.parse_args(argv)
+    
+    with CatalogoProdotti(args.db) as catalogo:
+        try:
+            if args.comando == "importa":
+                n = catalogo.salva(leggi_csv(args.csv))
+                print(f"Articoli importati: {n}, in catalogo: {len(catalogo)}")
+            elif args.comando == "prezzi":
+                if args.file:
+                    n = catalogo.aggiorna_prezzi((a.sku, a.prezzo) for a in leggi_csv(args.file))
+                else:
+                    n = catalogo.varia_prezzi(args.percentuale, args.prefisso)
+                print(f"Prezzi aggiornati: {n}")
+            elif args.comando == "cerca":
+                risultati = catalogo.indice().cerca(args.testo, args.limite)
+                for a in risultati:
+                    print(f"{a.sku:<16} {a.descrizione[:44]:<44} € {a.prezzo:>10.2f}  {a.iva:g}%")
+                if not risultati:
+                    print("Nessun articolo trovato")
+                    sys.exit(1)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Errore: {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
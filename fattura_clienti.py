@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Anagrafica clienti di Fattura Pro
+Clienti per Partita IVA / codice fiscale ricavati dalle fatture emesse, con indice
+ordinato sui nomi per l'autocompletamento (ricerca per prefisso con bisect)
+"""
+
+import argparse
+import json
+import re
+import sys
+import unicodedata
+from bisect import bisect_left, insort
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fattura_archivio import CAMPI_CLIENTE, data_iso, normalizza_p_iva
+from fattura_io import scrivi_json_atomico
+from fattura_numerazione import DATA_DIR
+
+
+CLIENTI_FILE = "clienti.json"
+CLIENTI_VERSION = 1
+
+
+def normalizza_testo(testo: str) -> str:
+    """Testo per il confronto: minuscolo, senza accenti né punteggiatura, spazi singoli"""
+    testo = testo or ""
+    if not testo.isascii():
+        testo = unicodedata.normalize("NFKD", testo)
+        testo = "".join(c for c in testo if not unicodedata.combining(c))
+    testo = testo.casefold()
+    return " ".join(re.sub(r"[^\w]+", " ", testo).split())
+
+
+def chiave_cliente(cliente: Dict) -> Optional[str]:
+    """Chiave dell'anagrafica: Partita IVA (senza prefisso IT) o codice fiscale"""
+    p_iva = normalizza_p_iva(cliente.get("p_iva", ""))
+    if p_iva:
+        return p_iva
+    codice_fiscale = re.sub(r"\s+", "", cliente.get("codice_fiscale", "") or "").upper()
+    return codice_fiscale or None
+
+
+def voci_nome(nome: str) -> List[str]:
+    """Chiavi di ricerca di una ragione sociale: il nome da ogni parola in poi
+    
+    "Mario Rossi Srl" si trova cercando "mar", "ros" o "srl".
+    """
+    parole = normalizza_testo(nome).split()
+    return [" ".join(parole[i:]) for i in range(len(parole))]
+
+
+class RegistroClienti:
+    """Anagrafica clienti persistita su file, con indice per prefisso in memoria
+    
+    L'indice è una lista ordinata di (voce, chiave): una ricerca è una bisect
+    più la lettura dei risultati, indipendente dal numero di clienti.
+    """
+    
+    def __init__(self, cartella=".", clienti_file: str = CLIENTI_FILE):
+        self.path = Path(cartella) / DATA_DIR / clienti_file
+        self.clienti: Dict[str, Dict] = {}
+        self.indice: List[Tuple[str, str]] = []
+        self.carica()
+    
+    def __len__(self):
+        return len(self.clienti)
+    
+    def carica(self):
+        """Carica l'anagrafica dal file (vuota se mancante o illeggibile)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("versione") != CLIENTI_VERSION:
+                return
+            self.clienti = data.get("clienti", {})
+        except (OSError, ValueError, AttributeError):
+            return
+        self._ricostruisci_indice()
+    
+    def _ricostruisci_indice(self):
+        """Ricostruisce l'indice dei nomi con un solo ordinamento"""
+        self.indice = sorted((voce, chiave) for chiave, cliente in self.clienti.items()
+                             for voce in voci_nome(cliente.get("ragione_sociale", "")))
+    
+    def dati(self) -> Dict:
+        """Contenuto del file; i record non vengono mai modificati sul posto,
+        quindi questa copia si può scrivere da un altro thread"""
+        return {"versione": CLIENTI_VERSION, "clienti": dict(self.clienti)}
+    
+    def salva(self, dati: Optional[Dict] = None):
+        """Salva l'anagrafica in modo atomico"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        scrivi_json_atomico(self.path, dati or self.dati())
+    
+    def _togli_dall_indice(self, chiave: str, nome: str):
+        for voce in voci_nome(nome):
+            i = bisect_left(self.indice, (voce, chiave))
+            if i < len(self.indice) and self.indice[i] == (voce, chiave):
+                del self.indice[i]
+    
+    def registra(self, cliente: Dict, data: str = "", indicizza: bool = True) -> bool:
+        """Aggiunge o aggiorna un cliente; True se l'anagrafica è cambiata
+        
+        data (gg/mm/aaaa) è quella della fattura: i dati di una fattura più
+        vecchia non sostituiscono quelli già registrati. Con indicizza=False
+        l'indice non viene aggiornato (va ricostruito alla fine, vedi importa).
+        """
+        chiave = chiave_cliente(cliente)
+        if chiave is None or not cliente.get("ragione_sociale"):
+            return False
+        record = {campo: cliente.get(campo, "") or "" for campo in CAMPI_CLIENTE}
+        record["_data"] = data_iso(data) or ""
+        
+        precedente = self.clienti.get(chiave)
+        if precedente is not None:
+            if record["_data"] and record["_data"] < precedente.get("_data", ""):
+                return False
+            if precedente == record:
+                return False
+            if indicizza:
+                self._togli_dall_indice(chiave, precedente.get("ragione_sociale", ""))
+        self.clienti[chiave] = record
+        if indicizza:
+            for voce in voci_nome(record["ragione_sociale"]):
+                insort(self.indice, (voce, chiave))
+        return True
+    
+    def importa(self, fatture: Iterable[Dict]) -> int:
+        """Registra i clienti di molte fatture; restituisce quanti sono cambiati"""
+        cambiati = sum(self.registra(data.get("cliente", {}), data.get("fattura", {}).get("data", ""), False)
+                       for data in fatture)
+        if cambiati:
+            self._ricostruisci_indice()
+        return cambiati
+    
+    def importa_cartella(self, cartella, pattern: str = "fattura_*.json") -> int:
+        """Registra i clienti di tutti i file fattura JSON di una cartella"""
+        def fatture():
+            for path in sorted(Path(cartella).glob(pattern)):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        yield json.load(f)
+                except (OSError, ValueError):
+                    continue
+        return self.importa(fatture())
+    
+    def get(self, chiave: str) -> Optional[Dict]:
+        """Dati cliente (campi di init_dati_cliente) per P.IVA o codice fiscale"""
+        record = self.clienti.get(chiave_cliente({"p_iva": chiave}) or "")
+        if record is None:
+            return None
+        return {campo: record.get(campo, "") for campo in CAMPI_CLIENTE}
+    
+    def cerca(self, testo: str, limite: int = 10) -> List[Dict]:
+        """Clienti il cui nome (da una qualsiasi parola) o P.IVA/CF inizia con testo"""
+        prefisso = normalizza_testo(testo)
+        if not prefisso:
+            return []
+        trovati: Dict[str, None] = {}
+        
+        # Partita IVA o codice fiscale scritti per intero: accesso diretto
+        chiave = chiave_cliente({"p_iva": testo})
+        if chiave in self.clienti:
+            trovati[chiave] = None
+        
+        i = bisect_left(self.indice, (prefisso,))
+        while i < len(self.indice) and len(trovati) < limite:
+            voce, chiave = self.indice[i]
+            if not voce.startswith(prefisso):
+                break
+            trovati[chiave] = None
+            i += 1
+        return [dict(self.get(chiave), chiave=chiave) for chiave in trovati]
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Anagrafica clienti di Fattura Pro")
+    parser.add_argument("--cartella", default=".", help="Cartella di lavoro di Fattura Pro (default: .)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    p = sub.add_parser("importa", help="Registra i clienti dei file fattura_*.json di una cartella")
+    p.add_argument("fatture", help="Cartella con i file fattura_*.json")
+    p = sub.add_parser("cerca", help="Cerca clienti per nome, Partita IVA o codice fiscale")
+    p.add_argument("testo")
+    p.add_argument("-n", "--limite", type=int, default=10, help="Numero massimo di risultati (default: 10)")
+    args = parser.parse_args(argv)
+    
+    registro = RegistroClienti(args.cartella)
+    if args.comando == "importa":
+        cambiati = registro.importa_cartella(args.fatture)
+        registro.salva()
+        print(f"Clienti aggiornati: {cambiati}, in anagrafica: {len(registro)}")
+    elif args.comando == "cerca":
+        risultati = registro.cerca(args.testo, args.limite)
+        for cliente in risultati:
+            print(f"{cliente['chiave']:<18} {cliente['ragione_sociale'][:40]:<40} {cliente['citta']}")
+        if not risultati:
+            print("Nessun cliente trovato")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Archivio compatto delle fatture
+Un file ZIP con le fatture del formato salva_dati ridotte all'essenziale: aziende e
+clienti salvati una volta sola e richiamati per numero, righe prodotto per colonne,
+fatture raggruppate in blocchi compressi. Una fattura si legge decomprimendo solo il
+suo blocco; la conversione è senza perdite (stesse chiavi, stesso ordine, stessi valori).
+
+    python fattura_compatto.py comprimi fatture/ fatture_2024.zip
+    python fattura_compatto.py mostra fatture_2024.zip 2024/0042
+    python fattura_compatto.py estrai fatture_2024.zip ripristino/
+"""
+
+import argparse
+import json
+import os
+import secrets
+import sys
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fattura_io import scrivi_json_atomico
+
+
+FORMATO = "fattura-compatto"
+VERSIONE = 1
+FATTURE_PER_BLOCCO = 64
+INDICE = "indice.json"
+SOGGETTI = "soggetti.json"
+RIFERIMENTI = ("azienda", "cliente")  # blocchi anagrafici deduplicati
+
+
+def _json(valore) -> str:
+    """JSON compatto, senza spazi e con l'ordine delle chiavi originale"""
+    return json.dumps(valore, ensure_ascii=False, separators=(",", ":"))
+
+
+def _membro_blocco(n: int) -> str:
+    return f"blocchi/{n:06d}.json"
+
+
+class ScrittoreCompatto:
+    """Scrive un archivio compatto una fattura alla volta
+    
+    In memoria restano solo il blocco in corso e le anagrafiche già viste.
+    Il file viene scritto accanto alla destinazione e rinominato alla chiusura,
+    quindi un archivio esistente non resta mai a metà.
+    
+    Struttura del blocco:
+    - fatture: il dizionario di ogni fattura con azienda/cliente sostituiti
+      dal numero del soggetto e i prodotti tolti;
+    - schemi/colonne: le righe prodotto di tutto il blocco, raggruppate per
+      elenco di chiavi e memorizzate per colonna (una lista per chiave).
+    Le fatture con prodotti non in forma di lista di dizionari li conservano tali e quali.
+    """
+    
+    def __init__(self, path, fatture_per_blocco: int = FATTURE_PER_BLOCCO):
+        self.path = Path(path)
+        self.fatture_per_blocco = max(1, fatture_per_blocco)
+        self._tmp = self.path.parent / f".{self.path.name}.{secrets.token_hex(6)}.tmp"
+        self._zip = zipfile.ZipFile(self._tmp, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9)
+        self._soggetti: List[Dict] = []
+        self._id_soggetto: Dict[str, int] = {}
+        self._voci: List[Dict] = []
+        self._blocco: List[Dict] = []
+        self._n_blocchi = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, tipo, *exc):
+        if tipo is None:
+            self.chiudi()
+        else:
+            self.annulla()
+    
+    def __len__(self):
+        return len(self._voci)
+    
+    def _soggetto(self, record: Dict) -> int:
+        """Numero del soggetto nella tabella condivisa (aggiunto se nuovo)"""
+        chiave = _json(record)
+        n = self._id_soggetto.get(chiave)
+        if n is None:
+            n = self._id_soggetto[chiave] = len(self._soggetti)
+            self._soggetti.append(record)
+        return n
+    
+    def aggiungi(self, data: Dict, file: Optional[str] = None):
+        """Aggiunge una fattura (dizionario salva_dati); file è il nome da usare in estrazione"""
+        if not isinstance(data, dict):
+            raise ValueError("la fattura non è un oggetto JSON")
+        fattura = data.get("fattura") if isinstance(data.get("fattura"), dict) else {}
+        self._voci.append({
+            "tipo": fattura.get("tipo") or "Fattura",
+            "numero": fattura.get("numero", ""),
+            "data": fattura.get("data", ""),
+            "file": Path(file).name if file else None,
+            "blocco": self._n_blocchi,
+            "posizione": len(self._blocco),
+        })
+        self._blocco.append(data)
+        if len(self._blocco) >= self.fatture_per_blocco:
+            self._scrivi_blocco()
+    
+    def _scrivi_blocco(self):
+        if not self._blocco:
+            return
+        fatture = []
+        schemi: Dict[Tuple[str, ...], int] = {}
+        colonne: List[List[list]] = []
+        for data in self._blocco:
+            compatta = {}
+            rif = []
+            for chiave, valore in data.items():
+                if chiave in RIFERIMENTI and isinstance(valore, dict):
+                    compatta[chiave] = self._soggetto(valore)
+                    rif.append(chiave)
+                else:
+                    compatta[chiave] = valore
+            voce = {"d": compatta}
+            if rif:
+                voce["rif"] = rif
+            prodotti = data.get("prodotti")
+            if isinstance(prodotti, list) and all(isinstance(p, dict) for p in prodotti):
+                # Ogni riga va nelle colonne del suo schema; la fattura tiene gli schemi in ordine
+                righe = []
+                for p in prodotti:
+                    schema = tuple(p)
+                    s = schemi.get(schema)
+                    if s is None:
+                        s = schemi[schema] = len(colonne)
+                        colonne.append([[] for _ in schema])
+                    for colonna, valore in zip(colonne[s], p.values()):
+                        colonna.append(valore)
+                    righe.append(s)
+                compatta["prodotti"] = None
+                voce["righe"] = righe
+            fatture.append(voce)
+        blocco = {"fatture": fatture, "schemi": [list(s) for s in schemi], "colonne": colonne}
+        self._zip.writestr(_membro_blocco(self._n_blocchi), _json(blocco))
+        self._n_blocchi += 1
+        self._blocco = []
+    
+    def chiudi(self):
+        """Scrive l'ultimo blocco, anagrafiche e indice, e pubblica l'archivio"""
+        try:
+            self._scrivi_blocco()
+            self._zip.writestr(SOGGETTI, _json(self._soggetti))
+            self._zip.writestr(INDICE, _json({
+                "formato": FORMATO,
+                "versione": VERSIONE,
+                "blocchi": self._n_blocchi,
+                "fatture": self._voci,
+            }))
+            self._zip.close()
+            with open(self._tmp, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(self._tmp, self.path)
+        except BaseException:
+            self.annulla()
+            raise
+    
+    def annulla(self):
+        """Abbandona la scrittura senza toccare la destinazione"""
+        self._zip.close()
+        try:
+            os.unlink(self._tmp)
+        except OSError:
+            pass
+
+
+def _inizi_righe(blocco: Dict) -> List[List[int]]:
+    """Per ogni fattura del blocco, la posizione della sua prima riga in ogni schema"""
+    cursori = [0] * len(blocco["schemi"])
+    inizi = []
+    for voce in blocco["fatture"]:
+        inizi.append(list(cursori))
+        for s in voce.get("righe", ()):
+            cursori[s] += 1
+    return inizi
+
+
+def _espandi(blocco: Dict, posizione: int, inizi: List[int], soggetti: List[Dict]) -> Dict:
+    """Ricostruisce il dizionario salva_dati di una fattura del blocco"""
+    voce = blocco["fatture"][posizione]
+    data = dict(voce["d"])
+    for chiave in voce.get("rif", ()):
+        data[chiave] = dict(soggetti[data[chiave]])
+    if "righe" in voce:
+        schemi = blocco["schemi"]
+        colonne = blocco["colonne"]
+        cursori = list(inizi)
+        prodotti = []
+        for s in voce["righe"]:
+            i = cursori[s]
+            prodotti.append({campo: colonna[i] for campo, colonna in zip(schemi[s], colonne[s])})
+            cursori[s] = i + 1
+        data["prodotti"] = prodotti
+    return data
+
+
+class ArchivioCompatto:
+    """Lettura di un archivio compatto
+    
+    All'apertura si leggono solo indice e anagrafiche; leggi() decomprime il
+    blocco della fattura richiesta e ricostruisce solo quella. L'ultimo blocco
+    letto resta in memoria, così le letture in sequenza non lo decomprimono di nuovo.
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self._zip = zipfile.ZipFile(self.path, 'r')
+        try:
+            indice = json.loads(self._zip.read(INDICE))
+            if indice.get("formato") != FORMATO:
+                raise ValueError(f"{self.path} non è un archivio compatto di Fattura Pro")
+            if indice.get("versione", 0) > VERSIONE:
+                raise ValueError(f"{self.path}: versione {indice['versione']} non supportata")
+            self.voci: List[Dict] = indice["fatture"]
+            self._soggetti: List[Dict] = json.loads(self._zip.read(SOGGETTI))
+        except (KeyError, ValueError):
+            self._zip.close()
+            raise
+        # Con tipo e numero ripetuti vale l'ultima fattura, come nell'archivio SQLite
+        self._per_numero: Dict[Tuple[str, str], int] = {
+            (v["tipo"], v["numero"]): n for n, v in enumerate(self.voci)}
+        self._blocco_letto: Tuple[int, Dict, List[List[int]]] = (-1, {}, [])
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.chiudi()
+    
+    def chiudi(self):
+        """Chiude il file"""
+        self._zip.close()
+    
+    def __len__(self):
+        return len(self.voci)
+    
+    def _blocco(self, n: int) -> Tuple[int, Dict, List[List[int]]]:
+        if self._blocco_letto[0] != n:
+            blocco = json.loads(self._zip.read(_membro_blocco(n)))
+            self._blocco_letto = (n, blocco, _inizi_righe(blocco))
+        return self._blocco_letto
+    
+    def fattura(self, n: int) -> Dict:
+        """La n-esima fattura dell'archivio (un dizionario nuovo a ogni chiamata)"""
+        voce = self.voci[n]
+        _, blocco, inizi = self._blocco(voce["blocco"])
+        posizione = voce["posizione"]
+        return _espandi(blocco, posizione, inizi[posizione], self._soggetti)
+    
+    def leggi(self, numero: str, tipo: Optional[str] = None) -> Optional[Dict]:
+        """Fattura per numero (e tipo, se più documenti hanno lo stesso numero)"""
+        if tipo:
+            n = self._per_numero.get((tipo, numero))
+        else:
+            n = next((i for i in reversed(range(len(self.voci))) if self.voci[i]["numero"] == numero), None)
+        return self.fattura(n) if n is not None else None
+    
+    def __iter__(self) -> Iterator[Tuple[Dict, Dict]]:
+        """(voce dell'indice, fattura) in ordine, un blocco alla volta"""
+        for n, voce in enumerate(self.voci):
+            yield voce, self.fattura(n)
+
+
+def fatture_cartella(cartella, pattern: str = "fattura_*.json",
+                     errori: Optional[List[str]] = None) -> Iterator[Tuple[Path, Dict]]:
+    """(path, fattura) dei file JSON di una cartella, in ordine di nome
+    
+    I file illeggibili o che non contengono un oggetto JSON vengono saltati e
+    annotati in `errori`, se passata.
+    """
+    for path in sorted(Path(cartella).glob(pattern)):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("la fattura non è un oggetto JSON")
+        except (OSError, ValueError) as e:
+            if errori is not None:
+                errori.append(f"{path}: {e}")
+            continue
+        yield path, data
+
+
+def comprimi(fatture: Iterable[Tuple[Path, Dict]], destinazione,
+             fatture_per_blocco: int = FATTURE_PER_BLOCCO) -> int:
+    """Scrive un archivio compatto; restituisce il numero di fatture"""
+    with ScrittoreCompatto(destinazione, fatture_per_blocco) as scrittore:
+        for path, data in fatture:
+            scrittore.aggiungi(data, str(path))
+        return len(scrittore)
+
+
+def nome_estratto(voce: Dict) -> str:
+    """Nome del file JSON di una fattura estratta (quello originale, se noto)"""
+    if voce.get("file"):
+        return voce["file"]
+    return f"fattura_{str(voce['numero']).replace('/', '_')}.json"
+
+
+def estrai(archivio: ArchivioCompatto, cartella) -> int:
+    """Riscrive le fatture come file JSON nel formato salva_dati; restituisce quante"""
+    cartella = Path(cartella)
+    cartella.mkdir(parents=True, exist_ok=True)
+    n = 0
+    for voce, data in archivio:
+        scrivi_json_atomico(cartella / nome_estratto(voce), data, indent=2, fsync=False)
+        n += 1
+    return n
+
+
+def differenze(archivio: ArchivioCompatto, cartella) -> List[str]:
+    """Confronta l'archivio con i file JSON da cui è stato creato"""
+    errori = []
+    for voce, data in archivio:
+        path = Path(cartella) / nome_estratto(voce)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                originale = json.load(f)
+        except (OSError, ValueError) as e:
+            errori.append(f"{path}: {e}")
+            continue
+        # Confronto sul testo JSON: conta anche l'ordine delle chiavi
+        if _json(originale) != _json(data):
+            errori.append(f"{path}: contenuto diverso")
+    return errori
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Archivio compatto delle fatture")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    p = sub.add_parser("comprimi", help="Crea un archivio dai file fattura_*.json di una cartella")
+    p.add_argument("cartella")
+    p.add_argument("archivio")
+    p.add_argument("--blocco", type=int, default=FATTURE_PER_BLOCCO,
+                   help="Fatture per blocco compresso (default: %(default)s)")
+    p.add_argument("--verifica", action="store_true", help="Rilegge l'archivio e lo confronta con i file")
+    p = sub.add_parser("estrai", help="Riscrive le fatture come file JSON")
+    p.add_argument("archivio")
+    p.add_argument("cartella")
+    p = sub.add_parser("verifica", help="Confronta un archivio con la cartella da cui è stato creato")
+    p.add_argument("archivio")
+    p.add_argument("cartella")
+    p = sub.add_parser("mostra", help="Stampa il JSON di una fattura")
+    p.add_argument("archivio")
+    p.add_argument("numero")
+    p.add_argument("--tipo", help="Tipo documento (se lo stesso numero è usato da più tipi)")
+    p = sub.add_parser("elenco", help="Elenca le fatture dell'archivio")
+    p.add_argument("archivio")
+    args = parser.parse_args(argv)
+    
+    try:
+        if args.comando == "comprimi":
+            saltati: List[str] = []
+            n = comprimi(fatture_cartella(args.cartella, errori=saltati), args.archivio, args.blocco)
+            for errore in saltati:
+                print(f"✗ {errore}")
+            originale = sum(p.stat().st_size for p in Path(args.cartella).glob("fattura_*.json"))
+            compresso = Path(args.archivio).stat().st_size
+            print(f"Fatture: {n}, da {originale / 1024:.1f} KB a {compresso / 1024:.1f} KB "
+                  f"({compresso / originale:.1%})" if originale else f"Fatture: {n}")
+            if args.verifica:
+                with ArchivioCompatto(args.archivio) as archivio:
+                    errori = differenze(archivio, args.cartella)
+                for errore in errori:
+                    print(f"✗ {errore}")
+                print(f"Verifica: {n - len(errori)} fatture identiche, {len(errori)} diverse")
+                sys.exit(1 if errori or saltati else 0)
+            if saltati:
+                print(f"File saltati: {len(saltati)}")
+                sys.exit(1)
+            return
+        with ArchivioCompatto(args.archivio) as archivio:
+            if args.comando == "estrai":
+                print(f"Fatture estratte: {estrai(archivio, args.cartella)}")
+            elif args.comando == "verifica":
+                errori = differenze(archivio, args.cartella)
+                for errore in errori:
+                    print(f"✗ {errore}")
+                print(f"Fatture identiche: {len(archivio) - len(errori)}, diverse: {len(errori)}")
+                sys.exit(1 if errori else 0)
+            elif args.comando == "mostra":
+                data = archivio.leggi(args.numero, args.tipo)
+                if data is None:
+                    print(f"Fattura {args.numero} non trovata")
+                    sys.exit(1)
+                print(json.dumps(data, indent=2, ensure_ascii=False))
+            elif args.comando == "elenco":
+                for voce in archivio.voci:
+                    print(f"{voce['data']:<12}{voce['tipo']:<16}{voce['numero']}")
+                print(f"\nFatture: {len(archivio)}")
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
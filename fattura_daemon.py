@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Cartella osservata di Fattura Pro
+Processo senza interfaccia che osserva una cartella e genera il PDF di ogni fattura JSON
+che vi viene scritta. Su Linux usa inotify (via ctypes), altrove o con --polling rilegge
+la cartella a intervalli. Un file si elabora solo quando dimensione e data di modifica
+restano ferme per --attesa secondi, così una scrittura ancora in corso non viene letta a metà.
+
+    python fattura_daemon.py entrata/ -o pdf/ --metriche metriche.json
+
+Le fatture passano da entrata/lavorazione a entrata/elaborati (o entrata/errori, con il
+motivo in un file .errore.txt accanto); all'avvio quelle rimaste in lavorazione si riprendono.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import fnmatch
+import math
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from fattura_cache import CachePDF
+from fattura_engine import REPORTLAB_AVAILABLE, aggiungi_opzioni_cache, cache_da_opzioni, render_job
+from fattura_io import scrivi_atomico, scrivi_json_atomico
+from fattura_profilo import span
+
+
+ATTESA = 2.0  # secondi senza modifiche prima di leggere un file
+INTERVALLO_POLLING = 1.0
+INTERVALLO_RISCANSIONE = 30.0  # anche con inotify (cartelle di rete, eventi persi)
+INTERVALLO_METRICHE = 5.0
+FINESTRA_THROUGHPUT = 60.0
+
+LAVORAZIONE = "lavorazione"
+ELABORATI = "elaborati"
+ERRORI = "errori"
+
+# Costanti di <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+EVENTO = struct.Struct("iIII")  # wd, mask, cookie, len, poi il nome
+
+
+class Inotify:
+    """Osservatore inotify di una cartella tramite le funzioni di libc
+    
+    Solo Linux: altrove il costruttore solleva OSError e si passa al polling.
+    """
+    
+    def __init__(self, cartella: Path):
+        nome_libc = ctypes.util.find_library("c") or "libc.so.6"
+        try:
+            libc = ctypes.CDLL(nome_libc, use_errno=True)
+            init, aggiungi = libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise OSError(f"inotify non disponibile: {e}") from None
+        aggiungi.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 fallita")
+        maschera = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY | IN_DELETE_SELF | IN_MOVE_SELF
+        if aggiungi(self.fd, os.fsencode(cartella), maschera) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch fallita su {cartella}")
+    
+    def fileno(self) -> int:
+        return self.fd
+    
+    def leggi(self) -> Tuple[Set[str], bool]:
+        """Nomi dei file toccati dagli eventi in attesa e True se serve rileggere la cartella
+        
+        (coda di eventi traboccata, oppure la cartella osservata è stata spostata o rimossa)
+        """
+        nomi: Set[str] = set()
+        riscansione = False
+        while True:
+            try:
+                dati = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + EVENTO.size <= len(dati):
+                _, maschera, _, lunghezza = EVENTO.unpack_from(dati, pos)
+                pos += EVENTO.size
+                nome = dati[pos:pos + lunghezza].rstrip(b"\0")
+                pos += lunghezza
+                if maschera & (IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    riscansione = True
+                elif nome:
+                    nomi.add(os.fsdecode(nome))
+        return nomi, riscansione
+    
+    def chiudi(self):
+        os.close(self.fd)
+
+
+class Metriche:
+    """Contatori e tempi del daemon: ricevute, completate, fallite, throughput e latenza
+    
+    La latenza va da quando il file è pronto (fine dell'attesa) alla fine della
+    generazione, quindi comprende il tempo in coda.
+    """
+    
+    def __init__(self):
+        self.avvio = time.time()
+        self.ricevute = 0
+        self.completate = 0
+        self.fallite = 0
+        self._fine: Deque[float] = deque()  # istanti di completamento nella finestra
+        self._latenze: Deque[float] = deque(maxlen=1000)  # ms, ultime fatture
+    
+    def completata(self, ok: bool, latenza_s: float):
+        adesso = time.monotonic()
+        if ok:
+            self.completate += 1
+        else:
+            self.fallite += 1
+        self._fine.append(adesso)
+        self._latenze.append(latenza_s * 1000)
+    
+    def istantanea(self, in_attesa: int, in_coda: int, in_corso: int, workers: int) -> Dict:
+        """Stato corrente (per il file delle metriche e il log)"""
+        limite = time.monotonic() - FINESTRA_THROUGHPUT
+        while self._fine and self._fine[0] < limite:
+            self._fine.popleft()
+        latenze = sorted(self._latenze)
+        n = len(latenze)
+        return {
+            "t": time.time(),
+            "attivo_da_s": round(time.time() - self.avvio, 1),
+            "ricevute": self.ricevute,
+            "completate": self.completate,
+            "fallite": self.fallite,
+            "in_attesa": in_attesa,
+            "in_coda": in_coda,
+            "in_corso": in_corso,
+            "workers": workers,
+            "fatture_al_minuto": len(self._fine) * 60 / FINESTRA_THROUGHPUT,
+            "latenza_p50_ms": round(latenze[max(0, math.ceil(0.5 * n) - 1)], 1) if n else None,
+            "latenza_p99_ms": round(latenze[max(0, math.ceil(0.99 * n) - 1)], 1) if n else None,
+        }
+
+
+class CartellaOsservata:
+    """Daemon che genera i PDF delle fatture scritte in una cartella
+    
+    Un solo ciclo principale attende con select() gli eventi inotify, la fine
+    di un lavoro o di un segnale (una coppia di socket interna li risveglia:
+    su Windows select() accetta solo socket, non pipe) e la scadenza
+    dell'attesa dei file. Al pool di processi non vanno mai più di
+    2 × workers fatture: le altre restano in coda e contano nella profondità.
+    """
+    
+    def __init__(self, cartella, output_dir=None, workers: int = 1, pattern: str = "*.json",
+                 attesa: float = ATTESA, polling: bool = False, cache: Optional[CachePDF] = None,
+                 metriche: Optional[str] = None, intervallo_metriche: float = INTERVALLO_METRICHE,
+                 silenzioso: bool = False):
+        self.cartella = Path(cartella)
+        self.output_dir = Path(output_dir) if output_dir else self.cartella / "pdf"
+        self.lavorazione = self.cartella / LAVORAZIONE
+        self.elaborati = self.cartella / ELABORATI
+        self.errori = self.cartella / ERRORI
+        for sottocartella in (self.output_dir, self.lavorazione, self.elaborati, self.errori):
+            sottocartella.mkdir(parents=True, exist_ok=True)
+        self.workers = max(1, workers)
+        self.pattern = pattern
+        self.attesa = attesa
+        self.cache = cache
+        self.file_metriche = metriche
+        self.intervallo_metriche = intervallo_metriche
+        self.silenzioso = silenzioso
+        self.metriche = Metriche()
+        
+        self.inotify: Optional[Inotify] = None
+        if not polling:
+            try:
+                self.inotify = Inotify(self.cartella)
+            except OSError as e:
+                self._log(f"Polling ogni {INTERVALLO_POLLING:g} s ({e})")
+        self._risveglio_r, self._risveglio_w = socket.socketpair()
+        self._risveglio_r.setblocking(False)
+        self._risveglio_w.setblocking(False)
+        
+        self.in_attesa: Dict[str, List] = {}  # nome -> [(dimensione, mtime_ns), ultima modifica]
+        self.coda: Deque[Tuple[Path, float]] = deque()  # (file in lavorazione, pronto da)
+        self.in_corso: Dict[Future, Tuple[Path, float, ProcessPoolExecutor]] = {}
+        # Fatture in corso quando un worker è morto: si riprovano una alla volta per trovare il colpevole
+        self.sospette: Set[Path] = set()
+        self.fermo = False
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._ultima_scansione = 0.0
+        self._ultime_metriche = 0.0
+    
+    def _log(self, messaggio: str):
+        if not self.silenzioso:
+            print(messaggio, flush=True)
+    
+    def _sveglia(self, *_):
+        try:
+            self._risveglio_w.send(b"\0")
+        except OSError:
+            pass  # buffer pieno (il ciclo è già stato svegliato) o socket già chiuso
+    
+    def ferma(self, *_):
+        """Chiede l'arresto: i lavori in corso vengono completati (anche da un gestore di segnale)"""
+        self.fermo = True
+        self._sveglia()
+    
+    def _accetta(self, nome: str) -> bool:
+        # File nascosti e temporanei sono scritture in corso di altri programmi
+        return (not nome.startswith(".") and not nome.endswith((".tmp", ".part", "~"))
+                and fnmatch.fnmatch(nome, self.pattern))
+    
+    def _segnala(self, nome: str, adesso: float):
+        """Un file è stato creato o modificato: (ri)parte la sua attesa"""
+        if not self._accetta(nome):
+            return
+        voce = self.in_attesa.get(nome)
+        if voce is None:
+            self.in_attesa[nome] = [None, adesso]
+        else:
+            voce[1] = adesso
+    
+    def _scansiona(self, adesso: float):
+        """Rilegge la cartella: i file non ancora noti entrano in attesa"""
+        self._ultima_scansione = adesso
+        try:
+            with os.scandir(self.cartella) as voci:
+                for voce in voci:
+                    if voce.name not in self.in_attesa and voce.is_file(follow_symlinks=False):
+                        self._segnala(voce.name, adesso)
+        except FileNotFoundError:
+            self._log(f"Cartella {self.cartella} non trovata")
+    
+    def _controlla_attese(self, adesso: float):
+        """Sposta in lavorazione i file fermi da almeno `attesa` secondi"""
+        for nome, voce in list(self.in_attesa.items()):
+            if adesso - voce[1] < self.attesa and voce[0] is not None:
+                continue
+            path = self.cartella / nome
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                del self.in_attesa[nome]
+                continue
+            firma = (st.st_size, st.st_mtime_ns)
+            if firma != voce[0]:
+                voce[0], voce[1] = firma, adesso
+                continue
+            if adesso - voce[1] < self.attesa:
+                continue
+            del self.in_attesa[nome]
+            try:
+                destinazione = self._sposta(path, self.lavorazione)
+            except FileNotFoundError:
+                continue
+            self.metriche.ricevute += 1
+            self.coda.append((destinazione, adesso))
+    
+    def _sposta(self, path: Path, cartella: Path) -> Path:
+        """Sposta un file (rename atomica) senza sovrascrivere uno con lo stesso nome"""
+        destinazione = cartella / path.name
+        if destinazione.exists():
+            destinazione = cartella / f"{path.stem}.{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}{path.suffix}"
+            n = 1
+            while destinazione.exists():
+                destinazione = cartella / f"{destinazione.stem}-{n}{path.suffix}"
+                n += 1
+        os.replace(path, destinazione)
+        return destinazione
+    
+    def _avvia_lavori(self):
+        """Passa al pool le fatture in coda, senza superare 2 × workers lavori aperti
+        
+        Una fattura sospetta (in corso durante la morte di un worker) parte da
+        sola, a pool vuoto: se il pool si rompe di nuovo la colpa è sua.
+        """
+        while self.coda and len(self.in_corso) < 2 * self.workers and not self.fermo:
+            if any(voce[0] in self.sospette for voce in self.in_corso.values()):
+                break
+            path, pronto = self.coda[0]
+            if path in self.sospette and self.in_corso:
+                break
+            self.coda.popleft()
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            futuro = self._pool.submit(render_job, (path, self.output_dir, self.cache))
+            self.in_corso[futuro] = (path, pronto, self._pool)
+            futuro.add_done_callback(self._sveglia)
+    
+    def _raccogli(self):
+        """Archivia in elaborati/errori le fatture dei lavori terminati
+        
+        Quando un worker muore falliscono tutti i lavori del pool: si rimettono
+        in coda come sospette, e va in errori solo quella che lo rompe da sola.
+        """
+        da_riprovare = []
+        for futuro in [f for f in self.in_corso if f.done()]:
+            path, pronto, pool = self.in_corso.pop(futuro)
+            try:
+                risultato = futuro.result()
+            except BrokenProcessPool as e:
+                # Un worker è morto (ad es. memoria esaurita): il pool va ricreato
+                if pool is self._pool:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                if path not in self.sospette:
+                    self.sospette.add(path)
+                    da_riprovare.append((path, pronto))
+                    continue
+                risultato = {"ok": False, "errore": f"processo di generazione terminato: {e}"}
+            except Exception as e:
+                risultato = {"ok": False, "errore": str(e)}
+            with span("daemon.archivia", ok=risultato["ok"]):
+                try:
+                    if risultato["ok"]:
+                        self._sposta(path, self.elaborati)
+                    else:
+                        archiviato = self._sposta(path, self.errori)
+                        scrivi_atomico(archiviato.with_name(archiviato.name + ".errore.txt"),
+                                       risultato["errore"] + "\n", fsync=False)
+                except OSError as e:
+                    self._log(f"✗ {path.name}: impossibile archiviare il file ({e})")
+            self.sospette.discard(path)
+            self.metriche.completata(risultato["ok"], time.monotonic() - pronto)
+            if risultato["ok"]:
+                self._log(f"✓ {path.name} -> {risultato['output']}")
+            else:
+                self._log(f"✗ {path.name}: {risultato['errore']}")
+        if da_riprovare:
+            self._log(f"↻ worker terminato: {len(da_riprovare)} fatture di nuovo in coda, una alla volta")
+            self.coda.extendleft(reversed(da_riprovare))
+    
+    def stato(self) -> Dict:
+        """Metriche correnti: contatori, profondità della coda, throughput e latenza"""
+        return self.metriche.istantanea(len(self.in_attesa), len(self.coda), len(self.in_corso), self.workers)
+    
+    def _scrivi_metriche(self, adesso: float):
+        self._ultime_metriche = adesso
+        if self.file_metriche:
+            try:
+                scrivi_json_atomico(self.file_metriche, self.stato(), indent=2, fsync=False)
+            except OSError as e:
+                self._log(f"Metriche non scritte: {e}")
+    
+    def _timeout(self, adesso: float) -> float:
+        """Quanto può durare la prossima select() senza far ritardare nulla"""
+        limiti = [self._ultima_scansione + (INTERVALLO_POLLING if self.inotify is None else INTERVALLO_RISCANSIONE)]
+        if self.file_metriche:
+            limiti.append(self._ultime_metriche + self.intervallo_metriche)
+        if self.in_attesa:
+            limiti.append(min(voce[1] for voce in self.in_attesa.values()) + self.attesa)
+        return min(max(0.0, min(limiti) - adesso), INTERVALLO_RISCANSIONE)
+    
+    def esegui(self, durata: Optional[float] = None):
+        """Ciclo principale, fino a ferma() (o per `durata` secondi)"""
+        fine = time.monotonic() + durata if durata is not None else None
+        # Fatture rimaste in lavorazione da un'esecuzione interrotta
+        for path in sorted(self.lavorazione.iterdir()):
+            if path.is_file():
+                self.metriche.ricevute += 1
+                self.coda.append((path, time.monotonic()))
+        self._scansiona(time.monotonic())
+        modo = "inotify" if self.inotify is not None else "polling"
+        self._log(f"In ascolto su {self.cartella} ({modo}, {self.workers} worker, PDF in {self.output_dir})")
+        try:
+            while not self.fermo:
+                adesso = time.monotonic()
+                if fine is not None and adesso >= fine:
+                    break
+                self._controlla_attese(adesso)
+                self._avvia_lavori()
+                timeout = self._timeout(adesso)
+                if fine is not None:
+                    timeout = min(timeout, max(0.0, fine - adesso))
+                sorgenti = [self._risveglio_r] + ([self.inotify.fileno()] if self.inotify else [])
+                try:
+                    pronti, _, _ = select.select(sorgenti, [], [], timeout)
+                except InterruptedError:
+                    pronti = []
+                adesso = time.monotonic()
+                if self._risveglio_r in pronti:
+                    try:
+                        while self._risveglio_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                if self.inotify is not None and self.inotify.fileno() in pronti:
+                    nomi, riscansione = self.inotify.leggi()
+                    for nome in nomi:
+                        self._segnala(nome, adesso)
+                    if riscansione:
+                        self._scansiona(adesso)
+                if adesso - self._ultima_scansione >= (INTERVALLO_POLLING if self.inotify is None
+                                                       else INTERVALLO_RISCANSIONE):
+                    self._scansiona(adesso)
+                self._raccogli()
+                if self.file_metriche and adesso - self._ultime_metriche >= self.intervallo_metriche:
+                    self._scrivi_metriche(adesso)
+        finally:
+            self.chiudi()
+    
+    def chiudi(self):
+        """Attende i lavori in corso, archivia i loro file e libera le risorse
+        
+        Le fatture ancora in coda restano in lavorazione e si riprendono al prossimo avvio.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self._raccogli()
+        self._scrivi_metriche(time.monotonic())
+        if self.inotify is not None:
+            self.inotify.chiudi()
+            self.inotify = None
+        self._risveglio_r.close()
+        self._risveglio_w.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Genera i PDF delle fatture JSON scritte in una cartella")
+    parser.add_argument("cartella", help="Cartella osservata")
+    parser.add_argument("-o", "--output", help="Cartella dei PDF (default: CARTELLA/pdf)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                       help="Processi di generazione (default: numero di CPU)")
+    parser.add_argument("--pattern", default="*.json", help="File da elaborare (default: %(default)s)")
+    parser.add_argument("--attesa", type=float, default=ATTESA,
+                       help="Secondi senza modifiche prima di leggere un file (default: %(default)g)")
+    parser.add_argument("--polling", action="store_true", help="Rilegge la cartella invece di usare inotify")
+    parser.add_argument("--metriche", metavar="FILE", help="Scrive qui le metriche in JSON")
+    parser.add_argument("--intervallo-metriche", type=float, default=INTERVALLO_METRICHE,
+                       help="Secondi tra due aggiornamenti delle metriche (default: %(default)g)")
+    parser.add_argument("-q", "--silenzioso", action="store_true", help="Non stampa una riga per fattura")
+    aggiungi_opzioni_cache(parser)
+    args = parser.parse_args(argv)
+    
+    if not REPORTLAB_AVAILABLE:
+        print("Errore: reportlab non installato!\nInstalla con: pip install reportlab")
+        sys.exit(1)
+    
+    daemon = CartellaOsservata(args.cartella, args.output, args.workers, args.pattern, args.attesa,
+                               args.polling, cache_da_opzioni(args), args.metriche,
+                               args.intervallo_metriche, args.silenzioso)
+    signal.signal(signal.SIGTERM, daemon.ferma)
+    signal.signal(signal.SIGINT, daemon.ferma)
+    daemon.esegui()
+    stato = daemon.stato()
+    print(f"\nFatture generate: {stato['completate']}, errori: {stato['fallite']}, "
+          f"rimaste in coda: {stato['in_coda']}")
+
+
+if __name__ == "__main__":
+    main()
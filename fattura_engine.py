@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Fattura Engine - Generazione PDF delle fatture senza interfaccia grafica
+Riceve il dizionario fattura (lo stesso formato scritto da salva_dati) e restituisce il PDF
+"""
+
+import argparse
+import importlib.util
+import io
+import json
+import os
+import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from fattura_cache import CACHE_DIR, DIMENSIONE_MAX, CachePDF, chiave_render
+from fattura_importi import RiepilogoIVA, da_centesimi
+from fattura_profilo import span
+
+
+# reportlab si importa al primo render: costa più dell'avvio dell'interfaccia
+# e molte sessioni non generano mai un PDF. Qui si verifica solo che sia installato.
+REPORTLAB_AVAILABLE = importlib.util.find_spec("reportlab") is not None
+_reportlab_caricato = False
+
+
+def carica_reportlab():
+    """Importa i moduli reportlab usati dal motore (solo la prima volta)"""
+    global _reportlab_caricato, A4, cm, colors, SimpleDocTemplate, Table, TableStyle
+    global Paragraph, Spacer, getSampleStyleSheet, ParagraphStyle, TA_CENTER
+    if _reportlab_caricato:
+        return
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("reportlab non installato! Installa con: pip install reportlab")
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER
+    _reportlab_caricato = True
+
+
+def nome_pdf(data: Dict) -> str:
+    """Nome del file PDF per una fattura (stesso schema di genera_pdf)"""
+    numero = data.get("fattura", {}).get("numero", "")
+    return f"Fattura_{numero.replace('/', '_')}.pdf"
+
+
+def normalizza_fattura(data: Dict) -> Dict:
+    """Completa il dizionario fattura con i campi mancanti"""
+    fattura = data.get("fattura", {})
+    banca = data.get("banca", {})
+    return {
+        "azienda": dict(data.get("azienda", {})),
+        "cliente": dict(data.get("cliente", {})),
+        "fattura": {
+            "tipo": fattura.get("tipo") or "Fattura",
+            "numero": fattura.get("numero", ""),
+            "data": fattura.get("data", ""),
+            "scadenza": fattura.get("scadenza", ""),
+            "condizioni": fattura.get("condizioni", ""),
+            "causale": fattura.get("causale", ""),
+            "note": fattura.get("note", "")
+        },
+        "banca": {
+            "iban": banca.get("iban", ""),
+            "nome": banca.get("nome", "")
+        },
+        "prodotti": list(data.get("prodotti", []))
+    }
+
+
+# Da incrementare a ogni modifica del layout PDF: invalida i PDF nella cache
+TEMPLATE_VERSION = "2"
+
+
+def chiave_pdf(data: Dict) -> str:
+    """Chiave della cache PDF: fattura normalizzata più versione del template"""
+    return chiave_render(normalizza_fattura(data), TEMPLATE_VERSION)
+
+
+class TemplateFattura(NamedTuple):
+    """Parte invariante del layout PDF: stili e comandi delle tabelle
+    
+    Viene costruito una volta per processo (vedi get_template) e condiviso
+    da tutte le fatture; per ogni fattura si costruisce solo la story.
+    """
+    title_style: object
+    header_style: object
+    footer_style: object
+    dati_table_style: object
+    dettagli_table_style: object
+    prodotti_table_style: object
+    riepilogo_table_style: object
+    prodotti_col_widths: Tuple
+
+
+def crea_template() -> TemplateFattura:
+    """Costruisce stili e comandi tabella del layout fattura"""
+    carica_reportlab()
+    styles = getSampleStyleSheet()
+    
+    # Stili personalizzati
+    title_style = ParagraphStyle(
+        'Title',
+        parent=styles['Heading1'],
+        fontSize=28,
+        textColor=colors.HexColor('#1e40af'),
+        spaceAfter=20,
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold'
+    )
+    
+    header_style = ParagraphStyle(
+        'Header',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#374151'),
+        spaceAfter=5,
+        fontName='Helvetica'
+    )
+    
+    footer_style = ParagraphStyle('Footer', parent=styles['Normal'],
+                                  fontSize=8, textColor=colors.grey,
+                                  alignment=TA_CENTER)
+    
+    dati_table_style = TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 0),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+    ])
+    
+    dettagli_table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e5e7eb')),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#1f2937')),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+        ('BACKGROUND', (1, 0), (1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#d1d5db')),
+    ])
+    
+    # Righe prodotto: stile indipendente dal numero di righe (intestazione ripetuta)
+    prodotti_table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('ALIGN', (1, 0), (1, -1), 'LEFT'),
+        ('ALIGN', (4, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9fafb')]),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e5e7eb')),
+    ])
+    
+    # Riepilogo IVA e totali: le ultime tre righe sono sempre i totali generali
+    riepilogo_table_style = TableStyle([
+        ('ALIGN', (4, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (4, 0), (-1, -1), 'Helvetica-Bold'),
+        ('GRID', (4, 0), (-1, -1), 0.5, colors.HexColor('#e5e7eb')),
+        ('FONTSIZE', (4, -3), (-1, -1), 11),
+        ('BACKGROUND', (4, -3), (-1, -1), colors.HexColor('#fef3c7')),
+        ('TEXTCOLOR', (4, -1), (-1, -1), colors.HexColor('#1e40af')),
+        ('FONTSIZE', (4, -1), (-1, -1), 14),
+    ])
+    
+    return TemplateFattura(
+        title_style=title_style,
+        header_style=header_style,
+        footer_style=footer_style,
+        dati_table_style=dati_table_style,
+        dettagli_table_style=dettagli_table_style,
+        prodotti_table_style=prodotti_table_style,
+        riepilogo_table_style=riepilogo_table_style,
+        prodotti_col_widths=(1*cm, 7*cm, 1.5*cm, 2*cm, 1.5*cm, 2.5*cm),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_template() -> TemplateFattura:
+    """Template condiviso, costruito alla prima fattura del processo"""
+    return crea_template()
+
+
+INTESTAZIONE_PRODOTTI = ["#", "Descrizione", "Q.tà", "Prezzo Unit.", "IVA %", "Totale"]
+
+# Righe prodotto per tabella: le fatture molto lunghe diventano più tabelle
+# con l'intestazione ripetuta, invece di un'unica tabella da migliaia di righe
+RIGHE_PER_TABELLA = 250
+
+
+def tabelle_prodotti(prodotti: List[Dict], template: TemplateFattura,
+                     righe_per_tabella: int = RIGHE_PER_TABELLA,
+                     riepilogo_iva: Optional[RiepilogoIVA] = None) -> List:
+    """Costruisce in un solo passaggio le tabelle righe prodotto e il riepilogo IVA
+    
+    Se riepilogo_iva è già disponibile (ad es. dal ModelloFattura della GUI)
+    i totali non vengono ricalcolati.
+    """
+    carica_reportlab()
+    calcola_riepilogo = riepilogo_iva is None
+    if calcola_riepilogo:
+        riepilogo_iva = RiepilogoIVA()
+    col_widths = list(template.prodotti_col_widths)
+    tabelle = []
+    righe = [INTESTAZIONE_PRODOTTI]
+    
+    for i, p in enumerate(prodotti, 1):
+        righe.append([
+            str(i),
+            p['descrizione'],
+            f"{p['quantita']:.2f}",
+            f"€ {p['prezzo']:.2f}",
+            f"{p['iva']:.0f}%",
+            f"€ {p['totale']:.2f}"
+        ])
+        if calcola_riepilogo:
+            riepilogo_iva.aggiungi(p)
+        
+        if len(righe) > righe_per_tabella:
+            tabelle.append(_tabella_righe(righe, col_widths, template))
+            righe = [INTESTAZIONE_PRODOTTI]
+    
+    if len(righe) > 1 or not tabelle:
+        tabelle.append(_tabella_righe(righe, col_widths, template))
+    
+    # Totali per aliquota IVA e totali generali, calcolati una sola volta
+    riepilogo = []
+    for voce in riepilogo_iva.per_aliquota():
+        aliquota = voce["aliquota"]
+        riepilogo.append(["", "", "", "", f"Imponibile {aliquota:.0f}%:", f"€ {da_centesimi(voce['imponibile']):.2f}"])
+        riepilogo.append(["", "", "", "", f"IVA {aliquota:.0f}%:", f"€ {da_centesimi(voce['iva']):.2f}"])
+    totale_imponibile, totale_iva, totale_generale = riepilogo_iva.totali()
+    riepilogo.append(["", "", "", "", "Totale Imponibile:", f"€ {da_centesimi(totale_imponibile):.2f}"])
+    riepilogo.append(["", "", "", "", "Totale IVA:", f"€ {da_centesimi(totale_iva):.2f}"])
+    riepilogo.append(["", "", "", "", "TOTALE FATTURA:", f"€ {da_centesimi(totale_generale):.2f}"])
+    
+    riepilogo_table = Table(riepilogo, colWidths=col_widths)
+    riepilogo_table.setStyle(template.riepilogo_table_style)
+    tabelle.append(Spacer(1, 0.2*cm))
+    tabelle.append(riepilogo_table)
+    return tabelle
+
+
+def _tabella_righe(righe: List[List[str]], col_widths: List[float], template: TemplateFattura):
+    """Tabella di righe prodotto con intestazione ripetuta sulle pagine successive"""
+    table = Table(righe, colWidths=col_widths, repeatRows=1)
+    table.setStyle(template.prodotti_table_style)
+    return table
+
+
+def render_pdf(data: Dict, template: Optional[TemplateFattura] = None,
+               riepilogo_iva: Optional[RiepilogoIVA] = None,
+               progresso: Optional[Callable[[float], None]] = None) -> bytes:
+    """Crea un PDF professionale con design italiano e ne restituisce i byte
+    
+    progresso, se indicato, viene chiamato dopo ogni elemento impaginato con la
+    frazione completata (0-1); può sollevare un'eccezione per interrompere.
+    """
+    with span("render.setup"):
+        carica_reportlab()
+        template = template or get_template()
+        title_style = template.title_style
+        header_style = template.header_style
+    
+    with span("render.testata"):
+        data = normalizza_fattura(data)
+        azienda = data["azienda"]
+        cliente = data["cliente"]
+        fattura = data["fattura"]
+        banca = data["banca"]
+        
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4,
+                               rightMargin=2*cm, leftMargin=2*cm,
+                               topMargin=2*cm, bottomMargin=2*cm)
+        story = []
+        
+        # Titolo
+        story.append(Paragraph(f"<b>{fattura['tipo'].upper()}</b>", title_style))
+        story.append(Spacer(1, 0.3*cm))
+        
+        # Linea decorativa
+        story.append(Spacer(1, 0.2*cm))
+        
+        # Dati azienda e cliente in due colonne
+        azienda_text = f"""
+        <b>{azienda.get('ragione_sociale', '')}</b><br/>
+        {azienda.get('indirizzo', '')}<br/>
+        {azienda.get('cap', '')} {azienda.get('citta', '')}
+        {f"({azienda['provincia']})" if azienda.get('provincia') else ""}<br/>
+        P.IVA: {azienda.get('p_iva', '')}<br/>
+        {f"CF: {azienda['codice_fiscale']}<br/>" if azienda.get('codice_fiscale') else ""}
+        {f"PEC: {azienda['pec']}<br/>" if azienda.get('pec') else ""}
+        {f"Tel: {azienda['telefono']}<br/>" if azienda.get('telefono') else ""}
+        {f"Email: {azienda['email']}" if azienda.get('email') else ""}
+        """
+        
+        cliente_text = f"""
+        <b>Cliente:</b><br/>
+        {cliente.get('ragione_sociale', '')}<br/>
+        {cliente.get('indirizzo', '')}<br/>
+        {cliente.get('cap', '')} {cliente.get('citta', '')}
+        {f"({cliente['provincia']})" if cliente.get('provincia') else ""}<br/>
+        {f"P.IVA: {cliente['p_iva']}<br/>" if cliente.get('p_iva') else ""}
+        {f"CF: {cliente['codice_fiscale']}<br/>" if cliente.get('codice_fiscale') else ""}
+        {f"Cod. Dest.: {cliente['codice_destinatario']}" if cliente.get('codice_destinatario') else ""}
+        """
+        
+        # Tabella a due colonne
+        dati_table_data = [
+            [Paragraph(azienda_text, header_style), Paragraph(cliente_text, header_style)]
+        ]
+        dati_table = Table(dati_table_data, colWidths=[9*cm, 9*cm])
+        dati_table.setStyle(template.dati_table_style)
+        story.append(dati_table)
+        story.append(Spacer(1, 0.5*cm))
+        
+        # Dettagli fattura
+        dettagli_data = [
+            ["<b>Numero Fattura:</b>", fattura["numero"]],
+            ["<b>Data Fattura:</b>", fattura["data"]],
+            ["<b>Data Scadenza:</b>", fattura["scadenza"] or "N/A"],
+            ["<b>Pagamento:</b>", fattura["condizioni"] or "N/A"],
+        ]
+        
+        dettagli_table = Table(dettagli_data, colWidths=[5*cm, 13*cm])
+        dettagli_table.setStyle(template.dettagli_table_style)
+        story.append(dettagli_table)
+        story.append(Spacer(1, 0.5*cm))
+    
+    with span("render.tabelle", righe=len(data["prodotti"])):
+        # Tabella prodotti
+        story.extend(tabelle_prodotti(data["prodotti"], template, riepilogo_iva=riepilogo_iva))
+        story.append(Spacer(1, 0.5*cm))
+    
+    with span("render.piede"):
+        # Dati bancari
+        if banca["iban"] or banca["nome"]:
+            banca_text = f"<b>Dati Bancari:</b><br/>"
+            if banca["nome"]:
+                banca_text += f"Banca: {banca['nome']}<br/>"
+            if banca["iban"]:
+                banca_text += f"IBAN: {banca['iban']}"
+            story.append(Paragraph(banca_text, header_style))
+            story.append(Spacer(1, 0.3*cm))
+        
+        # Note
+        if fattura["note"]:
+            story.append(Paragraph(f"<b>Note:</b><br/>{fattura['note']}", header_style))
+            story.append(Spacer(1, 0.3*cm))
+        
+        # Causale
+        if fattura["causale"]:
+            story.append(Paragraph(f"<b>Causale:</b> {fattura['causale']}", header_style))
+        
+        # Footer: solo dati della fattura, così il PDF in cache resta identico a uno rigenerato
+        story.append(Spacer(1, 1*cm))
+        footer_text = f"<i>Documento del {fattura['data']} generato con Fattura Pro</i>"
+        story.append(Paragraph(footer_text, template.footer_style))
+    
+    if progresso is not None:
+        # Avanzamento pesato sulle righe: le tabelle prodotti sono la parte lenta
+        totale = sum(getattr(f, "_nrows", 1) for f in story)
+        impaginati = [0]
+        
+        def dopo_elemento(flowable):
+            # Le parti di una tabella divisa ripetono l'intestazione: si limita a 1
+            impaginati[0] += getattr(flowable, "_nrows", 1)
+            progresso(min(impaginati[0] / totale, 1.0))
+        
+        doc.afterFlowable = dopo_elemento
+        progresso(0.0)
+    
+    # Impaginazione: wrap/split delle tabelle e scrittura del PDF
+    with span("render.build", righe=len(data["prodotti"])):
+        doc.build(story)
+    return buffer.getvalue()
+
+
+def carica_fattura(path) -> Dict:
+    """Legge un file fattura JSON"""
+    with span("json.carica"), open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def render_file(path, output_dir, cache: Optional[CachePDF] = None) -> Path:
+    """Genera il PDF di un file fattura JSON nella cartella di output
+    
+    Con una cache, un PDF già generato per lo stesso contenuto viene riusato.
+    """
+    with span("render.file", file=str(path)) as fase:
+        data = carica_fattura(path)
+        output = Path(output_dir) / nome_pdf(data)
+        if cache is not None:
+            fase.imposta(cache=cache.genera(output, chiave_pdf(data), lambda: render_pdf(data)))
+            return output
+        pdf = render_pdf(data)
+        with span("pdf.scrivi", byte=len(pdf)), open(output, 'wb') as f:
+            f.write(pdf)
+    return output
+
+
+def trova_fatture(cartella) -> List[Path]:
+    """Elenca i file fattura_*.json di una cartella in ordine di nome"""
+    return sorted(Path(cartella).glob("fattura_*.json"))
+
+
+def render_job(job) -> Dict:
+    """Genera un singolo PDF catturando l'errore (eseguito anche nei processi worker)"""
+    path, output_dir, cache = job
+    hit = cache.hit if cache is not None else 0
+    try:
+        output = render_file(path, output_dir, cache)
+        risultato = {"file": str(path), "ok": True, "output": str(output), "errore": ""}
+    except Exception as e:
+        risultato = {"file": str(path), "ok": False, "output": "", "errore": str(e)}
+    if cache is not None:
+        risultato["cache"] = "hit" if cache.hit > hit else "miss"
+    return risultato
+
+
+def calcola_chunksize(n_job: int, workers: int) -> int:
+    """Dimensione dei blocchi di job inviati a ogni worker"""
+    # Circa 4 blocchi per worker: pochi scambi tra processi ma carico ancora bilanciato
+    return max(1, min(64, n_job // (workers * 4)))
+
+
+def render_batch(files, output_dir, workers: int = 1, chunksize: Optional[int] = None,
+                 cache: Optional[CachePDF] = None) -> List[Dict]:
+    """Genera i PDF di una lista di file fattura JSON
+    
+    Con workers > 1 i file vengono distribuiti su un pool di processi a blocchi
+    di chunksize. I risultati mantengono l'ordine dei file:
+    {"file", "ok", "output", "errore"}, più "cache" ("hit"/"miss") se si usa la cache.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(Path(f), output_dir, cache) for f in files]
+    
+    if workers <= 1 or len(jobs) <= 1:
+        with span("batch", fatture=len(jobs), workers=1):
+            return [render_job(job) for job in jobs]
+    
+    workers = min(workers, len(jobs))
+    if chunksize is None:
+        chunksize = calcola_chunksize(len(jobs), workers)
+    from concurrent.futures import ProcessPoolExecutor  # solo in modalità batch
+    with span("batch", fatture=len(jobs), workers=workers, chunksize=chunksize):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(render_job, jobs, chunksize=chunksize))
+
+
+def render_directory(cartella, output_dir=None, workers: int = 1, chunksize: Optional[int] = None,
+                     cache: Optional[CachePDF] = None) -> List[Dict]:
+    """Genera i PDF di tutte le fatture JSON di una cartella
+    
+    Restituisce un risultato per fattura, nello stesso ordine dei file:
+    {"file", "ok", "output", "errore"}
+    """
+    output_dir = Path(output_dir) if output_dir else Path(cartella)
+    return render_batch(trova_fatture(cartella), output_dir, workers, chunksize, cache)
+
+
+def stampa_risultati(risultati: Iterable[Dict]) -> int:
+    """Stampa il riepilogo di un batch (anche man mano che arriva) e restituisce il numero di errori"""
+    totale = errori = hit = con_cache = 0
+    for r in risultati:
+        totale += 1
+        if "cache" in r:
+            con_cache += 1
+            hit += r["cache"] == "hit"
+        if r["ok"]:
+            print(f"✓ {r['file']} -> {r['output']}" if r.get("output") else f"✓ {r['file']}")
+        else:
+            errori += 1
+            print(f"✗ {r['file']}: {r['errore']}")
+        if r.get("avviso"):
+            print(f"  ! {r['avviso']}")
+    print(f"\nFatture generate: {totale - errori}, errori: {errori}")
+    if con_cache:
+        print(f"Cache PDF: {hit} riutilizzati, {con_cache - hit} generati")
+    return errori
+
+
+def aggiungi_opzioni_cache(parser: argparse.ArgumentParser):
+    """Opzioni --cache / --cache-max-mb per i comandi batch"""
+    parser.add_argument("--cache", nargs="?", const=CACHE_DIR, metavar="CARTELLA",
+                       help=f"Riusa i PDF delle fatture invariate (default cartella: {CACHE_DIR})")
+    parser.add_argument("--cache-max-mb", type=float, default=DIMENSIONE_MAX / 1024 / 1024,
+                       help="Dimensione massima della cache in MB (default: %(default)g)")
+
+
+def cache_da_opzioni(args) -> Optional[CachePDF]:
+    """CachePDF secondo le opzioni, o None se --cache non è indicato"""
+    if not args.cache:
+        return None
+    return CachePDF(args.cache, int(args.cache_max_mb * 1024 * 1024))
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Genera i PDF delle fatture JSON senza interfaccia grafica")
+    parser.add_argument("cartella", help="Cartella con i file fattura_*.json")
+    parser.add_argument("-o", "--output", help="Cartella di destinazione dei PDF (default: la cartella di input)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                       help="Numero di processi di generazione (default: numero di CPU)")
+    parser.add_argument("--chunk", type=int, default=None,
+                       help="Fatture inviate a ogni processo per volta (default: automatico)")
+    aggiungi_opzioni_cache(parser)
+    args = parser.parse_args(argv)
+    
+    if not REPORTLAB_AVAILABLE:
+        print("Errore: reportlab non installato!\nInstalla con: pip install reportlab")
+        sys.exit(1)
+    
+    risultati = render_directory(args.cartella, args.output, args.workers, args.chunk, cache_da_opzioni(args))
+    errori = stampa_risultati(risultati)
+    sys.exit(1 if errori else 0)
+
+
+if __name__ == "__main__":
+    main()
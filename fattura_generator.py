@@ -6,21 +6,31 @@ Generatore di Fatture - Crea fatture professionali in PDF
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
+import importlib.util
 import json
 import os
 from pathlib import Path
 
 
-try:
+# reportlab si importa solo alla prima generazione del PDF (vedi carica_reportlab):
+# all'avvio basta sapere se è installato
+REPORTLAB_AVAILABLE = importlib.util.find_spec("reportlab") is not None
+_reportlab_caricato = False
+
+
+def carica_reportlab():
+    """Importa i moduli reportlab usati per il PDF (solo la prima volta)"""
+    global _reportlab_caricato, A4, cm, colors, SimpleDocTemplate, Table, TableStyle
+    global Paragraph, Spacer, getSampleStyleSheet, ParagraphStyle, TA_RIGHT, TA_CENTER
+    if _reportlab_caricato:
+        return
     from reportlab.lib.pagesizes import A4
     from reportlab.lib.units import cm
     from reportlab.lib import colors
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     from reportlab.lib.enums import TA_RIGHT, TA_CENTER
-    REPORTLAB_AVAILABLE = True
-except ImportError:
-    REPORTLAB_AVAILABLE = False
+    _reportlab_caricato = True
 
 
 class FatturaGenerator:
@@ -339,6 +349,7 @@ class FatturaGenerator:
     
     def create_pdf(self, filename):
         """Crea il file PDF"""
+        carica_reportlab()
         doc = SimpleDocTemplate(filename, pagesize=A4)
         story = []
         styles = getSampleStyleSheet()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Importazione fatture da CSV (export gestionale/ERP)
+Legge il file riga per riga, raggruppa le righe in fatture per cliente e numero,
+le valida e le passa a PDF, archivio SQLite e file JSON senza tenere il file in memoria
+"""
+
+import argparse
+import csv
+import json
+import re
+import sys
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fattura_engine import REPORTLAB_AVAILABLE, nome_pdf, render_pdf, stampa_risultati
+from fattura_archivio import DB_FILE, ArchivioFatture
+from fattura_importi import a_decimal, calcola_riga
+from fattura_io import scrivi_atomico, scrivi_json_atomico
+from fattura_validazione import errori_fattura
+
+
+SETTINGS_FILE = "fattura_pro_settings.json"
+
+# Colonne attese nel CSV (intestazione, maiuscole/minuscole indifferenti).
+# Le colonne cliente_* e banca_* finiscono nelle rispettive sezioni della fattura.
+COLONNE_FATTURA = ["tipo", "numero", "data", "scadenza", "condizioni", "causale", "note"]
+COLONNE_OBBLIGATORIE = ["numero", "data", "cliente_ragione_sociale", "descrizione", "quantita", "prezzo", "iva"]
+
+ALIQUOTE_AMMESSE = {0.0, 4.0, 5.0, 10.0, 22.0}
+DELIMITATORI = ";,\t|"
+BLOCCO_ARCHIVIO = 500  # fatture archiviate per transazione
+RE_DATA = re.compile(r"^\d{2}/\d{2}/\d{4}$")
+
+
+class ErroreImport(ValueError):
+    """Errore nel formato del file CSV"""
+
+
+def leggi_numero(testo: str) -> float:
+    """Numero dal CSV, anche in formato italiano (1.234,56); ValueError se non è un numero finito"""
+    testo = (testo or "").strip().replace("€", "").replace(" ", "")
+    if "," in testo and "." in testo:
+        testo = testo.replace(".", "")
+    numero = a_decimal(testo)
+    if not numero.is_finite():
+        raise ValueError(f"numero non valido: {testo}")
+    return float(numero)
+
+
+def apri_csv(path, encoding: str = "utf-8-sig", delimitatore: Optional[str] = None) -> Tuple:
+    """Apre il CSV e restituisce (file, reader) con il delimitatore rilevato dalla prima riga"""
+    f = open(path, 'r', encoding=encoding, newline="")
+    try:
+        if delimitatore is None:
+            intestazione = f.readline()
+            f.seek(0)
+            try:
+                delimitatore = csv.Sniffer().sniff(intestazione, DELIMITATORI).delimiter
+            except csv.Error:
+                delimitatore = ";"
+        reader = csv.reader(f, delimiter=delimitatore)
+        return f, reader
+    except Exception:
+        f.close()
+        raise
+
+
+def leggi_righe(path, encoding: str = "utf-8-sig", delimitatore: Optional[str] = None) -> Iterator[Tuple[int, Dict]]:
+    """Genera (numero di riga, dizionario colonna -> valore) per ogni riga del CSV"""
+    f, reader = apri_csv(path, encoding, delimitatore)
+    with f:
+        try:
+            intestazione = [c.strip().lower() for c in next(reader)]
+        except StopIteration:
+            return
+        mancanti = [c for c in COLONNE_OBBLIGATORIE if c not in intestazione]
+        if mancanti:
+            raise ErroreImport(f"colonne mancanti: {', '.join(mancanti)}")
+        for riga in reader:
+            if not any(campo.strip() for campo in riga):
+                continue
+            yield reader.line_num, dict(zip(intestazione, (campo.strip() for campo in riga)))
+
+
+def chiave_fattura(riga: Dict) -> Tuple[str, str, str]:
+    """Chiave di raggruppamento: cliente (P.IVA o CF), tipo documento e numero"""
+    cliente = riga.get("cliente_p_iva") or riga.get("cliente_codice_fiscale") or riga.get("cliente_ragione_sociale", "")
+    return cliente, riga.get("tipo") or "Fattura", riga.get("numero", "")
+
+
+def _sezione(riga: Dict, prefisso: str) -> Dict:
+    """Campi con un prefisso (cliente_, banca_) senza il prefisso"""
+    return {k[len(prefisso):]: v for k, v in riga.items() if k.startswith(prefisso)}
+
+
+def componi_fattura(righe: List[Tuple[int, Dict]], azienda: Dict) -> Tuple[Dict, List[str]]:
+    """Costruisce il dizionario fattura dalle righe di un gruppo
+    
+    I dati di testata si prendono dalla prima riga. Restituisce la fattura
+    e gli errori trovati nelle righe prodotto.
+    """
+    _, prima = righe[0]
+    banca = _sezione(prima, "banca_")
+    data = {
+        "azienda": dict(azienda),
+        "cliente": _sezione(prima, "cliente_"),
+        "fattura": {c: prima.get(c, "") for c in COLONNE_FATTURA},
+        "banca": {"iban": banca.get("iban", ""), "nome": banca.get("nome", "")},
+        "prodotti": []
+    }
+    data["fattura"]["tipo"] = data["fattura"]["tipo"] or "Fattura"
+    
+    errori = []
+    for n_riga, riga in righe:
+        try:
+            quantita = leggi_numero(riga["quantita"])
+            prezzo = leggi_numero(riga["prezzo"])
+            iva = leggi_numero(riga["iva"])
+        except (ArithmeticError, ValueError):
+            errori.append(f"riga {n_riga}: quantità, prezzo o IVA non numerici")
+            continue
+        if iva not in ALIQUOTE_AMMESSE:
+            errori.append(f"riga {n_riga}: aliquota IVA {iva:g}% non ammessa")
+        if not riga.get("descrizione"):
+            errori.append(f"riga {n_riga}: descrizione mancante")
+        prodotto = {"descrizione": riga.get("descrizione", "")}
+        prodotto.update(calcola_riga(quantita, prezzo, iva))
+        data["prodotti"].append(prodotto)
+    return data, errori
+
+
+def valida_fattura(data: Dict) -> Tuple[List[str], List[str]]:
+    """Controlli di testata di una fattura importata: (errori, avvisi)
+    
+    Gli avvisi (CAP/provincia non coerenti) non impediscono l'importazione.
+    """
+    errori = []
+    fattura = data["fattura"]
+    cliente = data["cliente"]
+    if not fattura.get("numero"):
+        errori.append("numero fattura mancante")
+    if not RE_DATA.match(fattura.get("data", "")):
+        errori.append(f"data non valida: '{fattura.get('data', '')}' (formato gg/mm/aaaa)")
+    if fattura.get("scadenza") and not RE_DATA.match(fattura["scadenza"]):
+        errori.append(f"scadenza non valida: '{fattura['scadenza']}'")
+    if not cliente.get("ragione_sociale"):
+        errori.append("ragione sociale cliente mancante")
+    if not cliente.get("p_iva") and not cliente.get("codice_fiscale"):
+        errori.append("P.IVA o codice fiscale cliente mancante")
+    anagrafica = errori_fattura(data)
+    errori.extend(e["errore"] for e in anagrafica if not e["avviso"])
+    if not data["prodotti"]:
+        errori.append("nessuna riga prodotto valida")
+    return errori, [e["errore"] for e in anagrafica if e["avviso"]]
+
+
+def leggi_fatture(path, azienda: Dict, encoding: str = "utf-8-sig",
+                  delimitatore: Optional[str] = None) -> Iterator[Dict]:
+    """Genera una fattura per ogni gruppo di righe consecutive con la stessa chiave
+    
+    Il CSV deve avere le righe di una stessa fattura consecutive (come negli
+    export ordinati per documento): in memoria c'è una sola fattura alla volta,
+    più la chiave di quelle già viste per segnalare i numeri ripetuti.
+    Ogni elemento è {"file", "numero", "ok", "data", "errore", "avviso"}.
+    """
+    viste = set()
+    for chiave, gruppo in groupby(leggi_righe(path, encoding, delimitatore), key=lambda r: chiave_fattura(r[1])):
+        righe = list(gruppo)
+        origine = f"{path}:{righe[0][0]}"
+        data, errori = componi_fattura(righe, azienda)
+        errori_testata, avvisi = valida_fattura(data)
+        errori = errori_testata + errori
+        if chiave in viste:
+            errori.insert(0, "righe della fattura non consecutive nel file (numero ripetuto)")
+        viste.add(chiave)
+        yield {"file": origine, "numero": chiave[2], "ok": not errori, "output": "",
+               "data": data if not errori else None, "errore": "; ".join(errori),
+               "avviso": "; ".join(avvisi)}
+
+
+def carica_azienda(path: str = SETTINGS_FILE) -> Dict:
+    """Dati dell'azienda emittente dalle impostazioni di Fattura Pro"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("azienda", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def importa_csv(path, azienda: Dict, output_dir=None, json_dir=None, archivio: Optional[ArchivioFatture] = None,
+                encoding: str = "utf-8-sig", delimitatore: Optional[str] = None) -> Iterator[Dict]:
+    """Importa il CSV e per ogni fattura valida genera PDF, JSON e/o la archivia
+    
+    È un generatore: il file viene letto man mano che si consumano i risultati.
+    """
+    for cartella in (output_dir, json_dir):
+        if cartella:
+            Path(cartella).mkdir(parents=True, exist_ok=True)
+    
+    in_sospeso = 0
+    for risultato in leggi_fatture(path, azienda, encoding, delimitatore):
+        data = risultato.pop("data")
+        if data is None:
+            yield risultato
+            continue
+        uscite = []
+        try:
+            if json_dir:
+                file_json = Path(json_dir) / f"fattura_{data['fattura']['numero'].replace('/', '_')}.json"
+                # Atomico ma senza fsync per file: in un import massivo costerebbe più della scrittura
+                scrivi_json_atomico(file_json, data, indent=2, fsync=False)
+                uscite.append(str(file_json))
+            if output_dir:
+                pdf = Path(output_dir) / nome_pdf(data)
+                scrivi_atomico(pdf, render_pdf(data), fsync=False)
+                uscite.append(str(pdf))
+            if archivio is not None:
+                archivio.salva_differita(data, risultato["file"])
+                uscite.append("archivio")
+                in_sospeso += 1
+                if in_sospeso >= BLOCCO_ARCHIVIO:
+                    archivio.conferma()
+                    in_sospeso = 0
+        except Exception as e:
+            risultato.update(ok=False, errore=str(e))
+        risultato["output"] = ", ".join(uscite)
+        yield risultato
+    
+    if archivio is not None:
+        archivio.conferma()
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Importa fatture da un export CSV del gestionale")
+    parser.add_argument("csv", help="File CSV (una riga per prodotto, righe della stessa fattura consecutive)")
+    parser.add_argument("--pdf", metavar="CARTELLA", help="Genera i PDF nella cartella")
+    parser.add_argument("--json", metavar="CARTELLA", help="Scrive i file fattura_*.json nella cartella")
+    parser.add_argument("--archivio", nargs="?", const=DB_FILE, metavar="DB",
+                       help=f"Archivia le fatture nel database SQLite (default: {DB_FILE})")
+    parser.add_argument("--azienda", default=SETTINGS_FILE,
+                       help=f"File JSON con i dati dell'azienda emittente (default: {SETTINGS_FILE})")
+    parser.add_argument("-d", "--delimitatore", help="Separatore di campo (default: rilevato)")
+    parser.add_argument("--encoding", default="utf-8-sig", help="Codifica del file (default: utf-8-sig)")
+    parser.add_argument("--verifica", action="store_true", help="Solo validazione, senza scrivere nulla")
+    args = parser.parse_args(argv)
+    
+    if args.pdf and not REPORTLAB_AVAILABLE:
+        print("Errore: reportlab non installato!\nInstalla con: pip install reportlab")
+        sys.exit(1)
+    
+    azienda = carica_azienda(args.azienda)
+    if not azienda:
+        print(f"Attenzione: dati azienda non trovati in {args.azienda}")
+    
+    archivio = ArchivioFatture(args.archivio) if args.archivio and not args.verifica else None
+    try:
+        if args.verifica:
+            risultati = (dict(r, data=None) for r in leggi_fatture(args.csv, azienda, args.encoding, args.delimitatore))
+        else:
+            risultati = importa_csv(args.csv, azienda, args.pdf, args.json, archivio,
+                                    args.encoding, args.delimitatore)
+        errori = stampa_risultati(risultati)
+    except (OSError, ErroreImport) as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    finally:
+        if archivio is not None:
+            archivio.conferma()
+            archivio.chiudi()
+    sys.exit(1 if errori else 0)
+
+
+if __name__ == "__main__":
+    main()
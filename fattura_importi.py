@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Calcolo importi e IVA in centesimi (aritmetica a virgola fissa)
+Arrotondamento commerciale al centesimo e IVA calcolata sul totale imponibile per aliquota
+"""
+
+import importlib.util
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Tuple
+
+# numpy serve solo al ricalcolo massivo: si importa al primo uso, non all'avvio della GUI
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+
+CENTESIMO = Decimal("0.01")
+CAMPI_IMPORTO = ("quantita", "prezzo", "iva", "imponibile", "iva_importo", "totale")
+
+
+def a_decimal(valore) -> Decimal:
+    """Converte un valore (anche float letto da JSON) in Decimal senza errori binari"""
+    if isinstance(valore, Decimal):
+        return valore
+    if isinstance(valore, float):
+        return Decimal(repr(valore))
+    return Decimal(str(valore or 0).replace(",", "."))
+
+
+def arrotonda(valore) -> Decimal:
+    """Arrotonda al centesimo (metà per eccesso, come da prassi fiscale italiana)"""
+    return a_decimal(valore).quantize(CENTESIMO, rounding=ROUND_HALF_UP)
+
+
+def in_centesimi(valore) -> int:
+    """Importo in centesimi interi, arrotondato"""
+    return int(arrotonda(valore) * 100)
+
+
+def da_centesimi(centesimi: int) -> float:
+    """Centesimi interi in euro (float, per il formato JSON delle fatture)"""
+    return centesimi / 100
+
+
+def imposta_centesimi(imponibile_cent: int, aliquota) -> int:
+    """IVA in centesimi su un imponibile in centesimi, arrotondata al centesimo"""
+    imposta = Decimal(imponibile_cent) * a_decimal(aliquota) / 100
+    return int(imposta.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def calcola_riga(quantita, prezzo, iva) -> Dict:
+    """Calcola imponibile, IVA e totale di una riga prodotto
+    
+    Restituisce il dizionario prodotto (senza descrizione) nel formato dei file JSON.
+    """
+    imponibile_cent = in_centesimi(a_decimal(quantita) * a_decimal(prezzo))
+    iva_cent = imposta_centesimi(imponibile_cent, iva)
+    return {
+        "quantita": float(quantita),
+        "prezzo": float(prezzo),
+        "iva": float(iva),
+        "imponibile": da_centesimi(imponibile_cent),
+        "iva_importo": da_centesimi(iva_cent),
+        "totale": da_centesimi(imponibile_cent + iva_cent)
+    }
+
+
+def normalizza_riga(prodotto: Dict) -> Dict:
+    """Riga prodotto con gli importi in float; imponibile, IVA e totale ricalcolati se mancano
+    
+    Solleva ValueError se un importo non è un numero finito.
+    """
+    riga = dict(prodotto)
+    for campo in CAMPI_IMPORTO:
+        valore = riga.get(campo)
+        if valore is None or valore == "":
+            continue
+        try:
+            numero = a_decimal(valore)
+        except (ArithmeticError, ValueError):
+            numero = None
+        if isinstance(valore, bool) or numero is None or not numero.is_finite():
+            raise ValueError(f"{campo} non numerico: {valore!r}")
+        riga[campo] = float(numero)
+    if riga.get("imponibile") in (None, "") and riga.get("prezzo") not in (None, ""):
+        riga.update(calcola_riga(riga.get("quantita") or 0, riga["prezzo"], riga.get("iva") or 0))
+    return riga
+
+
+class RiepilogoIVA:
+    """Imponibile per aliquota in centesimi; l'IVA si calcola sul totale per aliquota
+
+    I totali sono tenuti aggiornati a ogni riga aggiunta o tolta: ogni
+    modifica ricalcola solo l'imposta dell'aliquota interessata.
+    """
+
+    def __init__(self):
+        self.imponibili: Dict[Decimal, int] = {}
+        self.imposte: Dict[Decimal, int] = {}
+        self.totale_imponibile = 0
+        self.totale_iva = 0
+
+    def _varia(self, aliquota: Decimal, delta_cent: int):
+        """Applica una variazione di imponibile a un'aliquota"""
+        imponibile = self.imponibili.get(aliquota, 0) + delta_cent
+        imposta = imposta_centesimi(imponibile, aliquota)
+        self.totale_imponibile += delta_cent
+        self.totale_iva += imposta - self.imposte.get(aliquota, 0)
+        self.imponibili[aliquota] = imponibile
+        self.imposte[aliquota] = imposta
+
+    def aggiungi(self, prodotto: Dict, segno: int = 1):
+        """Somma (o sottrae con segno=-1) l'imponibile di una riga"""
+        self._varia(a_decimal(prodotto.get("iva", 0)), segno * in_centesimi(prodotto.get("imponibile", 0)))
+
+    def rimuovi(self, prodotto: Dict):
+        """Toglie una riga dal riepilogo"""
+        self.aggiungi(prodotto, -1)
+
+    def aggiungi_riepilogo(self, altro: "RiepilogoIVA"):
+        """Somma un altro riepilogo (di un'altra fattura) a questo"""
+        for aliquota, imponibile in altro.imponibili.items():
+            self._varia(aliquota, imponibile)
+
+    def per_aliquota(self) -> List[Dict]:
+        """Righe del riepilogo ordinate per aliquota: aliquota, imponibile, iva (in centesimi)"""
+        return [{"aliquota": aliquota,
+                 "imponibile": imponibile,
+                 "iva": self.imposte[aliquota]}
+                for aliquota, imponibile in sorted(self.imponibili.items())
+                if imponibile or self.imposte[aliquota]]
+
+    def totali(self) -> Tuple[int, int, int]:
+        """Totale imponibile, totale IVA e totale documento in centesimi"""
+        return self.totale_imponibile, self.totale_iva, self.totale_imponibile + self.totale_iva
+
+
+def riepiloga_fattura(prodotti: Iterable[Dict]) -> RiepilogoIVA:
+    """Riepilogo IVA delle righe di una fattura, in un solo passaggio"""
+    riepilogo = RiepilogoIVA()
+    for p in prodotti:
+        riepilogo.aggiungi(p)
+    return riepilogo
+
+
+def riepiloga_batch(fatture: Iterable[Dict]) -> Tuple[RiepilogoIVA, Dict[Decimal, int]]:
+    """Totali per aliquota di molte fatture, in un solo passaggio sulle righe
+    
+    L'IVA va arrotondata fattura per fattura: restituisce il riepilogo degli
+    imponibili e l'IVA per aliquota già sommata fattura per fattura (in centesimi).
+    """
+    totale = RiepilogoIVA()
+    iva: Dict[Decimal, int] = {}
+    for data in fatture:
+        riepilogo = riepiloga_fattura(data.get("prodotti", []))
+        totale.aggiungi_riepilogo(riepilogo)
+        for riga in riepilogo.per_aliquota():
+            iva[riga["aliquota"]] = iva.get(riga["aliquota"], 0) + riga["iva"]
+    return totale, iva
+
+
+def _arrotonda_array(valori):
+    """Arrotondamento metà per eccesso (simmetrico) di un array NumPy all'intero"""
+    import numpy as np
+    return np.sign(valori) * np.floor(np.abs(valori) + 0.5)
+
+
+def riepiloga_colonne(fattura, quantita, prezzo, aliquota) -> Dict[float, Dict[str, int]]:
+    """Ricalcolo massivo con NumPy: righe di molte fatture passate per colonne
+    
+    fattura è l'indice (intero) della fattura di ogni riga. Restituisce per
+    aliquota imponibile e IVA in centesimi, con l'IVA arrotondata per fattura
+    come in riepiloga_batch.
+    """
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("numpy non installato! Installa con: pip install numpy")
+    import numpy as np
+    
+    fattura = np.asarray(fattura, dtype=np.int64)
+    aliquota_cent = _arrotonda_array(np.asarray(aliquota, dtype=np.float64) * 100).astype(np.int64)
+    # Arrotondare prima a 4 decimali di centesimo elimina il rumore binario
+    # (2.675 * 100 = 267.49999999999997 -> 267.5 -> 268)
+    imponibile = np.asarray(quantita, dtype=np.float64) * np.asarray(prezzo, dtype=np.float64) * 100
+    imponibile_cent = _arrotonda_array(np.round(imponibile, 4)).astype(np.int64)
+    
+    # Somma per coppia (fattura, aliquota)
+    chiavi, inverso = np.unique(np.stack([fattura, aliquota_cent]), axis=1, return_inverse=True)
+    per_gruppo = np.bincount(inverso.ravel(), weights=imponibile_cent, minlength=chiavi.shape[1]).astype(np.int64)
+    
+    # IVA per fattura e aliquota in aritmetica intera: imponibile * aliquota% / 100, arrotondata
+    prodotto = per_gruppo * chiavi[1]
+    iva_gruppo = np.sign(prodotto) * ((np.abs(prodotto) + 5000) // 10000)
+    
+    risultato = {}
+    for aliq in np.unique(chiavi[1]):
+        maschera = chiavi[1] == aliq
+        risultato[float(aliq) / 100] = {
+            "imponibile": int(per_gruppo[maschera].sum()),
+            "iva": int(iva_gruppo[maschera].sum())
+        }
+    return risultato
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Scritture sicure su disco per Fattura Pro
+Scrittura atomica (file temporaneo, fsync, rename) e giornale append-only dei numeri
+emessi: un'interruzione o un disco pieno non lasciano mai un file a metà
+"""
+
+import json
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Union
+
+from fattura_profilo import span
+
+
+def _fsync_cartella(cartella: Path):
+    """Rende persistente la rename nella cartella (POSIX; su Windows non serve e non si può)"""
+    if os.name != "posix":
+        return
+    fd = os.open(cartella, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def scrivi_atomico(path, contenuto: Union[bytes, str], fsync: bool = True):
+    """Scrive un file su un temporaneo nella stessa cartella e lo sostituisce con una rename
+    
+    Chi legge vede il file vecchio o quello nuovo, mai uno troncato. Con fsync
+    i dati (e la rename) sono su disco prima del ritorno; senza, la scrittura
+    resta atomica ma non durevole (va bene per le cache).
+    """
+    path = Path(path)
+    if isinstance(contenuto, str):
+        contenuto = contenuto.encode("utf-8")
+    # Nome casuale ma permessi secondo la umask, come un file creato con open() (mkstemp userebbe 0600)
+    tmp = path.parent / f".{path.name}.{secrets.token_hex(6)}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(contenuto)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        _fsync_cartella(path.parent)
+
+
+def scrivi_json_atomico(path, data, indent=None, fsync: bool = True):
+    """Serializza data in JSON e lo scrive con scrivi_atomico"""
+    with span("json.scrivi", file=Path(path).name, fsync=fsync):
+        scrivi_atomico(path, json.dumps(data, indent=indent, ensure_ascii=False), fsync)
+
+
+class Giornale:
+    """File append-only di record JSON, uno per riga
+    
+    Ogni annota() è una sola write seguita da fsync: dopo il ritorno il record
+    sopravvive a un crash. Una riga finale incompleta (crash durante la write)
+    viene ignorata alla rilettura.
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+    
+    def annota(self, record: Dict):
+        """Aggiunge un record in modo durevole"""
+        riga = json.dumps(dict(record, t=time.time()), ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a+b') as f:
+                # Dopo una write interrotta la riga incompleta va chiusa, o il record si perde
+                if f.seek(0, os.SEEK_END) and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+                    riga = "\n" + riga
+                f.write(riga.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+    
+    def record(self) -> Iterator[Dict]:
+        """Record annotati, in ordine"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for riga in f:
+                if not riga.endswith(b"\n"):
+                    break  # scrittura interrotta
+                try:
+                    yield json.loads(riga)
+                except ValueError:
+                    continue
+    
+    def svuota(self):
+        """Azzera il giornale, dopo che il suo contenuto è stato salvato altrove"""
+        with self._lock:
+            try:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(0)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Lavori in background per Fattura Pro
+Un thread di lavoro esegue le operazioni lente (PDF, salvataggi) fuori dal mainloop Tk;
+i risultati vengono ritirati dal thread dell'interfaccia con raccogli() (da root.after)
+"""
+
+import queue
+import threading
+from typing import Callable, Dict, Optional
+
+
+class Annullato(Exception):
+    """Lavoro annullato dall'utente"""
+
+
+class Lavoro:
+    """Un'operazione in coda: la funzione riceve il Lavoro per segnalare progresso e annullamento"""
+    
+    def __init__(self, chiave: str, descrizione: str, funzione: Callable,
+                 al_termine: Optional[Callable] = None):
+        self.chiave = chiave
+        self.descrizione = descrizione
+        self.funzione = funzione
+        self.al_termine = al_termine  # (risultato, errore) chiamata nel thread Tk
+        self.progresso = 0.0
+        self._annulla = threading.Event()
+    
+    @property
+    def annullato(self) -> bool:
+        return self._annulla.is_set()
+    
+    def annulla(self):
+        """Chiede l'interruzione (effettiva al prossimo controlla/avanza)"""
+        self._annulla.set()
+    
+    def controlla(self):
+        """Solleva Annullato se il lavoro è stato annullato"""
+        if self._annulla.is_set():
+            raise Annullato(self.descrizione)
+    
+    def avanza(self, frazione: float):
+        """Aggiorna la frazione completata (dal thread di lavoro) e controlla l'annullamento"""
+        self.progresso = frazione
+        self.controlla()
+
+
+class EsecutoreLavori:
+    """Thread di lavoro unico con coda FIFO
+    
+    Un lavoro con la stessa chiave di uno già in coda o in esecuzione viene
+    rifiutato, così i clic ripetuti non accodano duplicati. invia(), raccogli()
+    e annulla() vanno chiamati solo dal thread dell'interfaccia.
+    
+    I lavori di un esecutore si serializzano: operazioni lunghe che non devono
+    far attendere quelle avviate dall'utente vanno su un esecutore separato.
+    """
+    
+    def __init__(self, nome: str = "fattura-lavori"):
+        self._coda: "queue.Queue[Optional[Lavoro]]" = queue.Queue()
+        self._completati: "queue.Queue" = queue.Queue()
+        self.attivi: Dict[str, Lavoro] = {}
+        self._in_corso: Optional[Lavoro] = None
+        self._thread = threading.Thread(target=self._esegui, name=nome, daemon=True)
+        self._thread.start()
+    
+    def invia(self, chiave: str, descrizione: str, funzione: Callable,
+              al_termine: Optional[Callable] = None) -> Optional[Lavoro]:
+        """Accoda un lavoro; restituisce None se uno con la stessa chiave è già attivo"""
+        if chiave in self.attivi:
+            return None
+        lavoro = Lavoro(chiave, descrizione, funzione, al_termine)
+        self.attivi[chiave] = lavoro
+        self._coda.put(lavoro)
+        return lavoro
+    
+    def _esegui(self):
+        """Ciclo del thread di lavoro"""
+        while True:
+            lavoro = self._coda.get()
+            if lavoro is None:
+                return
+            self._in_corso = lavoro
+            try:
+                lavoro.controlla()
+                esito = (lavoro, lavoro.funzione(lavoro), None)
+            except Exception as e:
+                esito = (lavoro, None, e)
+            self._in_corso = None
+            self._completati.put(esito)
+    
+    def raccogli(self) -> int:
+        """Consegna i lavori terminati chiamando al_termine; restituisce quanti erano"""
+        n = 0
+        while True:
+            try:
+                lavoro, risultato, errore = self._completati.get_nowait()
+            except queue.Empty:
+                return n
+            n += 1
+            self.attivi.pop(lavoro.chiave, None)
+            if lavoro.al_termine is not None:
+                lavoro.al_termine(risultato, errore)
+    
+    def corrente(self) -> Optional[Lavoro]:
+        """Il lavoro in esecuzione, o il primo ancora da ritirare, se c'è"""
+        return self._in_corso or next(iter(self.attivi.values()), None)
+    
+    def annulla(self):
+        """Annulla tutti i lavori attivi"""
+        for lavoro in self.attivi.values():
+            lavoro.annulla()
+    
+    def chiudi(self, attesa: Optional[float] = None):
+        """Ferma il thread dopo i lavori già in coda"""
+        self._coda.put(None)
+        self._thread.join(attesa)
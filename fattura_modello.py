@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Modello della fattura in lavorazione
+Righe prodotto con totali tenuti aggiornati a ogni modifica, condivisi da GUI e PDF
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+from fattura_importi import RiepilogoIVA, da_centesimi
+
+
+class ModelloFattura:
+    """Righe prodotto di una fattura con totali incrementali
+    
+    Aggiungere, sostituire o togliere una riga aggiorna imponibile, IVA e
+    totale per aliquota senza risommare le altre righe. Ogni riga ha un id
+    stabile (ids, parallelo a prodotti) che non cambia quando si tolgono
+    le righe precedenti.
+    """
+    
+    def __init__(self, prodotti: Iterable[Dict] = ()):
+        self.prodotti: List[Dict] = []
+        self.ids: List[int] = []
+        self.riepilogo = RiepilogoIVA()
+        self._prossimo_id = 1
+        self.carica(prodotti)
+    
+    def __len__(self):
+        return len(self.prodotti)
+    
+    def carica(self, prodotti: Iterable[Dict]):
+        """Sostituisce tutte le righe (ad es. da un file JSON)"""
+        self.prodotti = []
+        self.ids = []
+        self.riepilogo = RiepilogoIVA()
+        for p in prodotti:
+            self.aggiungi(p)
+    
+    def svuota(self):
+        """Rimuove tutte le righe"""
+        self.carica(())
+    
+    def aggiungi(self, prodotto: Dict) -> int:
+        """Aggiunge una riga in coda e ne restituisce l'indice"""
+        self.prodotti.append(prodotto)
+        self.ids.append(self._prossimo_id)
+        self._prossimo_id += 1
+        self.riepilogo.aggiungi(prodotto)
+        return len(self.prodotti) - 1
+    
+    def sostituisci(self, indice: int, prodotto: Dict):
+        """Sostituisce la riga all'indice dato"""
+        self.riepilogo.rimuovi(self.prodotti[indice])
+        self.prodotti[indice] = prodotto
+        self.riepilogo.aggiungi(prodotto)
+    
+    def rimuovi(self, indice: int) -> Dict:
+        """Toglie la riga all'indice dato e la restituisce"""
+        prodotto = self.prodotti.pop(indice)
+        del self.ids[indice]
+        self.riepilogo.rimuovi(prodotto)
+        return prodotto
+    
+    def indice(self, id_riga: int) -> int:
+        """Indice attuale della riga con l'id dato (ValueError se non c'è più)"""
+        return self.ids.index(id_riga)
+    
+    def totali(self) -> Tuple[float, float, float]:
+        """Imponibile, IVA e totale documento in euro"""
+        imponibile, iva, totale = self.riepilogo.totali()
+        return da_centesimi(imponibile), da_centesimi(iva), da_centesimi(totale)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Indice persistente della numerazione fatture
+Tiene l'ultimo numero usato per anno e tipo documento, senza rileggere tutti i JSON
+"""
+
+import json
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from fattura_io import Giornale, scrivi_json_atomico
+from fattura_profilo import span
+
+
+DATA_DIR = ".fattura_pro"
+INDEX_FILE = "numerazione.json"
+GIORNALE_FILE = "numerazione.giornale"
+# Un mtime più recente di così non prova nulla: una scrittura nello stesso tick non lo cambierebbe
+MARGINE_MTIME_NS = 2_000_000_000
+INDEX_VERSION = 2
+
+
+def chiave_sequenza(anno: int, tipo: str) -> str:
+    """Chiave della sequenza di numerazione per anno e tipo documento"""
+    return f"{anno}|{tipo or 'Fattura'}"
+
+
+def estrai_numero(numero: str) -> Optional[int]:
+    """Estrae il progressivo (ultime 4 cifre) da un numero fattura"""
+    match = re.search(r'(\d{4})$', numero or "")
+    return int(match.group(1)) if match else None
+
+
+def estrai_anno(fattura: Dict) -> Optional[int]:
+    """Anno della fattura: dalla data (gg/mm/aaaa) o dal numero (FAT-aaaa-nnnn)"""
+    match = re.search(r'(\d{4})\s*$', fattura.get("data", "") or "")
+    if match:
+        return int(match.group(1))
+    match = re.search(r'(\d{4})\D+\d+$', fattura.get("numero", "") or "")
+    if match:
+        return int(match.group(1))
+    return None
+
+
+class IndiceNumerazione:
+    """Ultimo numero fattura per anno e tipo documento, persistito su file
+    
+    L'indice ricorda mtime, dimensione e progressivo di ogni fattura_*.json.
+    La prima scansione del processo (e aggiorna(completo=True)) fa una stat per
+    file e rilegge quelli nuovi o modificati, comprese le riscritture sul posto.
+    Dopo, ultimo() controlla solo l'mtime della cartella, che cambia a ogni file
+    creato, cancellato o salvato in modo atomico (rename): finché non cambia la
+    risposta è in O(1). I numeri emessi dall'applicazione arrivano comunque
+    subito con registra().
+    
+    I numeri emessi vanno prima nel giornale (append + fsync, pochi byte), che
+    viene riapplicato all'apertura: un numero registrato resta usato anche se
+    il file della fattura non è mai stato scritto o è rimasto illeggibile.
+    Il giornale si svuota quando l'indice completo viene salvato.
+    """
+    
+    def __init__(self, cartella=".", index_file: str = INDEX_FILE):
+        self.cartella = Path(cartella)
+        self.path = self.cartella / DATA_DIR / index_file
+        self.giornale = Giornale(self.cartella / DATA_DIR / GIORNALE_FILE)
+        self.da_salvare = False
+        self.cartella_mtime: Optional[int] = None  # mtime della cartella all'ultima scansione affidabile
+        self.files: Dict[str, Dict] = {}
+        self.registrati: Dict[str, int] = {}
+        self.ultimi: Dict[str, int] = {}
+        self.carica()
+        self.riapplica_giornale()
+    
+    def carica(self):
+        """Carica l'indice dal file (vuoto se mancante o illeggibile)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("versione") != INDEX_VERSION:
+                return
+            self.files = data.get("files", {})
+            self.registrati = data.get("registrati", {})
+            self.ultimi = data.get("ultimi", {})
+        except (OSError, ValueError, AttributeError):
+            pass
+    
+    def riapplica_giornale(self) -> int:
+        """Porta nell'indice i numeri del giornale; restituisce quanti record ha letto"""
+        n = 0
+        for record in self.giornale.record():
+            chiave, numero = record.get("chiave"), record.get("numero")
+            if isinstance(chiave, str) and isinstance(numero, int):
+                self._registra_numero(chiave, numero)
+                n += 1
+        self.da_salvare = self.da_salvare or n > 0
+        return n
+    
+    def salva(self):
+        """Salva l'indice in modo atomico e svuota il giornale, ormai incluso"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        scrivi_json_atomico(self.path, {
+            "versione": INDEX_VERSION,
+            "files": self.files,
+            "registrati": self.registrati,
+            "ultimi": self.ultimi
+        })
+        self.giornale.svuota()
+        self.da_salvare = False
+    
+    def aggiorna(self, completo: bool = False) -> bool:
+        """Riallinea l'indice ai file della cartella; True se qualcosa è cambiato
+        
+        Senza completo la scansione si salta se l'mtime della cartella è quello
+        dell'ultima scansione.
+        """
+        try:
+            cartella_mtime = os.stat(self.cartella).st_mtime_ns
+        except OSError:
+            return False
+        if not completo and cartella_mtime == self.cartella_mtime:
+            return False
+        
+        visti = set()
+        cambiato = False
+        letti = 0
+        with span("numerazione.aggiorna") as fase:
+            try:
+                it = os.scandir(self.cartella)
+            except OSError:
+                return False
+            with it:
+                for entry in it:
+                    if not (entry.name.startswith("fattura_") and entry.name.endswith(".json")):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    visti.add(entry.name)
+                    voce = self.files.get(entry.name)
+                    if voce is not None and voce["mtime"] == st.st_mtime_ns and voce.get("size") == st.st_size:
+                        continue
+                    self.files[entry.name] = self._leggi_voce(entry.path, st.st_mtime_ns, st.st_size)
+                    letti += 1
+                    cambiato = True
+            
+            for nome in set(self.files) - visti:
+                del self.files[nome]
+                cambiato = True
+            
+            if cambiato:
+                self._ricalcola_ultimi()
+            fase.imposta(file=len(visti), letti=letti)
+        recente = time.time_ns() - cartella_mtime < MARGINE_MTIME_NS
+        self.cartella_mtime = None if recente else cartella_mtime
+        if cambiato or self.da_salvare:
+            self.salva()
+        return cambiato
+    
+    def _leggi_voce(self, path, mtime, size) -> Dict:
+        """Legge anno, tipo e progressivo di un file fattura"""
+        voce = {"mtime": mtime, "size": size, "chiave": None, "numero": None}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                fattura = json.load(f).get("fattura", {})
+            numero = estrai_numero(fattura.get("numero", ""))
+            anno = estrai_anno(fattura)
+            if numero is not None and anno is not None:
+                voce["chiave"] = chiave_sequenza(anno, fattura.get("tipo", ""))
+                voce["numero"] = numero
+        except (OSError, ValueError, AttributeError):
+            pass
+        return voce
+    
+    def _ricalcola_ultimi(self):
+        """Ricostruisce i massimi per sequenza dalle voci già in memoria"""
+        ultimi = dict(self.registrati)
+        for voce in self.files.values():
+            chiave = voce["chiave"]
+            if chiave is not None:
+                ultimi[chiave] = max(ultimi.get(chiave, 0), voce["numero"])
+        self.ultimi = ultimi
+    
+    def ultimo(self, anno: Optional[int] = None, tipo: str = "Fattura") -> int:
+        """Ultimo progressivo usato per anno e tipo documento"""
+        self.aggiorna()
+        anno = anno or datetime.now().year
+        return self.ultimi.get(chiave_sequenza(anno, tipo), 0)
+    
+    def prossimo(self, anno: Optional[int] = None, tipo: str = "Fattura") -> int:
+        """Prossimo progressivo libero per anno e tipo documento"""
+        return self.ultimo(anno, tipo) + 1
+    
+    def _registra_numero(self, chiave: str, numero: int):
+        self.registrati[chiave] = max(self.registrati.get(chiave, 0), numero)
+        self.ultimi[chiave] = max(self.ultimi.get(chiave, 0), numero)
+    
+    def registra(self, data: Dict):
+        """Registra il numero di una fattura prima di scriverne il file (write-ahead)
+        
+        Il numero viene annotato nel giornale in modo durevole; l'indice completo
+        si riscrive al prossimo aggiorna().
+        """
+        fattura = data.get("fattura", {})
+        numero = estrai_numero(fattura.get("numero", ""))
+        anno = estrai_anno(fattura)
+        if numero is None or anno is None:
+            return
+        chiave = chiave_sequenza(anno, fattura.get("tipo", ""))
+        self.giornale.annota({"chiave": chiave, "numero": numero, "numero_fattura": fattura.get("numero", "")})
+        self._registra_numero(chiave, numero)
+        self.da_salvare = True
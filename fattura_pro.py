@@ -7,27 +7,29 @@ Versione migliorata con design moderno e conforme alle normative italiane
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
+import argparse
+import copy
 import json
 import os
-import re
+import sys
 from pathlib import Path
 from typing import Dict, List, Optional
 
 
-try:
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.units import cm, mm
-    from reportlab.lib import colors
-    from reportlab.platypus import (
-        SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer,
-        PageBreak, KeepTogether
-    )
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.enums import TA_RIGHT, TA_CENTER, TA_LEFT
-    from reportlab.pdfgen import canvas
-    REPORTLAB_AVAILABLE = True
-except ImportError:
-    REPORTLAB_AVAILABLE = False
+from fattura_engine import (REPORTLAB_AVAILABLE, aggiungi_opzioni_cache, cache_da_opzioni, chiave_pdf,
+                            render_pdf, render_directory, stampa_risultati)
+from fattura_cache import CachePDF
+from fattura_numerazione import IndiceNumerazione
+from fattura_io import scrivi_json_atomico
+from fattura_archivio import ArchivioFatture
+from fattura_xml import ContatoreInvii, esporta_xml, nome_file_xml, progressivo_invio
+from fattura_importi import calcola_riga
+from fattura_modello import ModelloFattura
+from fattura_lavori import Annullato, EsecutoreLavori
+from fattura_clienti import RegistroClienti
+from fattura_profilo import span
+from fattura_validazione import errori_fattura
+from fattura_catalogo import CATALOGO_FILE, Articolo, CatalogoProdotti, IndiceCatalogo, firma_catalogo
 
 
 # Colori moderni per l'interfaccia
@@ -37,6 +39,8 @@ COLOR_DANGER = "#ef4444"  # Rosso
 COLOR_BG = "#f8fafc"  # Grigio chiaro
 COLOR_CARD = "#ffffff"  # Bianco
 
+INTERVALLO_LAVORI = 100  # ms tra un controllo e l'altro dei lavori in background
+
 
 class ModernEntry(ttk.Frame):
     """Entry widget moderno con label integrata"""
@@ -62,6 +66,151 @@ class ModernEntry(ttk.Frame):
         self.entry.insert(index, string)
 
 
+class ListaVirtuale(ttk.Frame):
+    """Treeview virtuale: mostra solo le righe visibili di un ModelloFattura
+    
+    Gli item del Treeview hanno come iid l'id stabile della riga nel modello.
+    A ogni aggiornamento si confronta la finestra visibile con quella già
+    disegnata e si inseriscono, modificano o tolgono solo le righe cambiate,
+    quindi il costo non dipende dal numero totale di righe.
+    """
+    
+    def __init__(self, parent, modello, columns, widths, formatta, height=12):
+        super().__init__(parent)
+        self.modello = modello
+        self.formatta = formatta  # (indice, prodotto) -> valori da mostrare
+        self.inizio = 0
+        self.visibili = height
+        self.mostrate: List[str] = []  # iid disegnati, in ordine
+        self.valori: Dict[str, tuple] = {}  # iid -> valori disegnati
+        self.selezionati = set()  # id selezionati, anche fuori dalla finestra
+        self._in_aggiornamento = False
+        
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=height)
+        for col, width in zip(columns, widths):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=width, anchor=tk.CENTER if col != "Descrizione" else tk.W)
+        
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.scorri)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.tree.bind("<<TreeviewSelect>>", self._selezione_cambiata)
+        self.tree.bind("<Configure>", self._ridimensiona)
+        self.tree.bind("<MouseWheel>", lambda e: self.scorri("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scorri("scroll", -1, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scorri("scroll", 1, "units"))
+        self.tree.bind("<Up>", lambda e: self._tasto(-1))
+        self.tree.bind("<Down>", lambda e: self._tasto(1))
+        self.tree.bind("<Prior>", lambda e: self.scorri("scroll", -1, "pages"))
+        self.tree.bind("<Next>", lambda e: self.scorri("scroll", 1, "pages"))
+    
+    def aggiorna(self):
+        """Ridisegna la finestra visibile toccando solo le righe cambiate"""
+        n = len(self.modello)
+        self.inizio = max(0, min(self.inizio, n - self.visibili))
+        fine = min(n, self.inizio + self.visibili)
+        ids = self.modello.ids
+        self.selezionati.intersection_update(ids)
+        
+        finestra = [(str(ids[i]), self.formatta(i, self.modello.prodotti[i]))
+                    for i in range(self.inizio, fine)]
+        nuovi = {iid for iid, _ in finestra}
+        
+        self._in_aggiornamento = True
+        try:
+            # Righe uscite dalla finestra o tolte dal modello
+            fuori = [iid for iid in self.mostrate if iid not in nuovi]
+            if fuori:
+                self.tree.delete(*fuori)
+                for iid in fuori:
+                    del self.valori[iid]
+                self.mostrate = [iid for iid in self.mostrate if iid in nuovi]
+            
+            for pos, (iid, valori) in enumerate(finestra):
+                if iid not in self.valori:
+                    self.tree.insert("", pos, iid=iid, values=valori)
+                    self.mostrate.insert(pos, iid)
+                    if int(iid) in self.selezionati:
+                        self.tree.selection_add(iid)
+                else:
+                    if self.valori[iid] != valori:
+                        self.tree.item(iid, values=valori)
+                    if self.mostrate[pos] != iid:
+                        self.tree.move(iid, "", pos)
+                        self.mostrate.remove(iid)
+                        self.mostrate.insert(pos, iid)
+                self.valori[iid] = valori
+        finally:
+            self._in_aggiornamento = False
+        
+        if n:
+            self.scrollbar.set(self.inizio / n, fine / n)
+        else:
+            self.scrollbar.set(0, 1)
+    
+    def scorri(self, azione, quantita=None, unita=None):
+        """Comando della scrollbar ("moveto" frazione / "scroll" n units|pages)"""
+        if azione == "moveto":
+            self.inizio = int(float(quantita) * len(self.modello))
+        elif azione == "scroll":
+            passo = self.visibili if unita == "pages" else 1
+            self.inizio += int(quantita) * passo
+        self.aggiorna()
+        return "break"
+    
+    def mostra(self, indice: int):
+        """Scorre la finestra in modo che la riga all'indice dato sia visibile"""
+        if indice < self.inizio:
+            self.inizio = indice
+        elif indice >= self.inizio + self.visibili:
+            self.inizio = indice - self.visibili + 1
+        self.aggiorna()
+    
+    def selezione_indici(self) -> List[int]:
+        """Indici nel modello delle righe selezionate, in ordine"""
+        if not self.selezionati:
+            return []
+        return [i for i, id_riga in enumerate(self.modello.ids) if id_riga in self.selezionati]
+    
+    def _selezione_cambiata(self, event=None):
+        """Tiene la selezione per id, così sopravvive allo scorrimento"""
+        if self._in_aggiornamento:
+            return
+        visibili = {int(iid) for iid in self.mostrate}
+        self.selezionati -= visibili
+        self.selezionati.update(int(iid) for iid in self.tree.selection())
+    
+    def _tasto(self, direzione: int):
+        """Frecce su/giù: al bordo della finestra fa scorrere la lista"""
+        focus = self.tree.focus()
+        if not focus or focus not in self.valori:
+            return None
+        pos = self.mostrate.index(focus)
+        if 0 <= pos + direzione < len(self.mostrate):
+            return None  # movimento interno: lo gestisce il Treeview
+        self.inizio += direzione
+        self.aggiorna()
+        if self.mostrate:
+            iid = self.mostrate[0 if direzione < 0 else -1]
+            self.tree.focus(iid)
+            self.tree.selection_set(iid)
+        return "break"
+    
+    def _ridimensiona(self, event):
+        """Adatta il numero di righe disegnate all'altezza del widget"""
+        altezza_riga = ttk.Style().lookup("Treeview", "rowheight") or 20
+        try:
+            altezza_riga = int(altezza_riga)
+        except (TypeError, ValueError):
+            altezza_riga = 20
+        # Meno l'intestazione delle colonne
+        visibili = max(1, (event.height - altezza_riga) // altezza_riga)
+        if visibili != self.visibili:
+            self.visibili = visibili
+            self.aggiorna()
+
+
 class FatturaPro:
     """Generatore professionale di fatture italiane"""
     
@@ -77,7 +226,7 @@ class FatturaPro:
         # Dati
         self.dati_azienda = self.init_dati_azienda()
         self.dati_cliente = self.init_dati_cliente()
-        self.prodotti: List[Dict] = []
+        self.modello = ModelloFattura()
         self.numero_fattura = ""
         self.data_fattura = datetime.now().strftime("%d/%m/%Y")
         self.data_scadenza = ""
@@ -87,10 +236,47 @@ class FatturaPro:
         self.note = ""
         self.banca_iban = ""
         self.banca_nome = ""
+        self.indice_numerazione = IndiceNumerazione()
+        self.cache_pdf = CachePDF(collega=False)  # file scelti dall'utente: copie indipendenti
+        self.lavori = EsecutoreLavori()
+        # Caricamenti all'avvio su un thread a parte: non ritardano PDF e salvataggi
+        self.caricamenti = EsecutoreLavori("fattura-caricamenti")
+        self._controllo_lavori = None
+        
+        # Widget dei tab: esistono solo dopo che il tab è stato aperto la prima volta
+        self.schede = {}  # tab non ancora costruiti -> funzione che ne crea il contenuto
+        self.entries_azienda = {}
+        self.entries_cliente = {}
+        self.entries_fattura = {}
+        self.text_note = None
+        self.entry_iban = None
+        self.entry_banca = None
+        self.lista_prodotti = None
+        self.label_totale = None
+        self.label_imponibile = None
+        self.label_iva = None
+        self.label_totale_riepilogo = None
+        self.entry_cerca_cliente = None
+        self.lista_clienti_trovati = None
+        self.clienti_trovati: List[Dict] = []
+        self.registro_clienti: Optional[RegistroClienti] = None
+        self.entry_cerca_articolo = None
+        self.lista_articoli_trovati = None
+        self.articoli_trovati: List[Articolo] = []
+        self.indice_catalogo: Optional[IndiceCatalogo] = None
+        self.firma_catalogo = None  # stato del file quando l'indice è stato letto
         
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.chiudi)
         self.load_settings()
         self.auto_numero_fattura()
+        self.carica_anagrafica_clienti()
+        self.carica_catalogo()
+    
+    @property
+    def prodotti(self) -> List[Dict]:
+        """Righe prodotto della fattura (gestite da self.modello)"""
+        return self.modello.prodotti
     
     def setup_styles(self):
         """Configura gli stili moderni"""
@@ -158,6 +344,10 @@ class FatturaPro:
                                     bg=COLOR_PRIMARY, fg="white")
         self.status_label.pack(side=tk.RIGHT, padx=20, pady=15)
         
+        # Avanzamento e annullamento dei lavori in background (visibili solo durante un lavoro)
+        self.btn_annulla = ttk.Button(header, text="✖ Annulla", command=self.annulla_lavori)
+        self.progress_lavori = ttk.Progressbar(header, mode="determinate", maximum=1.0, length=160)
+        
         # Container principale
         main_container = tk.Frame(self.root, bg=COLOR_BG)
         main_container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -166,21 +356,32 @@ class FatturaPro:
         self.notebook = ttk.Notebook(main_container)
         self.notebook.pack(fill=tk.BOTH, expand=True)
         
-        # Tab
-        self.create_azienda_tab()
-        self.create_cliente_tab()
-        self.create_prodotti_tab()
-        self.create_fattura_tab()
-        self.create_riepilogo_tab()
+        # Tab: il contenuto si costruisce alla prima apertura
+        self.aggiungi_scheda("🏢 Azienda", self.create_azienda_tab)
+        self.aggiungi_scheda("👤 Cliente", self.create_cliente_tab)
+        self.aggiungi_scheda("📦 Prodotti/Servizi", self.create_prodotti_tab, padding=10)
+        self.aggiungi_scheda("📄 Fattura", self.create_fattura_tab)
+        self.aggiungi_scheda("📊 Riepilogo", self.create_riepilogo_tab)
+        self.notebook.bind("<<NotebookTabChanged>>", lambda e: self.costruisci_scheda(self.notebook.select()))
+        self.costruisci_scheda(self.notebook.select())
         
         # Barra azioni
         self.create_action_bar()
     
-    def create_azienda_tab(self):
+    def aggiungi_scheda(self, testo: str, costruttore, padding: int = 20):
+        """Aggiunge un tab vuoto; costruttore(tab) lo riempie alla prima selezione"""
+        tab = ttk.Frame(self.notebook, padding=padding)
+        self.notebook.add(tab, text=testo)
+        self.schede[str(tab)] = costruttore
+    
+    def costruisci_scheda(self, tab):
+        """Costruisce il contenuto di un tab se non è ancora stato fatto"""
+        costruttore = self.schede.pop(str(tab), None)
+        if costruttore is not None:
+            costruttore(self.notebook.nametowidget(tab))
+    
+    def create_azienda_tab(self, tab):
         """Tab dati azienda"""
-        tab = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(tab, text="🏢 Azienda")
-        
         # Scrollable frame
         canvas_frame = tk.Canvas(tab, bg=COLOR_BG)
         scrollbar = ttk.Scrollbar(tab, orient="vertical", command=canvas_frame.yview)
@@ -218,11 +419,26 @@ class FatturaPro:
         scrollable.columnconfigure(0, weight=1)
         canvas_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.mostra_azienda()
     
-    def create_cliente_tab(self):
+    def create_cliente_tab(self, tab):
         """Tab dati cliente"""
-        tab = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(tab, text="👤 Cliente")
+        # Ricerca in anagrafica
+        search_frame = tk.Frame(tab, bg=COLOR_BG)
+        search_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=(0, 10))
+        ttk.Label(search_frame, text="🔎 Cerca in anagrafica (nome, P.IVA o CF):",
+                 font=("Segoe UI", 9)).pack(anchor=tk.W, pady=(0, 2))
+        self.entry_cerca_cliente = ttk.Entry(search_frame, font=("Segoe UI", 10))
+        self.entry_cerca_cliente.pack(fill=tk.X, ipady=4)
+        self.lista_clienti_trovati = tk.Listbox(search_frame, height=5, font=("Segoe UI", 9),
+                                                activestyle="none", relief=tk.FLAT)
+        self.lista_clienti_trovati.pack(fill=tk.X, pady=(2, 0))
+        
+        self.entry_cerca_cliente.bind("<KeyRelease>", self.cerca_cliente)
+        self.entry_cerca_cliente.bind("<Return>", lambda e: self.scegli_cliente(0))
+        self.entry_cerca_cliente.bind("<Down>", lambda e: self._vai_ai_clienti_trovati())
+        self.lista_clienti_trovati.bind("<Double-Button-1>", lambda e: self.scegli_cliente())
+        self.lista_clienti_trovati.bind("<Return>", lambda e: self.scegli_cliente())
         
         canvas_frame = tk.Canvas(tab, bg=COLOR_BG)
         scrollbar = ttk.Scrollbar(tab, orient="vertical", command=canvas_frame.yview)
@@ -257,12 +473,69 @@ class FatturaPro:
         scrollable.columnconfigure(0, weight=1)
         canvas_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.mostra_cliente()
+    
+    def carica_anagrafica_clienti(self):
+        """Carica in background l'anagrafica clienti (creandola dalle fatture se manca)"""
+        def carica(lavoro):
+            registro = RegistroClienti()
+            if not len(registro) and registro.importa_cartella("."):
+                registro.salva()
+            return registro
+        
+        def al_termine(registro, errore):
+            if errore is None:
+                self.registro_clienti = registro
+                self.status_label.config(text=f"Anagrafica: {len(registro)} clienti")
+                self.cerca_cliente()
+        
+        self.avvia_lavoro("clienti", "Caricamento anagrafica clienti", carica, al_termine, sfondo=True)
+    
+    def cerca_cliente(self, event=None):
+        """Autocompletamento: mostra i clienti che iniziano con il testo cercato"""
+        if self.entry_cerca_cliente is None or self.registro_clienti is None:
+            return
+        if event is not None and event.keysym in ("Return", "Down", "Up"):
+            return
+        self.clienti_trovati = self.registro_clienti.cerca(self.entry_cerca_cliente.get())
+        self.lista_clienti_trovati.delete(0, tk.END)
+        for cliente in self.clienti_trovati:
+            self.lista_clienti_trovati.insert(
+                tk.END, f"{cliente['ragione_sociale']}  —  {cliente['chiave']}  —  {cliente['citta']}")
     
-    def create_prodotti_tab(self):
+    def _vai_ai_clienti_trovati(self):
+        """Freccia giù dalla ricerca: passa alla lista dei risultati"""
+        if self.clienti_trovati:
+            self.lista_clienti_trovati.focus_set()
+            self.lista_clienti_trovati.selection_clear(0, tk.END)
+            self.lista_clienti_trovati.selection_set(0)
+            self.lista_clienti_trovati.activate(0)
+    
+    def scegli_cliente(self, indice: Optional[int] = None):
+        """Compila in un colpo tutti i campi cliente con il risultato scelto"""
+        if indice is None:
+            selezione = self.lista_clienti_trovati.curselection()
+            if not selezione:
+                return
+            indice = selezione[0]
+        if not 0 <= indice < len(self.clienti_trovati):
+            return
+        cliente = self.clienti_trovati[indice]
+        self.dati_cliente = {key: cliente.get(key, "") for key in self.init_dati_cliente()}
+        self.mostra_cliente()
+        self.status_label.config(text=f"Cliente: {cliente['ragione_sociale'][:30]}")
+    
+    def registra_cliente(self, data: Dict):
+        """Aggiunge all'anagrafica il cliente di una fattura salvata"""
+        registro = self.registro_clienti
+        if registro is None:
+            return
+        if registro.registra(data.get("cliente", {}), data.get("fattura", {}).get("data", "")):
+            self.avvia_lavoro("clienti_salva", "Aggiornamento anagrafica clienti",
+                              lambda lavoro, dati=registro.dati(): registro.salva(dati), lambda *esito: None)
+    
+    def create_prodotti_tab(self, tab):
         """Tab prodotti con design migliorato"""
-        tab = ttk.Frame(self.notebook, padding=10)
-        self.notebook.add(tab, text="📦 Prodotti/Servizi")
-        
         # Frame principale
         main_frame = tk.Frame(tab, bg=COLOR_BG)
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -273,20 +546,13 @@ class FatturaPro:
                                    bg=COLOR_BG, fg=COLOR_PRIMARY)
         list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        # Treeview migliorato
+        # Treeview virtuale: disegna solo le righe visibili
         columns = ("#", "Descrizione", "Q.tà", "Prezzo Unit.", "IVA %", "Totale")
-        self.tree_prodotti = ttk.Treeview(list_frame, columns=columns, show="headings", height=12)
-        
         widths = [40, 300, 80, 100, 80, 120]
-        for col, width in zip(columns, widths):
-            self.tree_prodotti.heading(col, text=col)
-            self.tree_prodotti.column(col, width=width, anchor=tk.CENTER if col != "Descrizione" else tk.W)
-        
-        scrollbar_tree = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.tree_prodotti.yview)
-        self.tree_prodotti.configure(yscrollcommand=scrollbar_tree.set)
-        
-        self.tree_prodotti.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
-        scrollbar_tree.pack(side=tk.RIGHT, fill=tk.Y, pady=5)
+        self.lista_prodotti = ListaVirtuale(list_frame, self.modello, columns, widths,
+                                            self.formatta_prodotto, height=12)
+        self.lista_prodotti.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.tree_prodotti = self.lista_prodotti.tree
         
         # Form aggiunta prodotto
         form_frame = tk.LabelFrame(main_frame, text="Aggiungi Prodotto/Servizio",
@@ -294,6 +560,23 @@ class FatturaPro:
                                   bg=COLOR_BG, fg=COLOR_PRIMARY)
         form_frame.pack(fill=tk.X, padx=10, pady=5)
         
+        # Ricerca nel catalogo: il risultato scelto compila descrizione, prezzo e IVA
+        search_frame = tk.Frame(form_frame, bg=COLOR_BG)
+        search_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        ttk.Label(search_frame, text="📚 Cerca nel catalogo (codice o descrizione):",
+                 font=("Segoe UI", 9)).pack(anchor=tk.W, pady=(0, 2))
+        self.entry_cerca_articolo = ttk.Entry(search_frame, font=("Segoe UI", 10))
+        self.entry_cerca_articolo.pack(fill=tk.X, ipady=2)
+        self.lista_articoli_trovati = tk.Listbox(search_frame, height=4, font=("Segoe UI", 9),
+                                                 activestyle="none", relief=tk.FLAT)
+        self.lista_articoli_trovati.pack(fill=tk.X, pady=(2, 0))
+        
+        self.entry_cerca_articolo.bind("<KeyRelease>", self.cerca_articolo)
+        self.entry_cerca_articolo.bind("<Return>", lambda e: self.scegli_articolo(0))
+        self.entry_cerca_articolo.bind("<Down>", lambda e: self._vai_agli_articoli_trovati())
+        self.lista_articoli_trovati.bind("<Double-Button-1>", lambda e: self.scegli_articolo())
+        self.lista_articoli_trovati.bind("<Return>", lambda e: self.scegli_articolo())
+        
         # Grid per i campi
         fields_frame = tk.Frame(form_frame, bg=COLOR_BG)
         fields_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -337,12 +620,78 @@ class FatturaPro:
                                     font=("Segoe UI", 14, "bold"),
                                     bg=COLOR_BG, fg=COLOR_PRIMARY)
         self.label_totale.pack(side=tk.RIGHT, padx=10)
+        
+        self.aggiorna_lista_prodotti()
+        self.aggiorna_totali()
     
-    def create_fattura_tab(self):
-        """Tab dettagli fattura"""
-        tab = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(tab, text="📄 Fattura")
+    def carica_catalogo(self):
+        """Carica in background il catalogo prodotti e ne costruisce l'indice di ricerca"""
+        def carica(lavoro):
+            if not Path(CATALOGO_FILE).exists():
+                return None, firma_catalogo()
+            with CatalogoProdotti() as catalogo:
+                indice = catalogo.indice()
+            # Dopo la chiusura: aprire e chiudere la connessione tocca il WAL
+            return indice, firma_catalogo()
+        
+        def al_termine(esito, errore):
+            if errore is not None:
+                return
+            indice, self.firma_catalogo = esito
+            if indice is not None:
+                self.indice_catalogo = indice
+                self.status_label.config(text=f"Catalogo: {len(indice)} articoli")
+                self.cerca_articolo()
         
+        self.avvia_lavoro("catalogo", "Caricamento catalogo prodotti", carica, al_termine, sfondo=True)
+    
+    def cerca_articolo(self, event=None):
+        """Autocompletamento: articoli per codice, parola iniziale o parte della descrizione"""
+        if self.entry_cerca_articolo is None:
+            return
+        if event is not None and event.keysym in ("Return", "Down", "Up"):
+            return
+        if (event is not None and "catalogo" not in self.caricamenti.attivi
+                and firma_catalogo() != self.firma_catalogo):
+            # Catalogo modificato da fuori (import, variazione prezzi): si ricarica in background
+            self.carica_catalogo()
+        if self.indice_catalogo is None:
+            return
+        self.articoli_trovati = self.indice_catalogo.cerca(self.entry_cerca_articolo.get())
+        self.lista_articoli_trovati.delete(0, tk.END)
+        for articolo in self.articoli_trovati:
+            self.lista_articoli_trovati.insert(
+                tk.END, f"{articolo.sku}  —  {articolo.descrizione}  —  € {articolo.prezzo:.2f}  —  IVA {articolo.iva:g}%")
+    
+    def _vai_agli_articoli_trovati(self):
+        """Freccia giù dalla ricerca: passa alla lista dei risultati"""
+        if self.articoli_trovati:
+            self.lista_articoli_trovati.focus_set()
+            self.lista_articoli_trovati.selection_clear(0, tk.END)
+            self.lista_articoli_trovati.selection_set(0)
+            self.lista_articoli_trovati.activate(0)
+    
+    def scegli_articolo(self, indice: Optional[int] = None):
+        """Compila descrizione, prezzo e IVA con l'articolo scelto; resta da indicare la quantità"""
+        if indice is None:
+            selezione = self.lista_articoli_trovati.curselection()
+            if not selezione:
+                return
+            indice = selezione[0]
+        if not 0 <= indice < len(self.articoli_trovati):
+            return
+        articolo = self.articoli_trovati[indice]
+        self.entry_desc.delete(0, tk.END)
+        self.entry_desc.insert(0, articolo.descrizione)
+        self.entry_prezzo.delete(0, tk.END)
+        self.entry_prezzo.insert(0, f"{articolo.prezzo:.2f}")
+        self.entry_iva.set(f"{articolo.iva:g}")
+        self.entry_qty.focus_set()
+        self.entry_qty.select_range(0, tk.END)
+        self.status_label.config(text=f"Articolo: {articolo.sku}")
+    
+    def create_fattura_tab(self, tab):
+        """Tab dettagli fattura"""
         canvas_frame = tk.Canvas(tab, bg=COLOR_BG)
         scrollbar = ttk.Scrollbar(tab, orient="vertical", command=canvas_frame.yview)
         scrollable = tk.Frame(canvas_frame, bg=COLOR_BG)
@@ -351,7 +700,7 @@ class FatturaPro:
         canvas_frame.create_window((0, 0), window=scrollable, anchor="nw")
         canvas_frame.configure(yscrollcommand=scrollbar.set)
         
-        # Dati fattura
+        # Dati fattura (la chiave è anche il nome dell'attributo che ne tiene il valore)
         fields = [
             ("Tipo Documento", "tipo_fattura"),
             ("Numero Fattura *", "numero_fattura"),
@@ -379,10 +728,6 @@ class FatturaPro:
                 self.entries_fattura[key] = entry
             row += 1
         
-        # Data default
-        if "data_fattura" in self.entries_fattura:
-            self.entries_fattura["data_fattura"].set(self.data_fattura)
-        
         # Note
         note_frame = tk.LabelFrame(scrollable, text="Note", font=("Segoe UI", 10, "bold"),
                                   bg=COLOR_BG, fg=COLOR_PRIMARY)
@@ -411,12 +756,10 @@ class FatturaPro:
         scrollable.columnconfigure(0, weight=1)
         canvas_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.mostra_fattura()
     
-    def create_riepilogo_tab(self):
+    def create_riepilogo_tab(self, tab):
         """Tab riepilogo con calcoli"""
-        tab = ttk.Frame(self.notebook, padding=20)
-        self.notebook.add(tab, text="📊 Riepilogo")
-        
         frame = tk.Frame(tab, bg=COLOR_BG)
         frame.pack(fill=tk.BOTH, expand=True)
         
@@ -451,6 +794,8 @@ class FatturaPro:
         
         ttk.Button(preview_frame, text="🔄 Aggiorna Anteprima", 
                   command=self.aggiorna_anteprima).pack(pady=5)
+        
+        self.aggiorna_totali()
     
     def create_action_bar(self):
         """Barra azioni principale"""
@@ -468,9 +813,59 @@ class FatturaPro:
                   style='Success.TButton').pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="🔄 Nuova Fattura", command=self.nuova_fattura,
                   style='Success.TButton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="🧾 Esporta XML", command=self.esporta_fatturapa,
+                  style='Success.TButton').pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="📄 Genera PDF", command=self.genera_pdf,
                   style='Primary.TButton').pack(side=tk.LEFT, padx=10)
     
+    def avvia_lavoro(self, chiave: str, descrizione: str, funzione, al_termine, sfondo: bool = False) -> bool:
+        """Esegue funzione(lavoro) in background; al_termine(risultato, errore) torna nel thread Tk
+        
+        I lavori di sfondo (caricamenti) usano un thread separato e non mostrano
+        la barra di avanzamento, riservata alle operazioni avviate dall'utente.
+        """
+        esecutore = self.caricamenti if sfondo else self.lavori
+        if esecutore.invia(chiave, descrizione, funzione, al_termine) is None:
+            self.status_label.config(text=f"{descrizione} già in corso...")
+            return False
+        self.status_label.config(text=f"{descrizione}...")
+        if not sfondo:
+            self.progress_lavori["value"] = 0
+            self.btn_annulla.pack(side=tk.RIGHT, padx=(0, 20), pady=15)
+            self.progress_lavori.pack(side=tk.RIGHT, padx=5, pady=15)
+        if self._controllo_lavori is None:
+            self._controllo_lavori = self.root.after(INTERVALLO_LAVORI, self.controlla_lavori)
+        return True
+    
+    def controlla_lavori(self):
+        """Ritira i lavori terminati e aggiorna la barra di avanzamento (via root.after)"""
+        self._controllo_lavori = None
+        self.caricamenti.raccogli()
+        self.lavori.raccogli()
+        corrente = self.lavori.corrente()
+        if corrente is None:
+            self.progress_lavori.pack_forget()
+            self.btn_annulla.pack_forget()
+        else:
+            self.progress_lavori["value"] = corrente.progresso
+        if corrente is None and not self.caricamenti.attivi:
+            return
+        self._controllo_lavori = self.root.after(INTERVALLO_LAVORI, self.controlla_lavori)
+    
+    def annulla_lavori(self):
+        """Annulla i lavori in background in corso"""
+        self.lavori.annulla()
+        self.status_label.config(text="Annullamento in corso...")
+    
+    def chiudi(self):
+        """Chiude la finestra, chiedendo conferma se ci sono lavori in corso"""
+        if self.lavori.attivi and not messagebox.askyesno(
+                "Conferma", "Ci sono operazioni in corso. Uscire comunque?"):
+            return
+        self.lavori.annulla()
+        self.caricamenti.annulla()
+        self.root.destroy()
+    
     def auto_numero_fattura(self):
         """Genera automaticamente il numero fattura"""
         if not self.numero_fattura:
@@ -482,22 +877,11 @@ class FatturaPro:
                 self.entries_fattura["numero_fattura"].set(self.numero_fattura)
     
     def get_last_fattura_num(self) -> int:
-        """Recupera l'ultimo numero fattura usato"""
-        # Cerca file JSON salvati
-        max_num = 0
-        for file in Path(".").glob("fattura_*.json"):
-            try:
-                with open(file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if "fattura" in data and "numero" in data["fattura"]:
-                        num_str = data["fattura"]["numero"]
-                        # Estrai numero
-                        match = re.search(r'(\d{4})$', num_str)
-                        if match:
-                            max_num = max(max_num, int(match.group(1)))
-            except:
-                pass
-        return max_num
+        """Recupera l'ultimo numero fattura usato nell'anno per il tipo documento"""
+        tipo = self.tipo_fattura
+        if "tipo_fattura" in self.entries_fattura:
+            tipo = self.entries_fattura["tipo_fattura"].get() or tipo
+        return self.indice_numerazione.ultimo(datetime.now().year, tipo)
     
     def aggiungi_prodotto(self):
         """Aggiunge un prodotto"""
@@ -511,22 +895,10 @@ class FatturaPro:
             prezzo = float(self.entry_prezzo.get() or "0")
             iva = float(self.entry_iva.get() or "22")
             
-            imponibile = quantita * prezzo
-            iva_importo = imponibile * (iva / 100)
-            totale = imponibile + iva_importo
-            
-            prodotto = {
-                "descrizione": descrizione,
-                "quantita": quantita,
-                "prezzo": prezzo,
-                "iva": iva,
-                "imponibile": imponibile,
-                "iva_importo": iva_importo,
-                "totale": totale
-            }
+            prodotto = {"descrizione": descrizione}
+            prodotto.update(calcola_riga(quantita, prezzo, iva))
             
-            self.prodotti.append(prodotto)
-            self.aggiorna_lista_prodotti()
+            self.lista_prodotti.mostra(self.modello.aggiungi(prodotto))
             
             # Pulisci campi
             self.entry_desc.delete(0, tk.END)
@@ -537,20 +909,18 @@ class FatturaPro:
             
             self.aggiorna_totali()
             self.status_label.config(text=f"Prodotto aggiunto: {descrizione[:30]}...")
-            
+        
         except ValueError:
             messagebox.showerror("Errore", "Inserisci valori numerici validi")
     
     def modifica_prodotto(self):
         """Modifica il prodotto selezionato"""
-        selected = self.tree_prodotti.selection()
+        selected = self.lista_prodotti.selezione_indici()
         if not selected:
             messagebox.showwarning("Attenzione", "Seleziona un prodotto da modificare")
             return
         
-        item = selected[0]
-        index = int(self.tree_prodotti.item(item, "values")[0]) - 1
-        
+        index = selected[0]
         if 0 <= index < len(self.prodotti):
             p = self.prodotti[index]
             self.entry_desc.insert(0, p["descrizione"])
@@ -563,16 +933,14 @@ class FatturaPro:
     
     def rimuovi_prodotto(self):
         """Rimuove il prodotto selezionato"""
-        selected = self.tree_prodotti.selection()
+        selected = self.lista_prodotti.selezione_indici()
         if not selected:
             messagebox.showwarning("Attenzione", "Seleziona un prodotto da rimuovere")
             return
         
-        for item in selected:
-            index = int(self.tree_prodotti.item(item, "values")[0]) - 1
-            if 0 <= index < len(self.prodotti):
-                self.tree_prodotti.delete(item)
-                del self.prodotti[index]
+        # Dal fondo, così gli indici delle righe ancora da togliere non cambiano
+        for index in reversed(selected):
+            self.modello.rimuovi(index)
         
         self.aggiorna_lista_prodotti()
         self.aggiorna_totali()
@@ -580,38 +948,36 @@ class FatturaPro:
     def svuota_prodotti(self):
         """Svuota tutti i prodotti"""
         if messagebox.askyesno("Conferma", "Vuoi rimuovere tutti i prodotti?"):
-            self.prodotti.clear()
-            for item in self.tree_prodotti.get_children():
-                self.tree_prodotti.delete(item)
+            self.modello.svuota()
+            self.aggiorna_lista_prodotti()
             self.aggiorna_totali()
     
+    def formatta_prodotto(self, indice: int, p: Dict) -> tuple:
+        """Valori mostrati nella lista per una riga prodotto"""
+        return (
+            indice + 1,
+            p["descrizione"],
+            f"{p['quantita']:.2f}",
+            f"€ {p['prezzo']:.2f}",
+            f"{p['iva']:.0f}%",
+            f"€ {p['totale']:.2f}"
+        )
+    
     def aggiorna_lista_prodotti(self):
-        """Aggiorna la lista prodotti nel treeview"""
-        # Svuota
-        for item in self.tree_prodotti.get_children():
-            self.tree_prodotti.delete(item)
-        
-        # Riempie
-        for i, p in enumerate(self.prodotti, 1):
-            self.tree_prodotti.insert("", tk.END, values=(
-                i,
-                p["descrizione"],
-                f"{p['quantita']:.2f}",
-                f"€ {p['prezzo']:.2f}",
-                f"{p['iva']:.0f}%",
-                f"€ {p['totale']:.2f}"
-            ))
+        """Aggiorna la lista prodotti (solo le righe visibili che sono cambiate)"""
+        if self.lista_prodotti is not None:
+            self.lista_prodotti.aggiorna()
     
     def aggiorna_totali(self):
-        """Aggiorna i totali"""
-        totale_imponibile = sum(p["imponibile"] for p in self.prodotti)
-        totale_iva = sum(p["iva_importo"] for p in self.prodotti)
-        totale_generale = totale_imponibile + totale_iva
-        
-        self.label_totale.config(text=f"Totale: € {totale_generale:.2f}")
-        self.label_imponibile.config(text=f"Imponibile: € {totale_imponibile:.2f}")
-        self.label_iva.config(text=f"IVA: € {totale_iva:.2f}")
-        self.label_totale_riepilogo.config(text=f"TOTALE: € {totale_generale:.2f}")
+        """Aggiorna i totali nei tab già costruiti"""
+        totale_imponibile, totale_iva, totale_generale = self.modello.totali()
+        
+        if self.label_totale is not None:
+            self.label_totale.config(text=f"Totale: € {totale_generale:.2f}")
+        if self.label_imponibile is not None:
+            self.label_imponibile.config(text=f"Imponibile: € {totale_imponibile:.2f}")
+            self.label_iva.config(text=f"IVA: € {totale_iva:.2f}")
+            self.label_totale_riepilogo.config(text=f"TOTALE: € {totale_generale:.2f}")
     
     def aggiorna_anteprima(self):
         """Aggiorna l'anteprima"""
@@ -639,33 +1005,62 @@ Scadenza: {self.data_scadenza or 'N/A'}
 PRODOTTI:
 {chr(10).join([f"{i+1}. {p['descrizione']} - Q.tà: {p['quantita']:.2f} - € {p['totale']:.2f}" for i, p in enumerate(self.prodotti)])}
 
-TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
+TOTALE: € {self.modello.totali()[2]:.2f}
 """
         self.text_preview.delete("1.0", tk.END)
         self.text_preview.insert("1.0", preview)
     
     def get_all_data(self):
-        """Recupera tutti i dati dai form"""
+        """Recupera i dati dai form dei tab già costruiti
+        
+        I tab mai aperti non hanno widget: per quelli vale lo stato già
+        presente negli attributi (dati_azienda, dati_cliente, numero_fattura...).
+        """
         # Azienda
-        for key in self.dati_azienda:
-            if key in self.entries_azienda:
-                self.dati_azienda[key] = self.entries_azienda[key].get()
+        for key, entry in self.entries_azienda.items():
+            self.dati_azienda[key] = entry.get()
         
         # Cliente
-        for key in self.dati_cliente:
-            if key in self.entries_cliente:
-                self.dati_cliente[key] = self.entries_cliente[key].get()
+        for key, entry in self.entries_cliente.items():
+            self.dati_cliente[key] = entry.get()
         
         # Fattura
-        self.tipo_fattura = self.entries_fattura["tipo_fattura"].get()
-        self.numero_fattura = self.entries_fattura["numero_fattura"].get()
-        self.data_fattura = self.entries_fattura["data_fattura"].get()
-        self.data_scadenza = self.entries_fattura["data_scadenza"].get()
-        self.condizioni_pagamento = self.entries_fattura["condizioni_pagamento"].get()
-        self.causale = self.entries_fattura["causale"].get()
-        self.note = self.text_note.get("1.0", tk.END).strip()
-        self.banca_iban = self.entry_iban.get()
-        self.banca_nome = self.entry_banca.get()
+        for key, widget in self.entries_fattura.items():
+            setattr(self, key, widget.get())
+        if self.text_note is not None:
+            self.note = self.text_note.get("1.0", tk.END).strip()
+            self.banca_iban = self.entry_iban.get()
+            self.banca_nome = self.entry_banca.get()
+    
+    def mostra_azienda(self):
+        """Riporta i dati azienda nel form (se il tab è costruito)"""
+        for key, entry in self.entries_azienda.items():
+            entry.set(self.dati_azienda.get(key, ""))
+    
+    def mostra_cliente(self):
+        """Riporta i dati cliente nel form (se il tab è costruito)"""
+        for key, entry in self.entries_cliente.items():
+            entry.set(self.dati_cliente.get(key, ""))
+    
+    def mostra_fattura(self):
+        """Riporta dati fattura, note e banca nel form (se il tab è costruito)"""
+        for key, widget in self.entries_fattura.items():
+            widget.set(getattr(self, key))
+        if self.text_note is not None:
+            self.text_note.delete("1.0", tk.END)
+            self.text_note.insert("1.0", self.note)
+            self.entry_iban.delete(0, tk.END)
+            self.entry_iban.insert(0, self.banca_iban)
+            self.entry_banca.delete(0, tk.END)
+            self.entry_banca.insert(0, self.banca_nome)
+    
+    def mostra_dati(self):
+        """Riporta tutto lo stato nei tab già costruiti"""
+        self.mostra_azienda()
+        self.mostra_cliente()
+        self.mostra_fattura()
+        self.aggiorna_lista_prodotti()
+        self.aggiorna_totali()
     
     def valida_dati(self) -> tuple[bool, str]:
         """Valida i dati inseriti"""
@@ -689,17 +1084,22 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
         if not self.prodotti:
             return False, "Aggiungi almeno un prodotto/servizio"
         
-        # Valida P.IVA italiana (11 cifre)
-        piva_azienda = self.dati_azienda.get("p_iva", "").replace(" ", "")
-        if piva_azienda and (len(piva_azienda) != 11 or not piva_azienda.isdigit()):
-            return False, "Partita IVA azienda non valida (deve essere di 11 cifre)"
-        
-        piva_cliente = self.dati_cliente.get("p_iva", "").replace(" ", "")
-        if piva_cliente and (len(piva_cliente) != 11 or not piva_cliente.isdigit()):
-            return False, "Partita IVA cliente non valida (deve essere di 11 cifre)"
+        # P.IVA e codice fiscale (cifre di controllo): tutti gli errori insieme
+        errori = [e for e in errori_fattura({"azienda": self.dati_azienda, "cliente": self.dati_cliente})
+                  if not e["avviso"]]
+        if errori:
+            return False, "\n".join(e["errore"] for e in errori)
         
         return True, ""
     
+    def conferma_avvisi(self) -> bool:
+        """Segnala CAP/provincia non coerenti e chiede se procedere (la tabella è approssimata)"""
+        avvisi = [e["errore"] for e in errori_fattura({"azienda": self.dati_azienda, "cliente": self.dati_cliente})
+                  if e["avviso"]]
+        if not avvisi:
+            return True
+        return messagebox.askyesno("Attenzione", "\n".join(avvisi) + "\n\nProcedere comunque?")
+    
     def genera_pdf(self):
         """Genera il PDF della fattura"""
         if not REPORTLAB_AVAILABLE:
@@ -707,11 +1107,17 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
                                "reportlab non installato!\nInstalla con: pip install reportlab")
             return
         
+        if "pdf" in self.lavori.attivi:
+            self.status_label.config(text="Generazione PDF già in corso...")
+            return
+        
         self.get_all_data()
         valid, error = self.valida_dati()
         if not valid:
             messagebox.showerror("Errore Validazione", error)
             return
+        if not self.conferma_avvisi():
+            return
         
         filename = filedialog.asksaveasfilename(
             defaultextension=".pdf",
@@ -722,225 +1128,68 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
         if not filename:
             return
         
-        try:
-            self.create_pdf_professionale(filename)
-            messagebox.showinfo("Successo", f"Fattura generata:\n{filename}")
-            self.status_label.config(text="PDF generato con successo")
-        except Exception as e:
-            messagebox.showerror("Errore", f"Errore nella generazione PDF:\n{str(e)}")
-            self.status_label.config(text="Errore nella generazione PDF")
-    
-    def create_pdf_professionale(self, filename):
-        """Crea un PDF professionale con design italiano"""
-        doc = SimpleDocTemplate(filename, pagesize=A4,
-                               rightMargin=2*cm, leftMargin=2*cm,
-                               topMargin=2*cm, bottomMargin=2*cm)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Stili personalizzati
-        title_style = ParagraphStyle(
-            'Title',
-            parent=styles['Heading1'],
-            fontSize=28,
-            textColor=colors.HexColor('#1e40af'),
-            spaceAfter=20,
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold'
-        )
-        
-        header_style = ParagraphStyle(
-            'Header',
-            parent=styles['Normal'],
-            fontSize=11,
-            textColor=colors.HexColor('#374151'),
-            spaceAfter=5,
-            fontName='Helvetica'
-        )
-        
-        # Titolo
-        story.append(Paragraph(f"<b>{self.tipo_fattura.upper()}</b>", title_style))
-        story.append(Spacer(1, 0.3*cm))
-        
-        # Linea decorativa
-        story.append(Spacer(1, 0.2*cm))
-        
-        # Dati azienda e cliente in due colonne
-        azienda_text = f"""
-        <b>{self.dati_azienda['ragione_sociale']}</b><br/>
-        {self.dati_azienda['indirizzo']}<br/>
-        {self.dati_azienda['cap']} {self.dati_azienda['citta']}
-        {f"({self.dati_azienda['provincia']})" if self.dati_azienda.get('provincia') else ""}<br/>
-        P.IVA: {self.dati_azienda['p_iva']}<br/>
-        {f"CF: {self.dati_azienda['codice_fiscale']}<br/>" if self.dati_azienda.get('codice_fiscale') else ""}
-        {f"PEC: {self.dati_azienda['pec']}<br/>" if self.dati_azienda.get('pec') else ""}
-        {f"Tel: {self.dati_azienda['telefono']}<br/>" if self.dati_azienda.get('telefono') else ""}
-        {f"Email: {self.dati_azienda['email']}" if self.dati_azienda.get('email') else ""}
-        """
-        
-        cliente_text = f"""
-        <b>Cliente:</b><br/>
-        {self.dati_cliente['ragione_sociale']}<br/>
-        {self.dati_cliente['indirizzo']}<br/>
-        {self.dati_cliente['cap']} {self.dati_cliente['citta']}
-        {f"({self.dati_cliente['provincia']})" if self.dati_cliente.get('provincia') else ""}<br/>
-        {f"P.IVA: {self.dati_cliente['p_iva']}<br/>" if self.dati_cliente.get('p_iva') else ""}
-        {f"CF: {self.dati_cliente['codice_fiscale']}<br/>" if self.dati_cliente.get('codice_fiscale') else ""}
-        {f"Cod. Dest.: {self.dati_cliente['codice_destinatario']}" if self.dati_cliente.get('codice_destinatario') else ""}
-        """
-        
-        # Tabella a due colonne
-        dati_table_data = [
-            [Paragraph(azienda_text, header_style), Paragraph(cliente_text, header_style)]
-        ]
-        dati_table = Table(dati_table_data, colWidths=[9*cm, 9*cm])
-        dati_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 0),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-        ]))
-        story.append(dati_table)
-        story.append(Spacer(1, 0.5*cm))
-        
-        # Dettagli fattura
-        dettagli_data = [
-            ["<b>Numero Fattura:</b>", self.numero_fattura],
-            ["<b>Data Fattura:</b>", self.data_fattura],
-            ["<b>Data Scadenza:</b>", self.data_scadenza or "N/A"],
-            ["<b>Pagamento:</b>", self.condizioni_pagamento or "N/A"],
-        ]
-        
-        dettagli_table = Table(dettagli_data, colWidths=[5*cm, 13*cm])
-        dettagli_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e5e7eb')),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#1f2937')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#d1d5db')),
-        ]))
-        story.append(dettagli_table)
-        story.append(Spacer(1, 0.5*cm))
-        
-        # Tabella prodotti
-        prodotti_data = [["#", "Descrizione", "Q.tà", "Prezzo Unit.", "IVA %", "Totale"]]
-        
-        totale_imponibile = 0
-        totale_iva = 0
-        iva_breakdown = {}  # Raggruppa per aliquota IVA
-        
-        for i, p in enumerate(self.prodotti, 1):
-            prodotti_data.append([
-                str(i),
-                p['descrizione'],
-                f"{p['quantita']:.2f}",
-                f"€ {p['prezzo']:.2f}",
-                f"{p['iva']:.0f}%",
-                f"€ {p['totale']:.2f}"
-            ])
-            totale_imponibile += p['imponibile']
-            totale_iva += p['iva_importo']
-            
-            # Raggruppa per IVA
-            iva_key = f"{p['iva']:.0f}%"
-            if iva_key not in iva_breakdown:
-                iva_breakdown[iva_key] = {'imponibile': 0, 'iva': 0}
-            iva_breakdown[iva_key]['imponibile'] += p['imponibile']
-            iva_breakdown[iva_key]['iva'] += p['iva_importo']
-        
-        # Totali per aliquota IVA
-        for iva_key in sorted(iva_breakdown.keys(), key=lambda x: float(x.replace('%', ''))):
-            imp = iva_breakdown[iva_key]['imponibile']
-            iva_imp = iva_breakdown[iva_key]['iva']
-            prodotti_data.append([
-                "", "", "", "",
-                f"<b>Imponibile {iva_key}:</b>",
-                f"<b>€ {imp:.2f}</b>"
-            ])
-            prodotti_data.append([
-                "", "", "", "",
-                f"<b>IVA {iva_key}:</b>",
-                f"<b>€ {iva_imp:.2f}</b>"
-            ])
-        
-        # Totali generali
-        totale_generale = totale_imponibile + totale_iva
-        prodotti_data.append(["", "", "", "", "", ""])
-        prodotti_data.append([
-            "", "", "", "",
-            "<b>Totale Imponibile:</b>",
-            f"<b>€ {totale_imponibile:.2f}</b>"
-        ])
-        prodotti_data.append([
-            "", "", "", "",
-            "<b>Totale IVA:</b>",
-            f"<b>€ {totale_iva:.2f}</b>"
-        ])
-        prodotti_data.append([
-            "", "", "", "",
-            "<b>TOTALE FATTURA:</b>",
-            f"<b>€ {totale_generale:.2f}</b>"
-        ])
-        
-        prodotti_table = Table(prodotti_data, colWidths=[1*cm, 7*cm, 1.5*cm, 2*cm, 1.5*cm, 2.5*cm])
-        prodotti_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('ALIGN', (1, 0), (1, -1), 'LEFT'),
-            ('ALIGN', (4, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('TOPPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -len(prodotti_data)+len([x for x in prodotti_data if len(x) > 0 and x[0] == ""])), colors.white),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -len([x for x in prodotti_data if len(x) > 0 and x[0] == ""])-1), [colors.white, colors.HexColor('#f9fafb')]),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e5e7eb')),
-            ('FONTNAME', (4, -4), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (4, -4), (-1, -1), 11),
-            ('BACKGROUND', (4, -3), (-1, -1), colors.HexColor('#fef3c7')),
-            ('TEXTCOLOR', (4, -1), (-1, -1), colors.HexColor('#1e40af')),
-            ('FONTSIZE', (4, -1), (-1, -1), 14),
-        ]))
-        story.append(prodotti_table)
-        story.append(Spacer(1, 0.5*cm))
+        # Copia dei dati: la GUI resta modificabile mentre il PDF viene generato
+        data = copy.deepcopy(self.componi_dati())
+        riepilogo = copy.deepcopy(self.modello.riepilogo)
         
-        # Dati bancari
-        if self.banca_iban or self.banca_nome:
-            banca_text = f"<b>Dati Bancari:</b><br/>"
-            if self.banca_nome:
-                banca_text += f"Banca: {self.banca_nome}<br/>"
-            if self.banca_iban:
-                banca_text += f"IBAN: {self.banca_iban}"
-            story.append(Paragraph(banca_text, header_style))
-            story.append(Spacer(1, 0.3*cm))
+        def al_termine(risultato, errore):
+            if isinstance(errore, Annullato):
+                self.status_label.config(text="Generazione PDF annullata")
+            elif errore is not None:
+                messagebox.showerror("Errore", f"Errore nella generazione PDF:\n{str(errore)}")
+                self.status_label.config(text="Errore nella generazione PDF")
+            else:
+                messagebox.showinfo("Successo", f"Fattura generata:\n{filename}")
+                self.status_label.config(text="PDF generato con successo")
         
-        # Note
-        if self.note:
-            story.append(Paragraph(f"<b>Note:</b><br/>{self.note}", header_style))
-            story.append(Spacer(1, 0.3*cm))
+        self.avvia_lavoro("pdf", "Generazione PDF",
+                          lambda lavoro: self.create_pdf_professionale(filename, data, riepilogo, lavoro.avanza),
+                          al_termine)
+    
+    def esporta_fatturapa(self):
+        """Esporta la fattura in formato FatturaPA (XML per lo SDI)"""
+        self.get_all_data()
+        valid, error = self.valida_dati()
+        if not valid:
+            messagebox.showerror("Errore Validazione", error)
+            return
+        if not self.conferma_avvisi():
+            return
         
-        # Causale
-        if self.causale:
-            story.append(Paragraph(f"<b>Causale:</b> {self.causale}", header_style))
+        data = self.componi_dati()
+        contatore = ContatoreInvii()
+        n = contatore.prossimo()
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".xml",
+            filetypes=[("FatturaPA XML", "*.xml")],
+            initialfile=nome_file_xml(data, progressivo_invio(n))
+        )
         
-        # Footer
-        story.append(Spacer(1, 1*cm))
-        footer_text = f"<i>Documento generato il {datetime.now().strftime('%d/%m/%Y alle %H:%M')} con Fattura Pro</i>"
-        story.append(Paragraph(footer_text, ParagraphStyle('Footer', parent=styles['Normal'], 
-                                                          fontSize=8, textColor=colors.grey,
-                                                          alignment=TA_CENTER)))
+        if not filename:
+            return
         
-        doc.build(story)
+        try:
+            esporta_xml(data, filename, progressivo_invio(n))
+            contatore.registra(n)
+            messagebox.showinfo("Successo", f"FatturaPA esportata:\n{filename}")
+            self.status_label.config(text="XML FatturaPA esportato")
+        except Exception as e:
+            messagebox.showerror("Errore", f"Errore nell'esportazione XML:\n{str(e)}")
     
-    def salva_dati(self):
-        """Salva i dati"""
-        self.get_all_data()
+    def create_pdf_professionale(self, filename, data: Dict, riepilogo_iva=None, progresso=None):
+        """Crea un PDF professionale con design italiano (eseguito nel thread di lavoro)
         
-        data = {
+        Se la stessa fattura è già stata generata, il PDF viene preso dalla cache.
+        """
+        with span("gui.pdf", righe=len(data.get("prodotti", []))) as fase:
+            fase.imposta(cache=self.cache_pdf.genera(
+                filename, chiave_pdf(data),
+                lambda: render_pdf(data, riepilogo_iva=riepilogo_iva, progresso=progresso)))
+        return filename
+    
+    def componi_dati(self) -> Dict:
+        """Compone il dizionario fattura (formato dei file JSON salvati)"""
+        return {
             "azienda": self.dati_azienda,
             "cliente": self.dati_cliente,
             "fattura": {
@@ -958,6 +1207,15 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
             },
             "prodotti": self.prodotti
         }
+    
+    def salva_dati(self):
+        """Salva i dati"""
+        if "salva" in self.lavori.attivi:
+            self.status_label.config(text="Salvataggio già in corso...")
+            return
+        
+        self.get_all_data()
+        data = copy.deepcopy(self.componi_dati())
         
         filename = filedialog.asksaveasfilename(
             defaultextension=".json",
@@ -965,11 +1223,46 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
             initialfile=f"fattura_{self.numero_fattura.replace('/', '_')}.json"
         )
         
-        if filename:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+        if not filename:
+            return
+        
+        def scrivi(lavoro):
+            lavoro.controlla()
+            # File temporaneo + fsync + rename: mai una fattura troncata su disco
+            scrivi_json_atomico(filename, data, indent=2)
+            lavoro.progresso = 0.5
+            if lavoro.annullato:
+                # Il file è già scritto: si annulla solo l'archiviazione
+                return "Fattura salvata, archiviazione annullata"
+            try:
+                with span("archivio.salva"), ArchivioFatture() as archivio:
+                    archivio.salva(data, filename)
+            except Exception as e:
+                return f"Fattura salvata ma non archiviata:\n{str(e)}"
+            return ""
+        
+        def al_termine(avviso, errore):
+            if isinstance(errore, Annullato):
+                self.status_label.config(text="Salvataggio annullato")
+                return
+            if errore is not None:
+                messagebox.showerror("Errore", f"Errore nel salvataggio:\n{str(errore)}")
+                self.status_label.config(text="Errore nel salvataggio")
+                return
+            self.registra_cliente(data)
+            if avviso:
+                messagebox.showwarning("Attenzione", avviso)
             messagebox.showinfo("Successo", "Dati salvati!")
             self.status_label.config(text="Dati salvati")
+        
+        # Il numero si registra prima della scrittura (giornale su disco): anche se il
+        # salvataggio non arriva in fondo non verrà riassegnato a un'altra fattura
+        try:
+            self.indice_numerazione.registra(data)
+        except OSError as e:
+            messagebox.showerror("Errore", f"Impossibile registrare il numero fattura:\n{str(e)}")
+            return
+        self.avvia_lavoro("salva", "Salvataggio", scrivi, al_termine)
     
     def carica_dati(self):
         """Carica i dati"""
@@ -981,53 +1274,44 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
             return
         
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
+            with span("json.carica", file=os.path.basename(filename)), open(filename, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
+            # Le modifiche non ancora lette dai form restano per i campi assenti nel file
+            self.get_all_data()
+            
             # Carica azienda
             if "azienda" in data:
                 for key, value in data["azienda"].items():
-                    if key in self.entries_azienda:
-                        self.entries_azienda[key].set(value)
+                    if key in self.dati_azienda:
+                        self.dati_azienda[key] = value
             
             # Carica cliente
             if "cliente" in data:
                 for key, value in data["cliente"].items():
-                    if key in self.entries_cliente:
-                        self.entries_cliente[key].set(value)
+                    if key in self.dati_cliente:
+                        self.dati_cliente[key] = value
             
             # Carica fattura
             if "fattura" in data:
                 f = data["fattura"]
-                if "tipo" in f:
-                    self.entries_fattura["tipo_fattura"].set(f["tipo"])
-                if "numero" in f:
-                    self.entries_fattura["numero_fattura"].set(f["numero"])
-                if "data" in f:
-                    self.entries_fattura["data_fattura"].set(f["data"])
-                if "scadenza" in f:
-                    self.entries_fattura["data_scadenza"].set(f["scadenza"])
-                if "condizioni" in f:
-                    self.entries_fattura["condizioni_pagamento"].set(f["condizioni"])
-                if "causale" in f:
-                    self.entries_fattura["causale"].set(f["causale"])
-                if "note" in f:
-                    self.text_note.delete("1.0", tk.END)
-                    self.text_note.insert("1.0", f.get("note", ""))
+                for chiave, attributo in (("tipo", "tipo_fattura"), ("numero", "numero_fattura"),
+                                          ("data", "data_fattura"), ("scadenza", "data_scadenza"),
+                                          ("condizioni", "condizioni_pagamento"), ("causale", "causale"),
+                                          ("note", "note")):
+                    if chiave in f:
+                        setattr(self, attributo, f[chiave])
             
             # Carica banca
             if "banca" in data:
-                self.entry_iban.delete(0, tk.END)
-                self.entry_iban.insert(0, data["banca"].get("iban", ""))
-                self.entry_banca.delete(0, tk.END)
-                self.entry_banca.insert(0, data["banca"].get("nome", ""))
+                self.banca_iban = data["banca"].get("iban", "")
+                self.banca_nome = data["banca"].get("nome", "")
             
             # Carica prodotti
             if "prodotti" in data:
-                self.prodotti = data["prodotti"]
-                self.aggiorna_lista_prodotti()
-                self.aggiorna_totali()
+                self.modello.carica(data["prodotti"])
             
+            self.mostra_dati()
             messagebox.showinfo("Successo", "Dati caricati!")
             self.status_label.config(text="Dati caricati")
         except Exception as e:
@@ -1036,15 +1320,12 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
     def nuova_fattura(self):
         """Crea una nuova fattura"""
         if messagebox.askyesno("Conferma", "Vuoi creare una nuova fattura?\nI dati non salvati andranno persi."):
-            # Mantieni solo i dati azienda
-            azienda_backup = {}
-            for key in self.dati_azienda:
-                if key in self.entries_azienda:
-                    azienda_backup[key] = self.entries_azienda[key].get()
+            # Mantieni solo i dati azienda (anche quelli appena digitati)
+            self.get_all_data()
             
             # Reset
             self.dati_cliente = self.init_dati_cliente()
-            self.prodotti = []
+            self.modello.svuota()
             self.numero_fattura = ""
             self.data_fattura = datetime.now().strftime("%d/%m/%Y")
             self.data_scadenza = ""
@@ -1055,25 +1336,7 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
             self.banca_nome = ""
             
             # Pulisci form
-            for key in self.entries_cliente:
-                self.entries_cliente[key].set("")
-            
-            for item in self.tree_prodotti.get_children():
-                self.tree_prodotti.delete(item)
-            
-            self.entries_fattura["numero_fattura"].set("")
-            self.entries_fattura["data_fattura"].set(self.data_fattura)
-            self.entries_fattura["data_scadenza"].set("")
-            self.entries_fattura["condizioni_pagamento"].set("")
-            self.entries_fattura["causale"].set("")
-            self.text_note.delete("1.0", tk.END)
-            self.entry_iban.delete(0, tk.END)
-            self.entry_banca.delete(0, tk.END)
-            
-            # Ripristina azienda
-            for key, value in azienda_backup.items():
-                if key in self.entries_azienda:
-                    self.entries_azienda[key].set(value)
+            self.mostra_dati()
             
             self.auto_numero_fattura()
             self.aggiorna_totali()
@@ -1089,14 +1352,33 @@ TOTALE: € {sum(p['totale'] for p in self.prodotti):.2f}
                 
                 if "azienda" in data:
                     for key, value in data["azienda"].items():
-                        if key in self.entries_azienda:
-                            self.entries_azienda[key].set(value)
+                        if key in self.dati_azienda:
+                            self.dati_azienda[key] = value
+                    self.mostra_azienda()
             except:
                 pass
 
 
 def main():
     """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Fattura Pro - Generatore Fatture Italiane")
+    parser.add_argument("--batch", metavar="CARTELLA",
+                       help="Genera senza interfaccia i PDF di tutti i fattura_*.json della cartella")
+    parser.add_argument("-o", "--output", help="Cartella di destinazione dei PDF in modalità batch")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                       help="Processi di generazione in modalità batch (default: numero di CPU)")
+    parser.add_argument("--chunk", type=int, default=None,
+                       help="Fatture inviate a ogni processo per volta (default: automatico)")
+    aggiungi_opzioni_cache(parser)
+    args = parser.parse_args()
+    
+    if args.batch:
+        if not REPORTLAB_AVAILABLE:
+            print("Errore: reportlab non installato!\nInstalla con: pip install reportlab")
+            sys.exit(1)
+        risultati = render_directory(args.batch, args.output, args.workers, args.chunk, cache_da_opzioni(args))
+        sys.exit(1 if stampa_risultati(risultati) else 0)
+    
     root = tk.Tk()
     app = FatturaPro(root)
     root.mainloop()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Profilazione a fasi di Fattura Pro
+Le fasi del render, l'I/O JSON e la numerazione sono racchiuse in span(); con la variabile
+d'ambiente FATTURA_PROFILO ogni span chiuso scrive un record JSON su una riga:
+
+    FATTURA_PROFILO=profilo.jsonl python fattura_engine.py fatture/ -o pdf/
+    python fattura_profilo.py profilo.jsonl
+
+FATTURA_PROFILO=- scrive su stderr. Senza la variabile span() restituisce un oggetto
+vuoto condiviso e non misura nulla.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, TextIO
+
+
+VARIABILE = "FATTURA_PROFILO"
+
+_uscita: Optional[TextIO] = None
+_lock = threading.Lock()
+_locale = threading.local()  # pila degli span aperti per thread
+
+
+class _SpanNullo:
+    """Span disattivato: nessuna misura"""
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def imposta(self, **attributi):
+        pass
+
+
+_SPAN_NULLO = _SpanNullo()
+
+
+class Span:
+    """Una fase misurata; alla chiusura scrive il record"""
+    __slots__ = ("nome", "attributi", "inizio", "genitore")
+    
+    def __init__(self, nome: str, attributi: Dict):
+        self.nome = nome
+        self.attributi = attributi
+        self.inizio = 0
+        self.genitore = None
+    
+    def imposta(self, **attributi):
+        """Aggiunge attributi al record (per valori noti solo durante la fase)"""
+        self.attributi.update(attributi)
+    
+    def __enter__(self):
+        pila = getattr(_locale, "pila", None)
+        if pila is None:
+            pila = _locale.pila = []
+        self.genitore = pila[-1].nome if pila else None
+        pila.append(self)
+        self.inizio = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, tipo, errore, traceback):
+        durata = time.perf_counter_ns() - self.inizio
+        pila = _locale.pila
+        profondita = len(pila) - 1
+        pila.pop()
+        record = {
+            "span": self.nome,
+            "ms": durata / 1e6,
+            "t": time.time(),
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "genitore": self.genitore,
+            "profondita": profondita,
+        }
+        if tipo is not None:
+            record["errore"] = tipo.__name__
+        record.update(self.attributi)
+        scrivi_record(record)
+        return False
+
+
+def attiva(destinazione: str = "-"):
+    """Attiva la profilazione verso un file JSON lines (in append) o "-" per stderr"""
+    global _uscita
+    disattiva()
+    if destinazione == "-":
+        _uscita = sys.stderr
+    else:
+        _uscita = open(destinazione, 'a', encoding='utf-8', buffering=1)
+
+
+def disattiva():
+    """Disattiva la profilazione e chiude il file"""
+    global _uscita
+    with _lock:
+        if _uscita is not None and _uscita is not sys.stderr:
+            _uscita.close()
+        _uscita = None
+
+
+def attiva_da_ambiente():
+    """Attiva la profilazione se FATTURA_PROFILO è impostata (anche nei processi worker)"""
+    destinazione = os.environ.get(VARIABILE)
+    if destinazione:
+        attiva(destinazione)
+
+
+def attivo() -> bool:
+    """True se la profilazione è attiva"""
+    return _uscita is not None
+
+
+def _dopo_fork():
+    # Il lock potrebbe essere stato preso da un altro thread al momento della fork
+    global _lock
+    _lock = threading.Lock()
+
+
+def scrivi_record(record: Dict):
+    """Scrive un record su una riga; una sola write per riga, quindi più processi
+    possono scrivere sullo stesso file aperto in append"""
+    riga = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        if _uscita is not None:
+            _uscita.write(riga)
+
+
+def span(nome: str, **attributi):
+    """Context manager che misura una fase: with span("render.build", righe=n): ..."""
+    if _uscita is None:
+        return _SPAN_NULLO
+    return Span(nome, attributi)
+
+
+def leggi_record(path) -> List[Dict]:
+    """Record di un file JSON lines (le righe non valide vengono saltate)"""
+    record = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for riga in f:
+            try:
+                record.append(json.loads(riga))
+            except ValueError:
+                continue
+    return record
+
+
+def riepiloga(record: List[Dict]) -> Dict[str, Dict]:
+    """Per ogni span: numero, totale, media, p50, p99 e massimo in ms"""
+    durate: Dict[str, List[float]] = defaultdict(list)
+    for r in record:
+        durate[r.get("span", "?")].append(r.get("ms", 0.0))
+    riepilogo = {}
+    for nome, valori in durate.items():
+        valori.sort()
+        n = len(valori)
+        riepilogo[nome] = {
+            "n": n,
+            "totale_ms": sum(valori),
+            "media_ms": sum(valori) / n,
+            "p50_ms": valori[max(0, math.ceil(0.5 * n) - 1)],
+            "p99_ms": valori[max(0, math.ceil(0.99 * n) - 1)],
+            "max_ms": valori[-1],
+        }
+    return riepilogo
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Riepiloga un profilo JSON lines di Fattura Pro")
+    parser.add_argument("profilo", help=f"File scritto con {VARIABILE}=file.jsonl")
+    parser.add_argument("--ordina", choices=["totale", "media", "p99", "n"], default="totale",
+                       help="Ordinamento delle fasi (default: totale)")
+    args = parser.parse_args(argv)
+    
+    try:
+        riepilogo = riepiloga(leggi_record(args.profilo))
+    except OSError as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    if not riepilogo:
+        print("Nessun record nel profilo")
+        sys.exit(1)
+    
+    campo = {"totale": "totale_ms", "media": "media_ms", "p99": "p99_ms", "n": "n"}[args.ordina]
+    print(f"{'fase':<28} {'n':>7} {'totale ms':>11} {'media ms':>10} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for nome, s in sorted(riepilogo.items(), key=lambda voce: voce[1][campo], reverse=True):
+        print(f"{nome:<28} {s['n']:>7} {s['totale_ms']:>11.2f} {s['media_ms']:>10.3f} "
+              f"{s['p50_ms']:>10.3f} {s['p99_ms']:>10.3f} {s['max_ms']:>10.3f}")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dopo_fork)
+attiva_da_ambiente()
+
+
+if __name__ == "__main__":
+    main()
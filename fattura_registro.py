@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Registro IVA di Fattura Pro
+Totali per mese e aliquota (imponibile, IVA, documenti) tenuti nell'archivio SQLite e
+aggiornati a ogni fattura archiviata: i riepiloghi di mese, trimestre e anno si leggono
+dai totali senza riaprire le fatture. Le note di credito entrano con segno negativo.
+
+    python fattura_registro.py trimestre 2024 3
+    python fattura_registro.py anno 2024
+    python fattura_registro.py ricostruisci
+"""
+
+import argparse
+import sqlite3
+import sys
+from collections import defaultdict
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+
+from fattura_importi import RiepilogoIVA, da_centesimi
+
+
+REGISTRO_VERSION = 1  # PRAGMA user_version dell'archivio: sotto, il registro va ricostruito
+NOTE_CREDITO = {"nota di credito"}
+
+SCHEMA_REGISTRO = """
+CREATE TABLE IF NOT EXISTS registro_documenti (
+    tipo TEXT NOT NULL,
+    numero TEXT NOT NULL,
+    mese TEXT NOT NULL,
+    segno INTEGER NOT NULL,
+    PRIMARY KEY (tipo, numero)
+);
+CREATE TABLE IF NOT EXISTS registro_voci (
+    tipo TEXT NOT NULL,
+    numero TEXT NOT NULL,
+    aliquota REAL NOT NULL,
+    imponibile_cent INTEGER NOT NULL,
+    iva_cent INTEGER NOT NULL,
+    PRIMARY KEY (tipo, numero, aliquota)
+);
+CREATE TABLE IF NOT EXISTS registro_iva (
+    mese TEXT NOT NULL,
+    aliquota REAL NOT NULL,
+    imponibile_cent INTEGER NOT NULL,
+    iva_cent INTEGER NOT NULL,
+    documenti INTEGER NOT NULL,
+    PRIMARY KEY (mese, aliquota)
+);
+CREATE INDEX IF NOT EXISTS idx_registro_documenti_mese ON registro_documenti(mese);
+"""
+
+TRIMESTRI = {1: ("01", "03"), 2: ("04", "06"), 3: ("07", "09"), 4: ("10", "12")}
+
+
+def segno_documento(tipo: str) -> int:
+    """-1 per le note di credito (stornano imponibile e IVA), 1 per gli altri documenti"""
+    return -1 if (tipo or "").strip().lower() in NOTE_CREDITO else 1
+
+
+class RegistroIVA:
+    """Registro IVA sulle tabelle dell'archivio fatture
+    
+    Per ogni documento si conservano mese, segno e importi per aliquota
+    (registro_documenti, registro_voci); registro_iva ne è la somma per
+    mese e aliquota. Registrare di nuovo un documento toglie prima il suo
+    contributo precedente, quindi l'aggiornamento è idempotente anche se
+    cambiano data o righe. Le modifiche non fanno commit: vanno nella
+    transazione dell'archivio che salva la fattura.
+    """
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.conn.executescript(SCHEMA_REGISTRO)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < REGISTRO_VERSION:
+            # Archivio creato prima del registro: si costruisce una volta dalle fatture
+            with self.conn:
+                self.ricostruisci()
+                self.conn.execute(f"PRAGMA user_version = {REGISTRO_VERSION}")
+    
+    def togli(self, tipo: str, numero: str):
+        """Toglie dai totali il contributo di un documento (se registrato)"""
+        row = self.conn.execute(
+            "SELECT mese FROM registro_documenti WHERE tipo = ? AND numero = ?", (tipo, numero)).fetchone()
+        if row is None:
+            return
+        mese = row[0]
+        for aliquota, imponibile, iva in self.conn.execute(
+                "SELECT aliquota, imponibile_cent, iva_cent FROM registro_voci WHERE tipo = ? AND numero = ?",
+                (tipo, numero)).fetchall():
+            self.conn.execute(
+                """UPDATE registro_iva SET imponibile_cent = imponibile_cent - ?, iva_cent = iva_cent - ?,
+                       documenti = documenti - 1
+                   WHERE mese = ? AND aliquota = ?""",
+                (imponibile, iva, mese, aliquota)
+            )
+        self.conn.execute("DELETE FROM registro_iva WHERE mese = ? AND documenti <= 0", (mese,))
+        self.conn.execute("DELETE FROM registro_voci WHERE tipo = ? AND numero = ?", (tipo, numero))
+        self.conn.execute("DELETE FROM registro_documenti WHERE tipo = ? AND numero = ?", (tipo, numero))
+    
+    def registra(self, tipo: str, numero: str, data_iso: Optional[str], riepilogo: RiepilogoIVA) -> bool:
+        """Registra (o aggiorna) un documento; False se non ha una data valida e resta fuori"""
+        self.togli(tipo, numero)
+        if not data_iso:
+            return False
+        mese = data_iso[:7]
+        segno = segno_documento(tipo)
+        self.conn.execute("INSERT INTO registro_documenti (tipo, numero, mese, segno) VALUES (?, ?, ?, ?)",
+                          (tipo, numero, mese, segno))
+        for riga in riepilogo.per_aliquota():
+            aliquota = float(riga["aliquota"])
+            imponibile = segno * riga["imponibile"]
+            iva = segno * riga["iva"]
+            self.conn.execute(
+                "INSERT INTO registro_voci (tipo, numero, aliquota, imponibile_cent, iva_cent) VALUES (?, ?, ?, ?, ?)",
+                (tipo, numero, aliquota, imponibile, iva)
+            )
+            self.conn.execute(
+                """INSERT INTO registro_iva (mese, aliquota, imponibile_cent, iva_cent, documenti)
+                   VALUES (?, ?, ?, ?, 1)
+                   ON CONFLICT(mese, aliquota) DO UPDATE SET
+                       imponibile_cent = imponibile_cent + excluded.imponibile_cent,
+                       iva_cent = iva_cent + excluded.iva_cent,
+                       documenti = documenti + 1""",
+                (mese, aliquota, imponibile, iva)
+            )
+        return True
+    
+    def ricostruisci(self) -> Tuple[int, int]:
+        """Ricalcola il registro dalle fatture archiviate, in un solo passaggio sulle righe
+        
+        Le righe si leggono in streaming fattura per fattura; in memoria restano
+        solo i totali per mese e aliquota. Restituisce documenti registrati ed
+        esclusi per data mancante. Senza commit, come registra().
+        """
+        for tabella in ("registro_documenti", "registro_voci", "registro_iva"):
+            self.conn.execute(f"DELETE FROM {tabella}")
+        totali: Dict[Tuple[str, float], List[int]] = defaultdict(lambda: [0, 0, 0])
+        registrati = esclusi = 0
+        righe = self.conn.execute(
+            """SELECT f.id, f.tipo, f.numero, f.data_iso, p.iva, p.imponibile
+               FROM fatture f LEFT JOIN prodotti p ON p.fattura_id = f.id
+               ORDER BY f.id, p.riga"""
+        )
+        for (_, tipo, numero, data_iso), gruppo in groupby(righe, key=lambda r: tuple(r[:4])):
+            if not data_iso:
+                esclusi += 1
+                continue
+            riepilogo = RiepilogoIVA()
+            for *_, aliquota, imponibile in gruppo:
+                if aliquota is not None:
+                    riepilogo.aggiungi({"iva": aliquota, "imponibile": imponibile})
+            mese = data_iso[:7]
+            segno = segno_documento(tipo)
+            self.conn.execute("INSERT INTO registro_documenti (tipo, numero, mese, segno) VALUES (?, ?, ?, ?)",
+                              (tipo, numero, mese, segno))
+            for riga in riepilogo.per_aliquota():
+                voce = (float(riga["aliquota"]), segno * riga["imponibile"], segno * riga["iva"])
+                self.conn.execute(
+                    "INSERT INTO registro_voci (tipo, numero, aliquota, imponibile_cent, iva_cent) "
+                    "VALUES (?, ?, ?, ?, ?)", (tipo, numero) + voce)
+                totale = totali[mese, voce[0]]
+                totale[0] += voce[1]
+                totale[1] += voce[2]
+                totale[2] += 1
+            registrati += 1
+        self.conn.executemany(
+            "INSERT INTO registro_iva (mese, aliquota, imponibile_cent, iva_cent, documenti) VALUES (?, ?, ?, ?, ?)",
+            ((mese, aliquota, *valori) for (mese, aliquota), valori in totali.items())
+        )
+        return registrati, esclusi
+    
+    def riepilogo(self, da_mese: str, a_mese: str) -> Dict:
+        """Totali per aliquota tra due mesi aaaa-mm (inclusi), in centesimi"""
+        aliquote = [
+            {"aliquota": aliquota, "imponibile": imponibile, "iva": iva, "documenti": documenti}
+            for aliquota, imponibile, iva, documenti in self.conn.execute(
+                """SELECT aliquota, SUM(imponibile_cent), SUM(iva_cent), SUM(documenti)
+                   FROM registro_iva WHERE mese BETWEEN ? AND ?
+                   GROUP BY aliquota ORDER BY aliquota""", (da_mese, a_mese))
+        ]
+        documenti, note_credito = self.conn.execute(
+            """SELECT COUNT(*), COALESCE(SUM(segno < 0), 0)
+               FROM registro_documenti WHERE mese BETWEEN ? AND ?""", (da_mese, a_mese)).fetchone()
+        return {
+            "da": da_mese,
+            "a": a_mese,
+            "aliquote": aliquote,
+            "imponibile": sum(a["imponibile"] for a in aliquote),
+            "iva": sum(a["iva"] for a in aliquote),
+            "documenti": documenti,
+            "note_credito": note_credito,
+        }
+    
+    def per_mese(self, da_mese: str, a_mese: str) -> List[Dict]:
+        """Imponibile e IVA di ogni mese tra due mesi aaaa-mm (inclusi), in centesimi"""
+        return [
+            {"mese": mese, "imponibile": imponibile, "iva": iva}
+            for mese, imponibile, iva in self.conn.execute(
+                """SELECT mese, SUM(imponibile_cent), SUM(iva_cent) FROM registro_iva
+                   WHERE mese BETWEEN ? AND ? GROUP BY mese ORDER BY mese""", (da_mese, a_mese))
+        ]
+    
+    def mese(self, anno: int, mese: int) -> Dict:
+        """Liquidazione mensile"""
+        return self.riepilogo(f"{anno:04d}-{mese:02d}", f"{anno:04d}-{mese:02d}")
+    
+    def trimestre(self, anno: int, trimestre: int) -> Dict:
+        """Liquidazione trimestrale (trimestre 1-4)"""
+        da, a = TRIMESTRI[trimestre]
+        return self.riepilogo(f"{anno:04d}-{da}", f"{anno:04d}-{a}")
+    
+    def anno(self, anno: int) -> Dict:
+        """Riepilogo annuale"""
+        return self.riepilogo(f"{anno:04d}-01", f"{anno:04d}-12")
+
+
+def _euro(centesimi: int) -> str:
+    return f"€ {da_centesimi(centesimi):>14.2f}"
+
+
+def stampa_riepilogo(titolo: str, riepilogo: Dict, mesi: Optional[List[Dict]] = None):
+    """Stampa un riepilogo del registro"""
+    print(titolo)
+    if mesi:
+        print(f"\n{'mese':<10}{'imponibile':>18}{'IVA':>18}")
+        for m in mesi:
+            print(f"{m['mese']:<10}{_euro(m['imponibile']):>18}{_euro(m['iva']):>18}")
+    print(f"\n{'aliquota':<10}{'imponibile':>18}{'IVA':>18}{'documenti':>11}")
+    for a in riepilogo["aliquote"]:
+        print(f"{a['aliquota']:>7g}%  {_euro(a['imponibile']):>18}"
+              f"{_euro(a['iva']):>18}{a['documenti']:>11}")
+    print(f"{'Totale':<10}{_euro(riepilogo['imponibile']):>18}{_euro(riepilogo['iva']):>18}")
+    print(f"\nDocumenti: {riepilogo['documenti']} (note di credito: {riepilogo['note_credito']})")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    from fattura_archivio import DB_FILE, ArchivioFatture
+    
+    parser = argparse.ArgumentParser(description="Registro IVA delle fatture archiviate")
+    parser.add_argument("--db", default=DB_FILE, help=f"File dell'archivio (default: {DB_FILE})")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    p = sub.add_parser("mese", help="Liquidazione di un mese")
+    p.add_argument("anno", type=int)
+    p.add_argument("mese", type=int, choices=range(1, 13), metavar="MESE")
+    p = sub.add_parser("trimestre", help="Liquidazione di un trimestre")
+    p.add_argument("anno", type=int)
+    p.add_argument("trimestre", type=int, choices=[1, 2, 3, 4])
+    p = sub.add_parser("anno", help="Riepilogo annuale, mese per mese")
+    p.add_argument("anno", type=int)
+    sub.add_parser("ricostruisci", help="Ricalcola il registro da tutte le fatture archiviate")
+    args = parser.parse_args(argv)
+    
+    with ArchivioFatture(args.db) as archivio:
+        registro = archivio.registro
+        if args.comando == "ricostruisci":
+            with archivio.conn:
+                registrati, esclusi = registro.ricostruisci()
+            print(f"Documenti registrati: {registrati}, senza data valida: {esclusi}")
+            sys.exit(1 if esclusi else 0)
+        elif args.comando == "mese":
+            stampa_riepilogo(f"Registro IVA {args.mese:02d}/{args.anno}", registro.mese(args.anno, args.mese))
+        elif args.comando == "trimestre":
+            da, a = TRIMESTRI[args.trimestre]
+            stampa_riepilogo(f"Registro IVA {args.trimestre}° trimestre {args.anno}",
+                             registro.trimestre(args.anno, args.trimestre),
+                             registro.per_mese(f"{args.anno}-{da}", f"{args.anno}-{a}"))
+        elif args.comando == "anno":
+            stampa_riepilogo(f"Registro IVA {args.anno}", registro.anno(args.anno),
+                             registro.per_mese(f"{args.anno}-01", f"{args.anno}-12"))
+
+
+if __name__ == "__main__":
+    main()
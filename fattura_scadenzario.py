@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Scadenzario di Fattura Pro
+Le scadenze delle fatture archiviate, con data normalizzata, importo e stato di pagamento.
+Le fatture non pagate sono in un indice ordinato per scadenza: "scadute al giorno X" e
+"in scadenza nei prossimi N giorni" leggono solo le righe richieste. Gli incassi si
+segnano a mano o abbinando un estratto conto CSV della banca.
+
+    python fattura_scadenzario.py scadute
+    python fattura_scadenzario.py prossime 30
+    python fattura_scadenzario.py estratto movimenti.csv
+"""
+
+import argparse
+import re
+import sqlite3
+import sys
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from fattura_importi import da_centesimi, in_centesimi
+from fattura_registro import segno_documento
+
+
+SCHEMA_SCADENZE = """
+CREATE TABLE IF NOT EXISTS scadenze (
+    tipo TEXT NOT NULL,
+    numero TEXT NOT NULL,
+    scadenza TEXT NOT NULL,
+    importo_cent INTEGER NOT NULL,
+    cliente TEXT,
+    pagato_il TEXT,
+    riferimento TEXT,
+    PRIMARY KEY (tipo, numero)
+);
+CREATE INDEX IF NOT EXISTS idx_scadenze_aperte ON scadenze(scadenza) WHERE pagato_il IS NULL;
+CREATE INDEX IF NOT EXISTS idx_scadenze_importo ON scadenze(importo_cent) WHERE pagato_il IS NULL;
+"""
+
+FORMATI_DATA = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%y", "%d.%m.%y"]
+# "30 gg", "60 giorni d.f.", "90 gg fine mese", "30 gg fm"
+RE_GIORNI = re.compile(r"(\d+)\s*(?:gg|giorni|g)\b(.*)", re.IGNORECASE)
+RE_FINE_MESE = re.compile(r"\bf\.?\s*m\.?(?:\W|$)|fine\s+mese", re.IGNORECASE)
+RE_A_VISTA = re.compile(r"vista|rimessa\s+diretta|immediat|contanti|anticipat", re.IGNORECASE)
+RE_NUMERO = re.compile(r"[A-Za-z0-9]+(?:[/\-_.][A-Za-z0-9]+)*")
+
+COLONNE_DATA = ["data valuta", "data contabile", "data operazione", "data"]
+COLONNE_IMPORTO = ["importo", "entrate", "avere", "accrediti", "accredito"]
+COLONNE_DESCRIZIONE = ["descrizione", "causale", "descrizione operazione", "dettagli", "note"]
+
+
+def leggi_data(testo: str) -> Optional[date]:
+    """Data in uno dei formati comuni (gg/mm/aaaa, gg-mm-aa, aaaa-mm-gg...), None se non valida"""
+    testo = (testo or "").strip()
+    for formato in FORMATI_DATA:
+        try:
+            return datetime.strptime(testo, formato).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalizza_scadenza(scadenza: str, data_fattura: str = "", condizioni: str = "") -> Optional[str]:
+    """Scadenza in formato aaaa-mm-gg dal testo libero della fattura
+    
+    Accetta una data esplicita oppure termini relativi alla data fattura
+    ("30 gg", "60 giorni fine mese", "rimessa diretta"), nella scadenza o
+    in mancanza nelle condizioni di pagamento. None se non si ricava.
+    """
+    esplicita = leggi_data(scadenza)
+    if esplicita:
+        return esplicita.isoformat()
+    base = leggi_data(data_fattura)
+    if base is None:
+        return None
+    for testo in (scadenza, condizioni):
+        testo = (testo or "").strip()
+        if not testo:
+            continue
+        trovato = RE_GIORNI.search(testo)
+        if trovato:
+            giorno = base + timedelta(days=int(trovato.group(1)))
+            if RE_FINE_MESE.search(trovato.group(2)):
+                giorno = giorno.replace(day=monthrange(giorno.year, giorno.month)[1])
+            return giorno.isoformat()
+        if RE_A_VISTA.search(testo):
+            return base.isoformat()
+    return None
+
+
+class Scadenza(NamedTuple):
+    """Una scadenza aperta o incassata (importo in centesimi)"""
+    tipo: str
+    numero: str
+    scadenza: str
+    importo_cent: int
+    cliente: str
+    pagato_il: Optional[str]
+    riferimento: Optional[str]
+    
+    @property
+    def importo(self) -> float:
+        return da_centesimi(self.importo_cent)
+
+
+class Abbinamento(NamedTuple):
+    """Un movimento dell'estratto conto abbinato a una scadenza"""
+    riga: int
+    data: Optional[str]
+    importo_cent: int
+    descrizione: str
+    scadenza: Optional[Scadenza]
+    criterio: str  # "numero", "importo", "importo diverso", "già pagata", "ambiguo", "nessuno"
+
+
+class Scadenzario:
+    """Scadenze delle fatture sulle tabelle dell'archivio
+    
+    Ogni fattura archiviata (non le note di credito) aggiorna la propria
+    scadenza; risalvarla non cambia lo stato di pagamento. L'indice parziale
+    idx_scadenze_aperte contiene solo le scadenze non pagate, ordinate per
+    data: scadute() e in_scadenza() sono una ricerca nel B-tree più la
+    lettura dei risultati, a prescindere dalla dimensione dell'archivio.
+    Come il registro IVA, le modifiche fatte per conto dell'archivio non
+    fanno commit; quelle dello scadenzario (pagamenti) sì.
+    """
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        nuova = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scadenze'").fetchone() is None
+        self.conn.executescript(SCHEMA_SCADENZE)
+        if nuova:
+            # Archivio creato prima dello scadenzario: le scadenze si ricavano una volta dalle fatture
+            with self.conn:
+                self.ricostruisci()
+    
+    def registra(self, tipo: str, numero: str, fattura: Dict, totale_cent: int, cliente: str = "") -> bool:
+        """Aggiorna la scadenza di un documento; False se non ne ha una (o è una nota di credito)"""
+        scadenza = None
+        if segno_documento(tipo) > 0:
+            scadenza = normalizza_scadenza(fattura.get("scadenza", ""), fattura.get("data", ""),
+                                           fattura.get("condizioni", ""))
+        if scadenza is None:
+            self.conn.execute("DELETE FROM scadenze WHERE tipo = ? AND numero = ? AND pagato_il IS NULL",
+                              (tipo, numero))
+            return False
+        self.conn.execute(
+            """INSERT INTO scadenze (tipo, numero, scadenza, importo_cent, cliente) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(tipo, numero) DO UPDATE SET scadenza = excluded.scadenza,
+                   importo_cent = excluded.importo_cent, cliente = excluded.cliente""",
+            (tipo, numero, scadenza, totale_cent, cliente)
+        )
+        return True
+    
+    def ricostruisci(self) -> int:
+        """Ricava le scadenze di tutte le fatture archiviate (senza commit); restituisce quante
+        
+        Le scadenze aperte vengono ricreate da zero, così spariscono quelle di
+        fatture non più in archivio; quelle pagate restano come storico incassi.
+        """
+        self.conn.execute("DELETE FROM scadenze WHERE pagato_il IS NULL")
+        n = 0
+        for tipo, numero, scadenza, data, condizioni, totale, cliente in self.conn.execute(
+                """SELECT f.tipo, f.numero, f.scadenza, f.data, f.condizioni, f.totale, c.ragione_sociale
+                   FROM fatture f LEFT JOIN clienti c ON c.id = f.cliente_id""").fetchall():
+            fattura = {"scadenza": scadenza, "data": data, "condizioni": condizioni}
+            n += self.registra(tipo, numero, fattura, in_centesimi(totale or 0), cliente or "")
+        return n
+    
+    def _scadenze(self, where: str, params) -> List[Scadenza]:
+        return [Scadenza(*row) for row in self.conn.execute(
+            f"""SELECT tipo, numero, scadenza, importo_cent, cliente, pagato_il, riferimento
+                FROM scadenze WHERE {where}""", params)]
+    
+    def scadute(self, al: Optional[date] = None) -> List[Scadenza]:
+        """Scadenze non pagate con data precedente a `al` (default: oggi), dalla più vecchia"""
+        al = al or date.today()
+        return self._scadenze("pagato_il IS NULL AND scadenza < ? ORDER BY scadenza", (al.isoformat(),))
+    
+    def in_scadenza(self, giorni: int, dal: Optional[date] = None) -> List[Scadenza]:
+        """Scadenze non pagate da `dal` (default: oggi) ai `giorni` successivi, estremi inclusi"""
+        dal = dal or date.today()
+        return self._scadenze("pagato_il IS NULL AND scadenza BETWEEN ? AND ? ORDER BY scadenza",
+                              (dal.isoformat(), (dal + timedelta(days=giorni)).isoformat()))
+    
+    def cerca(self, numero: str, tipo: Optional[str] = None) -> List[Scadenza]:
+        """Scadenze di un numero di documento"""
+        if tipo:
+            return self._scadenze("numero = ? AND tipo = ?", (numero, tipo))
+        return self._scadenze("numero = ?", (numero,))
+    
+    def segna_pagata(self, tipo: str, numero: str, il: Optional[date] = None, riferimento: str = "") -> bool:
+        """Segna come pagata una scadenza aperta; False se non c'è o è già pagata"""
+        il = il or date.today()
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE scadenze SET pagato_il = ?, riferimento = ? WHERE tipo = ? AND numero = ? AND pagato_il IS NULL",
+                (il.isoformat(), riferimento or None, tipo, numero)
+            )
+        return cur.rowcount > 0
+    
+    def annulla_pagamento(self, tipo: str, numero: str) -> bool:
+        """Riapre una scadenza segnata come pagata"""
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE scadenze SET pagato_il = NULL, riferimento = NULL WHERE tipo = ? AND numero = ?",
+                (tipo, numero))
+        return cur.rowcount > 0
+    
+    def abbina(self, movimenti: Iterable[Dict]) -> List[Abbinamento]:
+        """Abbina i movimenti in entrata di un estratto conto alle scadenze aperte
+        
+        Per ogni movimento si cercano nella descrizione i numeri delle fatture
+        (una lettura delle scadenze, poi un dizionario); se non ne cita
+        nessuna, si cerca una scadenza aperta con lo stesso importo, valida
+        solo se unica. Una scadenza viene abbinata al più una volta.
+        Non modifica nulla: vedi applica().
+        """
+        per_numero: Dict[str, List[Scadenza]] = {}
+        per_importo: Dict[int, List[Scadenza]] = {}
+        for s in self._scadenze("1", ()):
+            per_numero.setdefault(s.numero.upper(), []).append(s)
+            if s.pagato_il is None:
+                per_importo.setdefault(s.importo_cent, []).append(s)
+        usate = set()
+        abbinamenti = []
+        for movimento in movimenti:
+            importo = movimento["importo_cent"]
+            descrizione = movimento.get("descrizione", "")
+            trovata, criterio = None, "nessuno"
+            citate = [s for token in RE_NUMERO.findall(descrizione) for s in per_numero.get(token.upper(), ())]
+            candidate = [s for s in citate if s.pagato_il is None and (s.tipo, s.numero) not in usate]
+            if candidate:
+                trovata = next((s for s in candidate if s.importo_cent == importo), None)
+                criterio = "numero" if trovata else "importo diverso"
+                trovata = trovata or candidate[0]
+            elif citate:
+                trovata, criterio = citate[0], "già pagata"
+            else:
+                stesso_importo = [s for s in per_importo.get(importo, ()) if (s.tipo, s.numero) not in usate]
+                if len(stesso_importo) == 1:
+                    trovata, criterio = stesso_importo[0], "importo"
+                elif stesso_importo:
+                    criterio = "ambiguo"
+            if trovata is not None and criterio in ("numero", "importo"):
+                usate.add((trovata.tipo, trovata.numero))
+            abbinamenti.append(Abbinamento(movimento["riga"], movimento.get("data"), importo,
+                                           descrizione, trovata, criterio))
+        return abbinamenti
+    
+    def applica(self, abbinamenti: Iterable[Abbinamento], criteri=("numero",)) -> int:
+        """Segna pagate, in un'unica transazione, le scadenze abbinate con uno dei criteri"""
+        with self.conn:
+            cur = self.conn.executemany(
+                """UPDATE scadenze SET pagato_il = ?, riferimento = ?
+                   WHERE tipo = ? AND numero = ? AND pagato_il IS NULL""",
+                ((a.data or date.today().isoformat(), f"estratto riga {a.riga}: {a.descrizione[:80]}",
+                  a.scadenza.tipo, a.scadenza.numero)
+                 for a in abbinamenti if a.scadenza is not None and a.criterio in criteri)
+            )
+            return cur.rowcount
+
+
+def _colonna(intestazione: List[str], scelta: Optional[str], candidate: List[str]) -> Optional[int]:
+    """Indice della colonna indicata o della prima colonna candidata presente"""
+    for nome in ([scelta.strip().lower()] if scelta else candidate):
+        if nome in intestazione:
+            return intestazione.index(nome)
+    return None
+
+
+def leggi_estratto(path, delimitatore: Optional[str] = None, encoding: str = "utf-8-sig",
+                   colonna_data: Optional[str] = None, colonna_importo: Optional[str] = None,
+                   colonna_descrizione: Optional[str] = None) -> Iterable[Dict]:
+    """Movimenti in entrata (importo positivo) di un estratto conto CSV, riga per riga"""
+    from fattura_import import ErroreImport, apri_csv, leggi_numero
+    f, reader = apri_csv(path, encoding=encoding, delimitatore=delimitatore)
+    with f:
+        intestazione = [c.strip().lower() for c in next(reader, [])]
+        i_data = _colonna(intestazione, colonna_data, COLONNE_DATA)
+        i_importo = _colonna(intestazione, colonna_importo, COLONNE_IMPORTO)
+        i_descrizione = _colonna(intestazione, colonna_descrizione, COLONNE_DESCRIZIONE)
+        if i_importo is None:
+            raise ErroreImport(f"colonna importo non trovata (attese: {', '.join(COLONNE_IMPORTO)})")
+        for n, riga in enumerate(reader, start=2):
+            try:
+                importo = in_centesimi(leggi_numero(riga[i_importo]))
+            except (IndexError, ArithmeticError, ValueError):
+                continue
+            if importo <= 0:
+                continue
+            giorno = leggi_data(riga[i_data]) if i_data is not None and i_data < len(riga) else None
+            yield {
+                "riga": n,
+                "data": giorno.isoformat() if giorno else None,
+                "importo_cent": importo,
+                "descrizione": riga[i_descrizione].strip() if i_descrizione is not None and i_descrizione < len(riga) else "",
+            }
+
+
+def stampa_scadenze(scadenze: List[Scadenza], oggi: date):
+    """Stampa un elenco di scadenze con i giorni di ritardo (o mancanti)"""
+    for s in scadenze:
+        giorni = (date.fromisoformat(s.scadenza) - oggi).days
+        quando = f"{-giorni} gg fa" if giorni < 0 else ("oggi" if giorni == 0 else f"tra {giorni} gg")
+        print(f"{s.scadenza:<12}{quando:<12}{s.numero:<18}{(s.cliente or '')[:30]:<32}€ {s.importo:>12.2f}")
+    print(f"\nScadenze: {len(scadenze)}, totale: € {da_centesimi(sum(s.importo_cent for s in scadenze)):.2f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    from fattura_archivio import DB_FILE, ArchivioFatture
+    
+    def data_argomento(testo: str) -> date:
+        giorno = leggi_data(testo)
+        if giorno is None:
+            raise argparse.ArgumentTypeError(f"data non valida: '{testo}'")
+        return giorno
+    
+    parser = argparse.ArgumentParser(description="Scadenzario delle fatture archiviate")
+    parser.add_argument("--db", default=DB_FILE, help=f"File dell'archivio (default: {DB_FILE})")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    p = sub.add_parser("scadute", help="Fatture non pagate già scadute")
+    p.add_argument("--al", type=data_argomento, help="Data di riferimento gg/mm/aaaa (default: oggi)")
+    p = sub.add_parser("prossime", help="Fatture non pagate in scadenza nei prossimi giorni")
+    p.add_argument("giorni", type=int)
+    p.add_argument("--dal", type=data_argomento, help="Data di partenza gg/mm/aaaa (default: oggi)")
+    p = sub.add_parser("pagata", help="Segna una fattura come pagata")
+    p.add_argument("numero")
+    p.add_argument("--tipo", default="Fattura")
+    p.add_argument("--il", type=data_argomento, help="Data dell'incasso gg/mm/aaaa (default: oggi)")
+    p.add_argument("--annulla", action="store_true", help="Riapre la scadenza")
+    p = sub.add_parser("estratto", help="Segna pagate le fatture trovate in un estratto conto CSV")
+    p.add_argument("csv")
+    p.add_argument("-d", "--delimitatore", help="Separatore di campo (default: rilevato)")
+    p.add_argument("--encoding", default="utf-8-sig", help="Codifica del file (default: utf-8-sig)")
+    p.add_argument("--colonna-data", help=f"Colonna della data (default: {' / '.join(COLONNE_DATA)})")
+    p.add_argument("--colonna-importo", help=f"Colonna dell'importo (default: {' / '.join(COLONNE_IMPORTO)})")
+    p.add_argument("--colonna-descrizione",
+                   help=f"Colonna della descrizione (default: {' / '.join(COLONNE_DESCRIZIONE)})")
+    p.add_argument("--anche-per-importo", action="store_true",
+                   help="Segna pagate anche le fatture abbinate solo per importo (se unico)")
+    p.add_argument("--verifica", action="store_true", help="Mostra gli abbinamenti senza segnare nulla")
+    sub.add_parser("ricostruisci", help="Ricava di nuovo le scadenze da tutte le fatture archiviate")
+    args = parser.parse_args(argv)
+    
+    with ArchivioFatture(args.db) as archivio:
+        scadenzario = archivio.scadenzario
+        if args.comando == "scadute":
+            oggi = args.al or date.today()
+            stampa_scadenze(scadenzario.scadute(oggi), oggi)
+        elif args.comando == "prossime":
+            oggi = args.dal or date.today()
+            stampa_scadenze(scadenzario.in_scadenza(args.giorni, oggi), oggi)
+        elif args.comando == "pagata":
+            if args.annulla:
+                fatto = scadenzario.annulla_pagamento(args.tipo, args.numero)
+            else:
+                fatto = scadenzario.segna_pagata(args.tipo, args.numero, args.il)
+            print(f"{args.tipo} {args.numero}: " + ("aggiornata" if fatto else "scadenza aperta non trovata"))
+            sys.exit(0 if fatto else 1)
+        elif args.comando == "ricostruisci":
+            with archivio.conn:
+                print(f"Scadenze: {scadenzario.ricostruisci()}")
+        elif args.comando == "estratto":
+            try:
+                abbinamenti = scadenzario.abbina(leggi_estratto(
+                    args.csv, args.delimitatore, args.encoding,
+                    args.colonna_data, args.colonna_importo, args.colonna_descrizione))
+            except (OSError, ValueError) as e:
+                print(f"Errore: {e}")
+                sys.exit(1)
+            criteri = ("numero", "importo") if args.anche_per_importo else ("numero",)
+            for a in abbinamenti:
+                fattura = a.scadenza.numero if a.scadenza else "-"
+                segno = "✓" if a.scadenza is not None and a.criterio in criteri else "?"
+                print(f"{segno} riga {a.riga:<5} € {da_centesimi(a.importo_cent):>10.2f}  "
+                      f"{fattura:<16} {a.criterio:<16} {a.descrizione[:40]}")
+            if args.verifica:
+                return
+            print(f"\nScadenze segnate come pagate: {scadenzario.applica(abbinamenti, criteri)}")
+
+
+if __name__ == "__main__":
+    main()
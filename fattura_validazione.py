@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Validazione anagrafiche di Fattura Pro
+Cifra di controllo della Partita IVA, carattere di controllo del codice fiscale e
+coerenza CAP/provincia, per una fattura o per interi archivi e file di import
+(i soggetti ripetuti vengono controllati una sola volta)
+"""
+
+import argparse
+import json
+import re
+import sys
+from functools import lru_cache
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+# Sigle delle province italiane più EE (estero)
+PROVINCE = frozenset("""
+AG AL AN AO AP AQ AR AT AV BA BG BI BL BN BO BR BS BT BZ CA CB CE CH CL CN CO CR CS CT CZ
+EN FC FE FG FI FM FR GE GO GR IM IS KR LC LE LI LO LT LU MB MC ME MI MN MO MS MT NA NO NU
+OR PA PC PD PE PG PI PN PO PR PT PU PV PZ RA RC RE RG RI RM RN RO SA SI SO SP SR SS SU SV
+TA TE TN TO TP TR TS TV UD VA VB VC VE VI VR VT VV EE
+""".split())
+
+# Province ammesse per le prime due cifre del CAP. La tabella è volutamente larga
+# (più province per prefisso, comuni passati ad altra provincia senza cambiare CAP):
+# segnala le incoerenze evidenti, non sostituisce lo stradario.
+PROVINCE_PER_CAP = {
+    "00": "RM", "01": "VT", "02": "RI", "03": "FR", "04": "LT", "05": "TR", "06": "PG",
+    "07": "SS", "08": "NU OR", "09": "CA OR SU",
+    "10": "TO", "11": "AO", "12": "CN", "13": "VC BI", "14": "AT", "15": "AL", "16": "GE",
+    "17": "SV", "18": "IM", "19": "SP",
+    "20": "MI MB LO", "21": "VA", "22": "CO LC", "23": "SO LC", "24": "BG", "25": "BS",
+    "26": "CR LO", "27": "PV", "28": "NO VB", "29": "PC",
+    "30": "VE", "31": "TV", "32": "BL UD", "33": "UD PN", "34": "TS GO", "35": "PD", "36": "VI",
+    "37": "VR", "38": "TN", "39": "BZ",
+    "40": "BO", "41": "MO", "42": "RE", "43": "PR", "44": "FE", "45": "RO", "46": "MN",
+    "47": "FC RN", "48": "RA",
+    "50": "FI", "51": "PT", "52": "AR", "53": "SI", "54": "MS", "55": "LU", "56": "PI",
+    "57": "LI", "58": "GR", "59": "PO",
+    "60": "AN", "61": "PU", "62": "MC", "63": "AP FM", "64": "TE", "65": "PE", "66": "CH",
+    "67": "AQ",
+    "70": "BA", "71": "FG", "72": "BR", "73": "LE", "74": "TA", "75": "MT", "76": "BT",
+    "80": "NA", "81": "CE", "82": "BN", "83": "AV", "84": "SA", "85": "PZ", "86": "CB IS",
+    "87": "CS", "88": "CZ KR", "89": "RC VV",
+    "90": "PA", "91": "TP", "92": "AG", "93": "CL", "94": "EN", "95": "CT", "96": "SR",
+    "97": "RG", "98": "ME",
+}
+PROVINCE_PER_CAP = {prefisso: frozenset(sigle.split()) for prefisso, sigle in PROVINCE_PER_CAP.items()}
+
+# Valori dei caratteri in posizione dispari (1ª, 3ª, ...) per il codice fiscale
+CF_DISPARI = dict(zip("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                      [1, 0, 5, 7, 9, 13, 15, 17, 19, 21] +
+                      [1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25, 24, 23]))
+CF_PARI = {c: (int(c) if c.isdigit() else ord(c) - ord("A")) for c in CF_DISPARI}
+# Le cifre possono essere sostituite da lettere (omocodia)
+RE_CODICE_FISCALE = re.compile(r"^[A-Z]{6}[0-9LMNPQRSTUV]{2}[A-EHLMPRST][0-9LMNPQRSTUV]{2}[A-Z][0-9LMNPQRSTUV]{3}[A-Z]$")
+RE_CAP = re.compile(r"^\d{5}$")
+
+# Prefissi delle partite IVA estere accettati (VIES, con EL per la Grecia e XI per
+# l'Irlanda del Nord, più i paesi vicini fuori dall'UE); la loro cifra di controllo non si verifica
+PREFISSI_IVA_ESTERI = frozenset("""
+AT BE BG CY CZ DE DK EE EL ES FI FR HR HU IE LT LU LV MT NL PL PT RO SE SI SK XI
+CH GB LI MC NO SM VA
+""".split())
+# Codice paese ISO 3166 dove il prefisso IVA è diverso
+PAESE_PREFISSO = {"EL": "GR", "XI": "GB"}
+RE_IVA_ESTERA = re.compile(r"^[A-Z0-9+*]{2,12}$")
+
+SOGGETTI = ("azienda", "cliente")
+# Solo le cifre di controllo sono certe; CAP e provincia (tabella approssimata) danno un avviso
+CAMPI_BLOCCANTI = frozenset({"p_iva", "codice_fiscale"})
+MESSAGGI = {
+    "p_iva": "Partita IVA {} non valida",
+    "codice_fiscale": "Codice fiscale {} non valido",
+    "cap": "CAP {} non valido",
+    "provincia": "Provincia {} non valida",
+}
+
+
+def _pulisci(valore) -> str:
+    return re.sub(r"\s+", "", str(valore or "")).upper()
+
+
+def errore_partita_iva(p_iva: str) -> Optional[str]:
+    """Motivo per cui la Partita IVA non è valida, o None
+    
+    Delle partite IVA estere (prefisso in PREFISSI_IVA_ESTERI) si controlla
+    solo il formato; un prefisso sconosciuto è un errore.
+    """
+    p_iva = _pulisci(p_iva)
+    if p_iva[:2].isalpha():
+        prefisso, p_iva = p_iva[:2], p_iva[2:]
+        if prefisso in PREFISSI_IVA_ESTERI:
+            return None if RE_IVA_ESTERA.match(p_iva) else "formato non valido"
+        if prefisso != "IT":
+            return f"prefisso paese {prefisso} non riconosciuto"
+    if len(p_iva) != 11 or not p_iva.isdigit():
+        return "deve essere di 11 cifre"
+    if p_iva == "0" * 11:
+        return "non può essere tutta zeri"
+    if cifra_controllo_partita_iva(p_iva[:10]) != int(p_iva[10]):
+        return "cifra di controllo errata"
+    return None
+
+
+def paese_partita_iva(p_iva: str) -> Tuple[str, str]:
+    """(codice paese ISO, codice senza prefisso) di una Partita IVA; IT se non c'è prefisso"""
+    p_iva = _pulisci(p_iva)
+    if p_iva[:2] in PREFISSI_IVA_ESTERI or p_iva[:2] == "IT":
+        return PAESE_PREFISSO.get(p_iva[:2], p_iva[:2]), p_iva[2:]
+    return "IT", p_iva
+
+
+def cifra_controllo_partita_iva(cifre: str) -> int:
+    """Cifra di controllo (11ª) delle prime 10 cifre di una Partita IVA"""
+    somma = 0
+    for i, c in enumerate(cifre):
+        n = int(c)
+        if i % 2:
+            n *= 2
+            if n > 9:
+                n -= 9
+        somma += n
+    return (10 - somma % 10) % 10
+
+
+def carattere_controllo_codice_fiscale(primi15: str) -> str:
+    """Carattere di controllo (16°) dei primi 15 caratteri di un codice fiscale"""
+    somma = sum(CF_DISPARI[c] if i % 2 == 0 else CF_PARI[c] for i, c in enumerate(primi15))
+    return chr(ord("A") + somma % 26)
+
+
+def errore_codice_fiscale(codice_fiscale: str) -> Optional[str]:
+    """Motivo per cui il codice fiscale non è valido, o None
+    
+    Accetta sia il codice di 16 caratteri delle persone fisiche sia quello
+    numerico di 11 cifre dei soggetti diversi (controllato come una Partita IVA).
+    """
+    cf = _pulisci(codice_fiscale)
+    if len(cf) == 11 and cf.isdigit():
+        return errore_partita_iva(cf)
+    if len(cf) != 16:
+        return "deve essere di 16 caratteri (o 11 cifre)"
+    if not RE_CODICE_FISCALE.match(cf):
+        return "formato non valido"
+    if carattere_controllo_codice_fiscale(cf[:15]) != cf[15]:
+        return "carattere di controllo errato"
+    return None
+
+
+def errori_indirizzo(cap: str, provincia: str) -> List[Tuple[str, str]]:
+    """Errori (campo, motivo) di CAP e provincia"""
+    cap = _pulisci(cap)
+    provincia = _pulisci(provincia)
+    errori = []
+    if provincia and provincia not in PROVINCE:
+        errori.append(("provincia", "sigla non valida"))
+    if provincia == "EE":
+        return errori
+    if cap and not RE_CAP.match(cap):
+        errori.append(("cap", "deve essere di 5 cifre"))
+    elif cap and provincia in PROVINCE:
+        ammesse = PROVINCE_PER_CAP.get(cap[:2])
+        if ammesse is None:
+            errori.append(("cap", "inesistente"))
+        elif provincia not in ammesse:
+            errori.append(("cap", f"non compatibile con la provincia {provincia} ({'/'.join(sorted(ammesse))})"))
+    return errori
+
+
+@lru_cache(maxsize=65536)
+def errori_anagrafica(p_iva: str, codice_fiscale: str, cap: str, provincia: str) -> Tuple[Tuple[str, str], ...]:
+    """Errori (campo, motivo) di un soggetto; memorizzati, perché negli archivi
+    gli stessi clienti e la stessa azienda si ripetono su molte fatture"""
+    p_iva = _pulisci(p_iva)
+    codice_fiscale = _pulisci(codice_fiscale)
+    errori = []
+    if p_iva:
+        motivo = errore_partita_iva(p_iva)
+        if motivo:
+            errori.append(("p_iva", motivo))
+    if codice_fiscale:
+        motivo = errore_codice_fiscale(codice_fiscale)
+        if motivo:
+            errori.append(("codice_fiscale", motivo))
+    errori.extend(errori_indirizzo(cap, provincia))
+    return tuple(errori)
+
+
+def errori_soggetto(soggetto: Dict) -> Tuple[Tuple[str, str], ...]:
+    """Errori (campo, motivo) del dizionario azienda o cliente"""
+    # Chiave della cache sui valori grezzi: la pulizia avviene solo al primo controllo
+    return errori_anagrafica(str(soggetto.get("p_iva") or ""), str(soggetto.get("codice_fiscale") or ""),
+                             str(soggetto.get("cap") or ""), str(soggetto.get("provincia") or ""))
+
+
+def messaggio(soggetto: str, campo: str, motivo: str) -> str:
+    """Testo di un errore per l'utente: "Partita IVA cliente non valida: cifra di controllo errata" """
+    return f"{MESSAGGI[campo].format(soggetto)}: {motivo}"
+
+
+def errori_fattura(data: Dict) -> List[Dict]:
+    """Tutti gli errori anagrafici di una fattura: {"soggetto", "campo", "valore", "errore", "avviso"}
+    
+    avviso è True per i controlli su CAP e provincia, che l'utente può ignorare;
+    gli errori sulle cifre di controllo di P.IVA e codice fiscale sono bloccanti.
+    """
+    errori = []
+    for soggetto in SOGGETTI:
+        dati = data.get(soggetto) or {}
+        for campo, motivo in errori_soggetto(dati):
+            errori.append({"soggetto": soggetto, "campo": campo, "valore": dati.get(campo, ""),
+                           "errore": messaggio(soggetto, campo, motivo),
+                           "avviso": campo not in CAMPI_BLOCCANTI})
+    return errori
+
+
+def valida_fatture(fatture: Iterable[Tuple[str, Dict]]) -> Iterator[Dict]:
+    """Valida (origine, fattura) in un solo passaggio e genera un record per ogni errore
+    
+    Non si ferma al primo errore: ogni record è {"origine", "numero", "soggetto",
+    "campo", "valore", "errore", "avviso"}. Al posto della fattura può esserci
+    l'eccezione che ne ha impedito la lettura: diventa un errore con campo "file".
+    """
+    for origine, data in fatture:
+        if isinstance(data, Exception):
+            yield {"origine": origine, "numero": "", "soggetto": "", "campo": "file", "valore": "",
+                   "errore": f"file illeggibile: {data}", "avviso": False}
+            continue
+        numero = (data.get("fattura") or {}).get("numero", "")
+        for errore in errori_fattura(data):
+            yield dict(errore, origine=origine, numero=numero)
+
+
+def fatture_cartella(cartella, pattern: str = "fattura_*.json") -> Iterator[Tuple[str, Union[Dict, Exception]]]:
+    """(file, fattura) dei JSON di una cartella; (file, eccezione) per quelli illeggibili"""
+    for path in sorted(Path(cartella).glob(pattern)):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("la fattura non è un oggetto JSON")
+        except (OSError, ValueError) as e:
+            yield str(path), e
+            continue
+        yield str(path), data
+
+
+def fatture_archivio(path: str) -> Iterator[Tuple[str, Dict]]:
+    """(tipo e numero, anagrafiche) delle fatture dell'archivio SQLite, senza ricomporre i prodotti"""
+    from fattura_archivio import ArchivioFatture
+    campi = ("p_iva", "codice_fiscale", "cap", "provincia")
+    colonne = ", ".join([f"a.{c}" for c in campi] + [f"c.{c}" for c in campi])
+    with ArchivioFatture(path) as archivio:
+        for riga in archivio.conn.execute(
+                f"""SELECT f.tipo, f.numero, {colonne} FROM fatture f
+                    LEFT JOIN aziende a ON a.id = f.azienda_id
+                    LEFT JOIN clienti c ON c.id = f.cliente_id ORDER BY f.id"""):
+            valori = tuple(riga)
+            yield f"{valori[0]} {valori[1]}", {
+                "fattura": {"numero": valori[1]},
+                "azienda": dict(zip(campi, valori[2:6])),
+                "cliente": dict(zip(campi, valori[6:10])),
+            }
+
+
+def fatture_csv(path) -> Iterator[Tuple[str, Dict]]:
+    """(riga, fattura) di un file di import CSV (vedi fattura_import)"""
+    from fattura_import import _sezione, carica_azienda, chiave_fattura, leggi_righe
+    azienda = carica_azienda()
+    for _, gruppo in groupby(leggi_righe(path), key=lambda r: chiave_fattura(r[1])):
+        n_riga, prima = next(gruppo)
+        yield f"{path}:{n_riga}", {"fattura": {"numero": prima.get("numero", "")},
+                                   "azienda": azienda, "cliente": _sezione(prima, "cliente_")}
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Controlla Partite IVA, codici fiscali e CAP/provincia")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("cartella", help="Fatture fattura_*.json di una cartella")
+    p.add_argument("sorgente")
+    p = sub.add_parser("archivio", help="Fatture dell'archivio SQLite")
+    p.add_argument("sorgente", nargs="?", default=None)
+    p = sub.add_parser("csv", help="File CSV da importare")
+    p.add_argument("sorgente")
+    p = sub.add_parser("codice", help="Una Partita IVA o un codice fiscale")
+    p.add_argument("sorgente")
+    args = parser.parse_args(argv)
+    
+    if args.comando == "codice":
+        codice = _pulisci(args.sorgente)
+        motivo = errore_codice_fiscale(codice) if len(codice) == 16 else errore_partita_iva(codice)
+        print(f"{codice}: {motivo or 'valido'}")
+        sys.exit(1 if motivo else 0)
+    
+    if args.comando == "archivio":
+        from fattura_archivio import DB_FILE
+        fatture = fatture_archivio(args.sorgente or DB_FILE)
+    elif args.comando == "csv":
+        fatture = fatture_csv(args.sorgente)
+    else:
+        fatture = fatture_cartella(args.sorgente)
+    
+    errori = avvisi = 0
+    try:
+        for errore in valida_fatture(fatture):
+            if errore["avviso"]:
+                avvisi += 1
+            else:
+                errori += 1
+            valore = f" ('{errore['valore']}')" if errore["valore"] else ""
+            print(f"{'!' if errore['avviso'] else '✗'} {errore['origine']}: {errore['errore']}{valore}")
+    except (OSError, ValueError) as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    info = errori_anagrafica.cache_info()
+    print(f"\nErrori: {errori}, avvisi: {avvisi} "
+          f"(soggetti distinti controllati: {info.misses}, ripetuti: {info.hits})")
+    sys.exit(1 if errori else 0)
+
+
+if __name__ == "__main__":
+    main()
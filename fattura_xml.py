@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Esportazione FatturaPA (XML per il Sistema di Interscambio)
+Scrive le fatture in streaming, senza costruire l'albero DOM in memoria
+"""
+
+import argparse
+import io
+import json
+import sys
+import zipfile
+from pathlib import Path
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, List, Optional
+
+from fattura_archivio import data_iso
+from fattura_engine import stampa_risultati, trova_fatture
+from fattura_importi import a_decimal, da_centesimi, riepiloga_fattura
+from fattura_io import scrivi_atomico, scrivi_json_atomico
+from fattura_numerazione import DATA_DIR
+from fattura_validazione import paese_partita_iva
+
+
+NAMESPACE_FATTURAPA = "http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2"
+FORMATO_PRIVATI = "FPR12"
+FORMATO_PA = "FPA12"
+
+TIPI_DOCUMENTO = {
+    "Fattura": "TD01",
+    "Nota di Credito": "TD04",
+    "Nota di Debito": "TD05",
+}
+
+CIFRE_PROGRESSIVO = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+INVII_FILE = str(Path(DATA_DIR) / "invii.json")
+
+
+def importo(valore) -> str:
+    """Formatta un importo con due decimali e il punto come separatore"""
+    return f"{float(valore):.2f}"
+
+
+def decimale(valore, cifre_max: int = 8) -> str:
+    """Formatta quantità e prezzi unitari a piena precisione (da 2 a 8 decimali)
+    
+    Arrotondarli a 2 decimali farebbe scartare la riga al controllo
+    PrezzoUnitario × Quantita = PrezzoTotale (es. 0,125 × 1000).
+    """
+    numero = a_decimal(valore).quantize(Decimal(1).scaleb(-cifre_max), rounding=ROUND_HALF_UP)
+    intero, _, decimali = f"{numero:f}".partition(".")
+    return f"{intero}.{decimali.rstrip('0').ljust(2, '0')}"
+
+
+def progressivo_invio(n: int) -> str:
+    """Progressivo di invio alfanumerico di 5 caratteri (base 36)"""
+    cifre = ""
+    for _ in range(5):
+        n, resto = divmod(n, 36)
+        cifre = CIFRE_PROGRESSIVO[resto] + cifre
+    return cifre
+
+
+def nome_file_xml(data: Dict, progressivo: str) -> str:
+    """Nome file SDI: IT + identificativo del trasmittente + progressivo"""
+    azienda = data.get("azienda", {})
+    paese, codice = paese_partita_iva(azienda.get("p_iva") or "")
+    if not codice:
+        paese, codice = "IT", (azienda.get("codice_fiscale") or "").replace(" ", "").upper()
+    return f"{paese}{codice}_{progressivo}.xml"
+
+
+class ContatoreInvii:
+    """Ultimo progressivo di invio usato, salvato accanto all'indice di numerazione
+    
+    Lo SDI scarta un file con lo stesso nome di uno già ricevuto: il progressivo
+    avanza a ogni esportazione riuscita, dalla GUI come dalla riga di comando.
+    """
+    
+    def __init__(self, path: str = INVII_FILE):
+        self.path = Path(path)
+    
+    def ultimo(self) -> int:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                ultimo = json.load(f).get("ultimo", 0)
+            return ultimo if isinstance(ultimo, int) else 0
+        except (OSError, ValueError, AttributeError):
+            return 0
+    
+    def prossimo(self) -> int:
+        return self.ultimo() + 1
+    
+    def registra(self, n: int):
+        """Annota n come usato (i progressivi non tornano mai indietro)"""
+        if n > self.ultimo():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            scrivi_json_atomico(self.path, {"ultimo": n})
+
+
+def dividi_testo(testo: str, lunghezza: int = 200) -> List[str]:
+    """Divide un testo lungo nei blocchi massimi ammessi da FatturaPA"""
+    testo = " ".join((testo or "").split())
+    return [testo[i:i + lunghezza] for i in range(0, len(testo), lunghezza)]
+
+
+class ScrittoreXML:
+    """XMLGenerator con indentazione, che scrive direttamente sullo stream"""
+    
+    def __init__(self, stream, indent: str = "  "):
+        from xml.sax.saxutils import XMLGenerator  # importa anche urllib: solo all'esportazione
+        self.xml = XMLGenerator(stream, encoding="utf-8", short_empty_elements=True)
+        self.indent = indent
+        self.livello = 0
+    
+    def inizio(self):
+        self.xml.startDocument()
+    
+    def fine(self):
+        self.xml.ignorableWhitespace("\n")
+        self.xml.endDocument()
+    
+    def _a_capo(self):
+        self.xml.ignorableWhitespace("\n" + self.indent * self.livello)
+    
+    def apri(self, tag: str, attributi: Optional[Dict] = None):
+        if self.livello:
+            self._a_capo()
+        self.xml.startElement(tag, attributi or {})
+        self.livello += 1
+    
+    def chiudi(self, tag: str):
+        self.livello -= 1
+        self._a_capo()
+        self.xml.endElement(tag)
+    
+    def elemento(self, tag: str, testo):
+        """Scrive <tag>testo</tag>; i valori vuoti vengono omessi"""
+        if testo is None or testo == "":
+            return
+        self._a_capo()
+        self.xml.startElement(tag, {})
+        self.xml.characters(str(testo))
+        self.xml.endElement(tag)
+
+
+class EsportatoreFatturaPA:
+    """Converte il dizionario fattura (formato salva_dati) in FatturaPA"""
+    
+    def __init__(self, regime_fiscale: str = "RF01", natura_esente: str = "N2.2",
+                 modalita_pagamento: str = "MP05", formato: str = FORMATO_PRIVATI):
+        self.regime_fiscale = regime_fiscale
+        self.natura_esente = natura_esente
+        self.modalita_pagamento = modalita_pagamento
+        self.formato = formato
+    
+    def scrivi(self, data: Dict, stream, progressivo: str = "00001"):
+        """Scrive una fattura FatturaPA sullo stream (binario o testo)"""
+        out = ScrittoreXML(stream)
+        out.inizio()
+        out.apri("p:FatturaElettronica", {
+            "versione": self.formato,
+            "xmlns:ds": "http://www.w3.org/2000/09/xmldsig#",
+            "xmlns:p": NAMESPACE_FATTURAPA,
+            "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+        })
+        self._header(out, data, progressivo)
+        self._body(out, data)
+        out.chiudi("p:FatturaElettronica")
+        out.fine()
+    
+    def genera(self, data: Dict, progressivo: str = "00001") -> bytes:
+        """Il documento FatturaPA completo in memoria: un errore non lascia file a metà"""
+        buffer = io.BytesIO()
+        self.scrivi(data, buffer, progressivo)
+        return buffer.getvalue()
+    
+    def _header(self, out: ScrittoreXML, data: Dict, progressivo: str):
+        azienda = data.get("azienda", {})
+        cliente = data.get("cliente", {})
+        paese_azienda, p_iva_azienda = paese_partita_iva(azienda.get("p_iva") or "")
+        
+        out.apri("FatturaElettronicaHeader")
+        
+        out.apri("DatiTrasmissione")
+        out.apri("IdTrasmittente")
+        out.elemento("IdPaese", paese_azienda)
+        out.elemento("IdCodice", p_iva_azienda or azienda.get("codice_fiscale", ""))
+        out.chiudi("IdTrasmittente")
+        out.elemento("ProgressivoInvio", progressivo)
+        out.elemento("FormatoTrasmissione", self.formato)
+        codice_destinatario = cliente.get("codice_destinatario") or ""
+        if codice_destinatario:
+            out.elemento("CodiceDestinatario", codice_destinatario)
+        else:
+            # Senza codice destinatario si recapita via PEC (o al cassetto fiscale)
+            out.elemento("CodiceDestinatario", "0000000")
+            out.elemento("PECDestinatario", cliente.get("pec", ""))
+        out.chiudi("DatiTrasmissione")
+        
+        out.apri("CedentePrestatore")
+        out.apri("DatiAnagrafici")
+        self._id_fiscale(out, azienda)
+        out.apri("Anagrafica")
+        out.elemento("Denominazione", azienda.get("ragione_sociale", ""))
+        out.chiudi("Anagrafica")
+        out.elemento("RegimeFiscale", self.regime_fiscale)
+        out.chiudi("DatiAnagrafici")
+        self._sede(out, azienda)
+        self._rea(out, azienda)
+        if azienda.get("telefono") or azienda.get("email"):
+            out.apri("Contatti")
+            out.elemento("Telefono", azienda.get("telefono", ""))
+            out.elemento("Email", azienda.get("email", ""))
+            out.chiudi("Contatti")
+        out.chiudi("CedentePrestatore")
+        
+        out.apri("CessionarioCommittente")
+        out.apri("DatiAnagrafici")
+        self._id_fiscale(out, cliente)
+        out.apri("Anagrafica")
+        out.elemento("Denominazione", cliente.get("ragione_sociale", ""))
+        out.chiudi("Anagrafica")
+        out.chiudi("DatiAnagrafici")
+        self._sede(out, cliente)
+        out.chiudi("CessionarioCommittente")
+        
+        out.chiudi("FatturaElettronicaHeader")
+    
+    def _id_fiscale(self, out: ScrittoreXML, soggetto: Dict):
+        paese, p_iva = paese_partita_iva(soggetto.get("p_iva") or "")
+        if p_iva:
+            out.apri("IdFiscaleIVA")
+            out.elemento("IdPaese", paese)
+            out.elemento("IdCodice", p_iva)
+            out.chiudi("IdFiscaleIVA")
+        out.elemento("CodiceFiscale", (soggetto.get("codice_fiscale") or "").replace(" ", "").upper())
+    
+    def _sede(self, out: ScrittoreXML, soggetto: Dict):
+        out.apri("Sede")
+        out.elemento("Indirizzo", soggetto.get("indirizzo", ""))
+        out.elemento("CAP", soggetto.get("cap", ""))
+        out.elemento("Comune", soggetto.get("citta", ""))
+        out.elemento("Provincia", (soggetto.get("provincia") or "").upper())
+        out.elemento("Nazione", "IT")
+        out.chiudi("Sede")
+    
+    def _rea(self, out: ScrittoreXML, azienda: Dict):
+        rea = (azienda.get("rea") or "").strip()
+        if not rea:
+            return
+        # Formato atteso "MI-123456"; senza sigla si usa la provincia della sede
+        ufficio, _, numero = rea.replace(" ", "").rpartition("-")
+        ufficio = (ufficio or azienda.get("provincia") or "").upper()
+        out.apri("IscrizioneREA")
+        out.elemento("Ufficio", ufficio)
+        out.elemento("NumeroREA", numero)
+        capitale = (azienda.get("capitale_sociale") or "").replace("€", "").strip()
+        if "," in capitale:
+            capitale = capitale.replace(".", "").replace(",", ".")
+        try:
+            out.elemento("CapitaleSociale", importo(capitale) if capitale else "")
+        except ValueError:
+            pass
+        out.elemento("StatoLiquidazione", "LN")
+        out.chiudi("IscrizioneREA")
+    
+    def _body(self, out: ScrittoreXML, data: Dict):
+        fattura = data.get("fattura", {})
+        banca = data.get("banca", {})
+        prodotti = data.get("prodotti", [])
+        
+        out.apri("FatturaElettronicaBody")
+        
+        out.apri("DatiGenerali")
+        out.apri("DatiGeneraliDocumento")
+        out.elemento("TipoDocumento", TIPI_DOCUMENTO.get(fattura.get("tipo") or "Fattura", "TD01"))
+        out.elemento("Divisa", "EUR")
+        out.elemento("Data", data_iso(fattura.get("data", "")) or "")
+        out.elemento("Numero", fattura.get("numero", ""))
+        riepilogo = riepiloga_fattura(prodotti)
+        totale = da_centesimi(riepilogo.totali()[2])
+        out.elemento("ImportoTotaleDocumento", importo(totale))
+        for blocco in dividi_testo(fattura.get("causale", "")):
+            out.elemento("Causale", blocco)
+        out.chiudi("DatiGeneraliDocumento")
+        out.chiudi("DatiGenerali")
+        
+        out.apri("DatiBeniServizi")
+        for i, p in enumerate(prodotti, 1):
+            aliquota = float(p.get("iva", 0))
+            out.apri("DettaglioLinee")
+            out.elemento("NumeroLinea", i)
+            out.elemento("Descrizione", (p.get("descrizione") or "")[:1000])
+            out.elemento("Quantita", decimale(p.get("quantita", 0)))
+            out.elemento("PrezzoUnitario", decimale(p.get("prezzo", 0)))
+            out.elemento("PrezzoTotale", importo(p.get("imponibile", 0)))
+            out.elemento("AliquotaIVA", importo(aliquota))
+            if aliquota == 0:
+                out.elemento("Natura", self.natura_esente)
+            out.chiudi("DettaglioLinee")
+        for voce in riepilogo.per_aliquota():
+            aliquota = voce["aliquota"]
+            out.apri("DatiRiepilogo")
+            out.elemento("AliquotaIVA", importo(aliquota))
+            if aliquota == 0:
+                out.elemento("Natura", self.natura_esente)
+            out.elemento("ImponibileImporto", importo(da_centesimi(voce["imponibile"])))
+            out.elemento("Imposta", importo(da_centesimi(voce["iva"])))
+            out.elemento("EsigibilitaIVA", "I")
+            out.chiudi("DatiRiepilogo")
+        out.chiudi("DatiBeniServizi")
+        
+        out.apri("DatiPagamento")
+        out.elemento("CondizioniPagamento", "TP02")
+        out.apri("DettaglioPagamento")
+        out.elemento("ModalitaPagamento", self.modalita_pagamento)
+        out.elemento("DataScadenzaPagamento", data_iso(fattura.get("scadenza", "")) or "")
+        out.elemento("ImportoPagamento", importo(totale))
+        out.elemento("IstitutoFinanziario", banca.get("nome", ""))
+        out.elemento("IBAN", (banca.get("iban") or "").replace(" ", "").upper())
+        out.chiudi("DettaglioPagamento")
+        out.chiudi("DatiPagamento")
+        
+        out.chiudi("FatturaElettronicaBody")
+
+
+def esporta_xml(data: Dict, path, progressivo: str = "00001", esportatore: Optional[EsportatoreFatturaPA] = None,
+                fsync: bool = True):
+    """Scrive una singola fattura FatturaPA su file, in modo atomico"""
+    esportatore = esportatore or EsportatoreFatturaPA()
+    scrivi_atomico(path, esportatore.genera(data, progressivo), fsync=fsync)
+
+
+def leggi_fatture(files: Iterable) -> Iterable:
+    """Legge i file fattura JSON uno alla volta"""
+    for path in files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                yield path, json.load(f), None
+        except (OSError, ValueError) as e:
+            yield path, None, e
+
+
+def esporta_batch(files: Iterable, destinazione, zip_file: bool = False, primo_progressivo: int = 1,
+                  esportatore: Optional[EsportatoreFatturaPA] = None) -> List[Dict]:
+    """Esporta molte fatture in FatturaPA, una alla volta
+    
+    destinazione è una cartella oppure, con zip_file=True, il file .zip da creare.
+    Ogni fattura viene letta, generata in memoria e scritta solo se completa:
+    una fattura che fallisce non lascia voci troncate né consuma il progressivo.
+    Restituisce un risultato per file: {"file", "ok", "output", "errore"}
+    """
+    esportatore = esportatore or EsportatoreFatturaPA()
+    destinazione = Path(destinazione)
+    risultati = []
+    archivio = None
+    if zip_file:
+        destinazione.parent.mkdir(parents=True, exist_ok=True)
+        archivio = zipfile.ZipFile(destinazione, 'w', compression=zipfile.ZIP_DEFLATED)
+    else:
+        destinazione.mkdir(parents=True, exist_ok=True)
+    
+    try:
+        n = primo_progressivo
+        for path, data, errore in leggi_fatture(files):
+            if errore is not None:
+                risultati.append({"file": str(path), "ok": False, "output": "", "errore": str(errore)})
+                continue
+            nome = nome_file_xml(data, progressivo_invio(n))
+            try:
+                if archivio is not None:
+                    archivio.writestr(nome, esportatore.genera(data, progressivo_invio(n)))
+                    output = f"{destinazione}:{nome}"
+                else:
+                    output = destinazione / nome
+                    esporta_xml(data, output, progressivo_invio(n), esportatore, fsync=False)
+                risultati.append({"file": str(path), "ok": True, "output": str(output), "errore": ""})
+                n += 1
+            except Exception as e:
+                risultati.append({"file": str(path), "ok": False, "output": "", "errore": str(e)})
+    finally:
+        if archivio is not None:
+            archivio.close()
+    return risultati
+
+
+def main(argv: Optional[List[str]] = None):
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Esporta le fatture JSON in formato FatturaPA (XML SDI)")
+    parser.add_argument("cartella", help="Cartella con i file fattura_*.json")
+    parser.add_argument("-o", "--output", required=True,
+                       help="Cartella di destinazione, oppure file .zip con --zip")
+    parser.add_argument("--zip", action="store_true", help="Scrive tutte le fatture in un unico archivio zip")
+    parser.add_argument("--progressivo", type=int,
+                       help="Primo progressivo di invio (default: il successivo all'ultimo usato)")
+    parser.add_argument("--regime", default="RF01", help="Regime fiscale del cedente (default: RF01)")
+    args = parser.parse_args(argv)
+    
+    contatore = ContatoreInvii()
+    primo = args.progressivo or contatore.prossimo()
+    risultati = esporta_batch(trova_fatture(args.cartella), args.output, args.zip, primo,
+                              EsportatoreFatturaPA(regime_fiscale=args.regime))
+    esportate = sum(1 for r in risultati if r["ok"])
+    if esportate:
+        contatore.registra(primo + esportate - 1)
+    errori = stampa_risultati(risultati)
+    sys.exit(1 if errori else 0)
+
+
+if __name__ == "__main__":
+    main()